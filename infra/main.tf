@@ -85,9 +85,13 @@ resource "google_storage_bucket" "documents" {
     }
   }
 
+  # Per-case objects (the layout before content-addressed storage) expire by age. Shared
+  # blobs/sha256/ objects can be younger in use than in age, so they are deleted by
+  # `blob_store.py gc` once the documents rows referencing them have expired
   lifecycle_rule {
     condition {
-      age = var.log_retention_days
+      age            = var.log_retention_days
+      matches_prefix = ["cases/"]
     }
     action {
       type = "Delete"
@@ -110,6 +114,23 @@ resource "google_storage_bucket_iam_member" "api_object_viewer" {
   member = "serviceAccount:${google_service_account.api_sa.email}"
 }
 
+# Uploads mark the shared blob they store or reuse as referenced (a metadata update that
+# blob_store.py gc checks before deleting); objectCreator cannot update existing objects,
+# and objectUser would also allow deleting them
+resource "google_project_iam_custom_role" "blob_referencer" {
+  project     = var.project_id
+  role_id     = "tytanBlobReferencer"
+  title       = "Tytan document blob referencer"
+  description = "Update metadata of stored document blobs"
+  permissions = ["storage.objects.update"]
+}
+
+resource "google_storage_bucket_iam_member" "api_blob_referencer" {
+  bucket = google_storage_bucket.documents.name
+  role   = google_project_iam_custom_role.blob_referencer.name
+  member = "serviceAccount:${google_service_account.api_sa.email}"
+}
+
 # Grant worker service account read-only access
 resource "google_storage_bucket_iam_member" "worker_object_viewer" {
   bucket = google_storage_bucket.documents.name
@@ -117,6 +138,32 @@ resource "google_storage_bucket_iam_member" "worker_object_viewer" {
   member = "serviceAccount:${google_service_account.worker_sa.email}"
 }
 
+# Shard checkpoints let a redelivered document resume instead of re-extracting
+resource "google_storage_bucket" "worker_checkpoints" {
+  name          = "${local.bucket_name}-worker-checkpoints"
+  location      = var.region
+  force_destroy = true
+
+  uniform_bucket_level_access = true
+
+  lifecycle_rule {
+    condition {
+      age = var.checkpoint_retention_days
+    }
+    action {
+      type = "Delete"
+    }
+  }
+
+  labels = local.common_labels
+}
+
+resource "google_storage_bucket_iam_member" "worker_checkpoint_admin" {
+  bucket = google_storage_bucket.worker_checkpoints.name
+  role   = "roles/storage.objectAdmin"
+  member = "serviceAccount:${google_service_account.worker_sa.email}"
+}
+
 # ====================================================================
 # BIGQUERY
 # ====================================================================
@@ -226,6 +273,40 @@ EOF
   labels = local.common_labels
 }
 
+# Table: extracted_fields_shadow (backfill re-extractions, compared against extracted_fields)
+resource "google_bigquery_table" "extracted_fields_shadow" {
+  dataset_id          = google_bigquery_dataset.lending_ops.dataset_id
+  table_id            = "extracted_fields_shadow"
+  deletion_protection = false
+
+  time_partitioning {
+    type          = "DAY"
+    field         = "extracted_at"
+    expiration_ms = 90 * 24 * 60 * 60 * 1000
+  }
+
+  clustering = ["backfill_run_id", "document_id"]
+
+  schema = <<EOF
+[
+  {"name": "extraction_id", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "case_id", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "document_id", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "field_name", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "value", "type": "STRING", "mode": "NULLABLE"},
+  {"name": "confidence", "type": "FLOAT64", "mode": "NULLABLE"},
+  {"name": "page_number", "type": "INT64", "mode": "NULLABLE"},
+  {"name": "bounding_box", "type": "JSON", "mode": "NULLABLE"},
+  {"name": "extracted_at", "type": "TIMESTAMP", "mode": "REQUIRED"},
+  {"name": "processor_id", "type": "STRING", "mode": "NULLABLE"},
+  {"name": "is_corrected", "type": "BOOLEAN", "mode": "NULLABLE"},
+  {"name": "backfill_run_id", "type": "STRING", "mode": "REQUIRED"}
+]
+EOF
+
+  labels = local.common_labels
+}
+
 # Table: field_corrections
 resource "google_bigquery_table" "field_corrections" {
   dataset_id          = google_bigquery_dataset.lending_ops.dataset_id
@@ -285,6 +366,113 @@ EOF
   labels = local.common_labels
 }
 
+# Table: status_events (append-only case/document status transitions)
+resource "google_bigquery_table" "status_events" {
+  dataset_id          = google_bigquery_dataset.lending_ops.dataset_id
+  table_id            = "status_events"
+  deletion_protection = var.environment == "prod"
+
+  time_partitioning {
+    type          = "DAY"
+    field         = "event_time"
+    expiration_ms = var.log_retention_days * 24 * 60 * 60 * 1000
+  }
+
+  clustering = ["entity_type", "entity_id"]
+
+  schema = <<EOF
+[
+  {"name": "event_id", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "entity_type", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "entity_id", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "case_id", "type": "STRING", "mode": "NULLABLE"},
+  {"name": "status", "type": "STRING", "mode": "REQUIRED"},
+  {"name": "event_time", "type": "TIMESTAMP", "mode": "REQUIRED"},
+  {"name": "source", "type": "STRING", "mode": "NULLABLE"},
+  {"name": "details", "type": "JSON", "mode": "NULLABLE"}
+]
+EOF
+
+  labels = local.common_labels
+}
+
+# View: latest status event per case
+resource "google_bigquery_table" "case_status_current" {
+  dataset_id          = google_bigquery_dataset.lending_ops.dataset_id
+  table_id            = "case_status_current"
+  deletion_protection = false
+
+  view {
+    use_legacy_sql = false
+    query          = <<EOF
+SELECT entity_id AS case_id, status, event_time AS status_updated_at
+FROM `${var.project_id}.${var.dataset_name}.status_events`
+WHERE entity_type = 'case'
+QUALIFY ROW_NUMBER() OVER (PARTITION BY entity_id ORDER BY event_time DESC) = 1
+EOF
+  }
+
+  depends_on = [google_bigquery_table.status_events]
+
+  labels = local.common_labels
+}
+
+# View: latest status event per document
+resource "google_bigquery_table" "document_status_current" {
+  dataset_id          = google_bigquery_dataset.lending_ops.dataset_id
+  table_id            = "document_status_current"
+  deletion_protection = false
+
+  view {
+    use_legacy_sql = false
+    query          = <<EOF
+SELECT entity_id AS document_id, case_id, status, event_time AS status_updated_at
+FROM `${var.project_id}.${var.dataset_name}.status_events`
+WHERE entity_type = 'document'
+QUALIFY ROW_NUMBER() OVER (PARTITION BY entity_id ORDER BY event_time DESC) = 1
+EOF
+  }
+
+  depends_on = [google_bigquery_table.status_events]
+
+  labels = local.common_labels
+}
+
+# Scheduled compaction: fold the latest status events back into cases/documents
+# (one MERGE per schedule tick instead of one UPDATE per transition). Both tables
+# take streaming inserts, and DML fails on rows still in the streaming buffer, so
+# rows inserted in the last 90 minutes are left for a later tick; until then
+# readers take their status from the *_status_current views.
+resource "google_bigquery_data_transfer_config" "status_compaction" {
+  display_name   = "tytan-status-compaction"
+  location       = var.region
+  data_source_id = "scheduled_query"
+  schedule       = var.status_compaction_schedule
+
+  params = {
+    query = <<EOF
+MERGE `${var.project_id}.${var.dataset_name}.cases` c
+USING `${var.project_id}.${var.dataset_name}.case_status_current` s
+ON c.case_id = s.case_id
+WHEN MATCHED AND s.status_updated_at > c.updated_at
+  AND c.created_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 90 MINUTE) THEN
+  UPDATE SET status = s.status, updated_at = s.status_updated_at;
+
+MERGE `${var.project_id}.${var.dataset_name}.documents` d
+USING `${var.project_id}.${var.dataset_name}.document_status_current` s
+ON d.document_id = s.document_id
+WHEN MATCHED AND d.status != s.status
+  AND d.uploaded_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 90 MINUTE) THEN
+  UPDATE SET status = s.status;
+EOF
+  }
+
+  depends_on = [
+    google_bigquery_table.case_status_current,
+    google_bigquery_table.document_status_current
+  ]
+}
+
 # Grant API service account BigQuery permissions
 resource "google_bigquery_dataset_iam_member" "api_data_editor" {
   dataset_id = google_bigquery_dataset.lending_ops.dataset_id
@@ -324,6 +512,70 @@ resource "google_project_iam_member" "webhook_job_user" {
   member  = "serviceAccount:${google_service_account.webhook_sa.email}"
 }
 
+# ====================================================================
+# FIRESTORE - CASE STATUS PROJECTION
+# ====================================================================
+
+# Low-latency per-case status read model (case_projection.py); BigQuery stays the system of record
+resource "google_firestore_database" "case_projection" {
+  name        = "(default)"
+  location_id = var.region
+  type        = "FIRESTORE_NATIVE"
+}
+
+# API (case created, document uploaded, reviews) and worker (case status) keep it current
+resource "google_project_iam_member" "api_firestore_user" {
+  project = var.project_id
+  role    = "roles/datastore.user"
+  member  = "serviceAccount:${google_service_account.api_sa.email}"
+}
+
+resource "google_project_iam_member" "worker_firestore_user" {
+  project = var.project_id
+  role    = "roles/datastore.user"
+  member  = "serviceAccount:${google_service_account.worker_sa.email}"
+}
+
+# Webhook reads the projection and writes the escalation outbox
+resource "google_project_iam_member" "webhook_firestore_user" {
+  project = var.project_id
+  role    = "roles/datastore.user"
+  member  = "serviceAccount:${google_service_account.webhook_sa.email}"
+}
+
+# Escalation outbox (services/dialogflow-webhook/escalation_outbox.py): due entries, and the oldest pending
+resource "google_firestore_index" "escalation_outbox_due" {
+  collection = "escalation_outbox"
+
+  fields {
+    field_path = "status"
+    order      = "ASCENDING"
+  }
+
+  fields {
+    field_path = "next_attempt_at"
+    order      = "ASCENDING"
+  }
+
+  depends_on = [google_firestore_database.case_projection]
+}
+
+resource "google_firestore_index" "escalation_outbox_age" {
+  collection = "escalation_outbox"
+
+  fields {
+    field_path = "status"
+    order      = "ASCENDING"
+  }
+
+  fields {
+    field_path = "created_at"
+    order      = "ASCENDING"
+  }
+
+  depends_on = [google_firestore_database.case_projection]
+}
+
 # ====================================================================
 # PUB/SUB
 # ====================================================================
@@ -335,8 +587,13 @@ resource "google_pubsub_topic" "document_uploaded" {
   labels = local.common_labels
 }
 
-# Subscription for Document AI worker
+# Subscription for Document AI worker (single queue, before the priority-lane cutover).
+# Its attributes must stay as originally created: filter and enable_message_ordering are
+# ForceNew, so changing them would replace the subscription and drop its backlog. It is
+# removed once worker_lanes_cutover is set (see "Priority Lane Cutover" in the runbook).
 resource "google_pubsub_subscription" "document_ai_worker" {
+  count = var.worker_lanes_cutover ? 0 : 1
+
   name  = "document-ai-worker-sub"
   topic = google_pubsub_topic.document_uploaded.name
 
@@ -355,6 +612,85 @@ resource "google_pubsub_subscription" "document_ai_worker" {
   labels = local.common_labels
 }
 
+moved {
+  from = google_pubsub_subscription.document_ai_worker
+  to   = google_pubsub_subscription.document_ai_worker[0]
+}
+
+# Standard lane; also takes messages without a priority attribute
+resource "google_pubsub_subscription" "document_ai_worker_standard" {
+  name  = "document-ai-worker-standard-sub"
+  topic = google_pubsub_topic.document_uploaded.name
+
+  ack_deadline_seconds = 600 # 10 minutes for Document AI processing
+
+  # Messages are published with ordering_key = case_id so each case's updates are serialized
+  enable_message_ordering = true
+
+  # Priority lanes: the API sets the "priority" attribute (interactive | standard | bulk)
+  filter = "NOT attributes:priority OR attributes.priority = \"standard\""
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.document_uploaded_dlq.id
+    max_delivery_attempts = 5
+  }
+
+  labels = local.common_labels
+}
+
+# Interactive lane: members waiting on a verification
+resource "google_pubsub_subscription" "document_ai_worker_interactive" {
+  name  = "document-ai-worker-interactive-sub"
+  topic = google_pubsub_topic.document_uploaded.name
+
+  ack_deadline_seconds = 600
+
+  enable_message_ordering = true
+
+  filter = "attributes.priority = \"interactive\""
+
+  retry_policy {
+    minimum_backoff = "5s"
+    maximum_backoff = "600s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.document_uploaded_dlq.id
+    max_delivery_attempts = 5
+  }
+
+  labels = local.common_labels
+}
+
+# Bulk lane: backfills and batch loads
+resource "google_pubsub_subscription" "document_ai_worker_bulk" {
+  name  = "document-ai-worker-bulk-sub"
+  topic = google_pubsub_topic.document_uploaded.name
+
+  ack_deadline_seconds = 600
+
+  enable_message_ordering = true
+
+  filter = "attributes.priority = \"bulk\""
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.document_uploaded_dlq.id
+    max_delivery_attempts = 5
+  }
+
+  labels = local.common_labels
+}
+
 # Dead Letter Queue topic
 resource "google_pubsub_topic" "document_uploaded_dlq" {
   name = "document-uploaded-dlq"
@@ -378,7 +714,32 @@ resource "google_pubsub_topic_iam_member" "api_publisher" {
 
 # Grant worker service account Pub/Sub subscriber permissions
 resource "google_pubsub_subscription_iam_member" "worker_subscriber" {
-  subscription = google_pubsub_subscription.document_ai_worker.name
+  count = var.worker_lanes_cutover ? 0 : 1
+
+  subscription = google_pubsub_subscription.document_ai_worker[0].name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:${google_service_account.worker_sa.email}"
+}
+
+moved {
+  from = google_pubsub_subscription_iam_member.worker_subscriber
+  to   = google_pubsub_subscription_iam_member.worker_subscriber[0]
+}
+
+resource "google_pubsub_subscription_iam_member" "worker_subscriber_standard" {
+  subscription = google_pubsub_subscription.document_ai_worker_standard.name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:${google_service_account.worker_sa.email}"
+}
+
+resource "google_pubsub_subscription_iam_member" "worker_subscriber_interactive" {
+  subscription = google_pubsub_subscription.document_ai_worker_interactive.name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:${google_service_account.worker_sa.email}"
+}
+
+resource "google_pubsub_subscription_iam_member" "worker_subscriber_bulk" {
+  subscription = google_pubsub_subscription.document_ai_worker_bulk.name
   role         = "roles/pubsub.subscriber"
   member       = "serviceAccount:${google_service_account.worker_sa.email}"
 }
@@ -451,11 +812,23 @@ resource "google_cloud_run_v2_service" "api" {
           cpu    = "2"
           memory = "2Gi"
         }
+        # Extra CPU while the 4 gunicorn workers import and warm up
+        startup_cpu_boost = true
       }
 
       ports {
         container_port = 8080
       }
+
+      # Traffic is routed once /warmup reports this instance's clients built and connected
+      startup_probe {
+        http_get {
+          path = "/warmup"
+        }
+        timeout_seconds   = 5
+        period_seconds    = 5
+        failure_threshold = 12
+      }
     }
   }
 
@@ -506,7 +879,23 @@ resource "google_cloud_run_v2_service" "worker" {
 
       env {
         name  = "SUBSCRIPTION_ID"
-        value = "document-ai-worker-sub"
+        value = var.worker_lanes_cutover ? google_pubsub_subscription.document_ai_worker_standard.name : google_pubsub_subscription.document_ai_worker[0].name
+      }
+
+      env {
+        name  = "CHECKPOINT_BUCKET"
+        value = google_storage_bucket.worker_checkpoints.name
+      }
+
+      env {
+        name  = "WORKER_DRAIN_GRACE_SECONDS"
+        value = "6"
+      }
+
+      env {
+        name  = "WORKER_LANES"
+        # Empty until the cutover: the worker reads SUBSCRIPTION_ID alone
+        value = var.worker_lanes_cutover ? "interactive:${google_pubsub_subscription.document_ai_worker_interactive.name}:${var.worker_lane_weights.interactive},standard:${google_pubsub_subscription.document_ai_worker_standard.name}:${var.worker_lane_weights.standard},bulk:${google_pubsub_subscription.document_ai_worker_bulk.name}:${var.worker_lane_weights.bulk}" : ""
       }
 
       env {
@@ -524,6 +913,11 @@ resource "google_cloud_run_v2_service" "worker" {
         value = var.docai_form_processor_id
       }
 
+      # Prometheus metrics (worker metrics.py)
+      ports {
+        container_port = 8080
+      }
+
       resources {
         limits = {
           cpu    = "2"
@@ -578,16 +972,34 @@ resource "google_cloud_run_v2_service" "webhook" {
         value = local.mock_mode
       }
 
+      env {
+        name  = "TICKET_ENDPOINT_URL"
+        value = var.ticket_endpoint_url
+      }
+
       resources {
         limits = {
           cpu    = "1"
           memory = "1Gi"
         }
+        # Keep CPU between requests for the background timeline statistics refresh and escalation dispatcher
+        cpu_idle          = false
+        startup_cpu_boost = true
       }
 
       ports {
         container_port = 8080
       }
+
+      # Traffic is routed once /warmup reports this instance's clients built and connected
+      startup_probe {
+        http_get {
+          path = "/warmup"
+        }
+        timeout_seconds   = 5
+        period_seconds    = 5
+        failure_threshold = 12
+      }
     }
   }
 
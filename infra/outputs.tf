@@ -31,8 +31,17 @@ output "pubsub_topic" {
 }
 
 output "pubsub_subscription" {
-  description = "Pub/Sub subscription for worker"
-  value       = google_pubsub_subscription.document_ai_worker.name
+  description = "Pub/Sub subscription for worker (the standard lane after the cutover)"
+  value       = var.worker_lanes_cutover ? google_pubsub_subscription.document_ai_worker_standard.name : google_pubsub_subscription.document_ai_worker[0].name
+}
+
+output "pubsub_lane_subscriptions" {
+  description = "Pub/Sub subscriptions for the worker priority lanes"
+  value = {
+    interactive = google_pubsub_subscription.document_ai_worker_interactive.name
+    standard    = google_pubsub_subscription.document_ai_worker_standard.name
+    bulk        = google_pubsub_subscription.document_ai_worker_bulk.name
+  }
 }
 
 output "api_service_account" {
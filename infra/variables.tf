@@ -71,6 +71,26 @@ variable "worker_max_instances" {
   default     = 50
 }
 
+variable "worker_lane_weights" {
+  description = "Weighted-fair share of worker concurrency per priority lane"
+  type = object({
+    interactive = number
+    standard    = number
+    bulk        = number
+  })
+  default = {
+    interactive = 8
+    standard    = 3
+    bulk        = 1
+  }
+}
+
+variable "worker_lanes_cutover" {
+  description = "Run the worker on the priority-lane subscriptions and remove the legacy document-ai-worker-sub; set only after the legacy backlog has drained (see the runbook)"
+  type        = bool
+  default     = false
+}
+
 variable "webhook_min_instances" {
   description = "Minimum instances for webhook service"
   type        = number
@@ -83,6 +103,12 @@ variable "webhook_max_instances" {
   default     = 20
 }
 
+variable "ticket_endpoint_url" {
+  description = "CRM batch ticket endpoint the webhook delivers callback requests to (empty: recorded, not delivered)"
+  type        = string
+  default     = ""
+}
+
 variable "enable_audit_logging" {
   description = "Enable comprehensive audit logging"
   type        = bool
@@ -94,3 +120,15 @@ variable "log_retention_days" {
   type        = number
   default     = 2555
 }
+
+variable "status_compaction_schedule" {
+  description = "Schedule for compacting status_events into the cases and documents tables"
+  type        = string
+  default     = "every 1 hours"
+}
+
+variable "checkpoint_retention_days" {
+  description = "Days to keep worker shard checkpoints that were not cleaned up after processing"
+  type        = number
+  default     = 7
+}
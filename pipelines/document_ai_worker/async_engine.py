@@ -0,0 +1,397 @@
+"""
+Tytan LendingOps & MemberAssist - Asyncio worker engine
+Pulls Pub/Sub messages and runs extraction and BigQuery writes as coroutines,
+so in-flight documents are bounded by semaphores instead of callback threads.
+Enable with WORKER_ENGINE=asyncio.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import functools
+from concurrent import futures
+from google.pubsub_v1 import SubscriberAsyncClient
+from google.cloud import documentai_v1 as documentai
+
+import cpu_stage
+import tracing
+import metrics
+import graceful_drain
+import structured_logging
+from extraction_results import ExtractionResult
+from preprocess import UnreadableDocumentError
+
+logger = structured_logging.get_logger(__name__)
+
+# Concurrency limits
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '200'))
+ASYNC_PULL_BATCH = int(os.getenv('ASYNC_PULL_BATCH', '50'))
+ASYNC_DOCAI_CONCURRENCY = int(os.getenv('ASYNC_DOCAI_CONCURRENCY', '64'))
+ASYNC_BQ_CONCURRENCY = int(os.getenv('ASYNC_BQ_CONCURRENCY', '32'))
+ASYNC_GCS_CONCURRENCY = int(os.getenv('ASYNC_GCS_CONCURRENCY', '32'))
+
+# Threads for the blocking BigQuery/GCS client calls; must cover both semaphores
+ASYNC_IO_THREADS = int(os.getenv('ASYNC_IO_THREADS', str(ASYNC_BQ_CONCURRENCY + ASYNC_GCS_CONCURRENCY)))
+
+# Lease management (subscription ack deadline is 600s)
+ASYNC_ACK_DEADLINE_SECONDS = int(os.getenv('ASYNC_ACK_DEADLINE_SECONDS', '600'))
+ASYNC_LEASE_INTERVAL_SECONDS = int(os.getenv('ASYNC_LEASE_INTERVAL_SECONDS', '60'))
+ASYNC_ACK_FLUSH_SECONDS = float(os.getenv('ASYNC_ACK_FLUSH_SECONDS', '0.1'))
+ASYNC_PULL_TIMEOUT_SECONDS = float(os.getenv('ASYNC_PULL_TIMEOUT_SECONDS', '30'))
+
+# modify_ack_deadline / acknowledge accept at most 2500 ack IDs per call
+MAX_ACK_IDS_PER_REQUEST = 2500
+
+
+class AsyncWorkerEngine:
+    """Pull-based worker that keeps up to ASYNC_MAX_IN_FLIGHT documents in flight"""
+
+    def __init__(self, worker, subscription_path):
+        # The running worker module: its clients, status writer and aggregator are shared
+        self.worker = worker
+        self.subscription_path = subscription_path
+        self.subscriber = None
+        self.docai_client = None
+
+        self.in_flight_slots = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+        self.docai_semaphore = asyncio.Semaphore(ASYNC_DOCAI_CONCURRENCY)
+        self.bq_semaphore = asyncio.Semaphore(ASYNC_BQ_CONCURRENCY)
+        self.gcs_semaphore = asyncio.Semaphore(ASYNC_GCS_CONCURRENCY)
+
+        self.in_flight = {}  # ack_id -> receive time
+        self.pending_acks = []
+        self.pending_nacks = []
+        self.tasks = set()
+        self.stopping = asyncio.Event()
+        self.signalled_at = None
+
+    async def run_bq(self, func, *args):
+        """Run a blocking BigQuery helper from worker.py under the BigQuery semaphore"""
+        async with self.bq_semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def run_gcs(self, func, *args):
+        """Run a blocking Cloud Storage helper from worker.py under the GCS semaphore"""
+        async with self.gcs_semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def wait_until_written(self, written):
+        """Wait for a message's status writes before acking it (see worker.settle_when_written)"""
+        await asyncio.wait_for(asyncio.wrap_future(written), self.worker.STATUS_ACK_TIMEOUT_SECONDS)
+
+    async def process_shard(self, blob, gcs_uri, processor_name, page_range, shared_document=None, prepared=None):
+        """Async counterpart of worker.process_shard"""
+        if page_range is None:
+            request = self.worker.build_whole_document_request(processor_name, gcs_uri, prepared)
+            page_offset = 0
+        else:
+            page_offset = page_range[0]
+            if shared_document is not None:
+                content = await asyncio.to_thread(cpu_stage.split_pdf_pages, shared_document, *page_range)
+            else:
+                content = await self.run_gcs(self.worker.read_pdf_page_range, blob, *page_range)
+            request = self.worker.build_process_request(processor_name, content=content)
+            del content
+
+        async with self.docai_semaphore:
+            with tracing.tracer.start_as_current_span("documentai.process_document", attributes={"processor": processor_name}), \
+                    metrics.stage("documentai.process_document", "documentai"):
+                result = await self.docai_client.process_document(request=request)
+
+        def parse():
+            # Inline parsing yields entities lazily, so the columns are built off the event loop too
+            return ExtractionResult.from_columns(cpu_stage.parse_entities(result.document, page_offset))
+
+        return await asyncio.to_thread(parse)
+
+    async def extract_fields(self, gcs_uri, processor_name, checkpoint=None):
+        """Async counterpart of worker.extract_fields_real, retrying only failed shards"""
+        blob = await self.run_gcs(self.worker.get_blob, gcs_uri)
+        if checkpoint:
+            checkpoint.bind(blob, processor_name)
+        prepared = await self.run_gcs(self.worker.prepare_document, blob)
+        is_pdf = prepared.mime_type == "application/pdf"
+        page_count = await self.run_gcs(self.worker.count_pdf_pages, blob) if is_pdf else None
+        shards = self.worker.plan_shards(page_count, self.worker.SHARD_PAGE_SIZE)
+
+        shared_document = None
+        if shards and cpu_stage.get_pool() is not None:
+            shared_document = await self.run_gcs(cpu_stage.SharedDocument.from_blob, blob)
+
+        try:
+            return await self.extract_shards(
+                blob, gcs_uri, processor_name, shards or [None], shared_document, checkpoint, prepared
+            )
+        finally:
+            if shared_document is not None:
+                shared_document.close()
+
+    async def extract_shards(
+        self, blob, gcs_uri, processor_name, shards, shared_document, checkpoint=None, prepared=None
+    ):
+        shard_results = await self.run_gcs(checkpoint.completed, shards) if checkpoint else {}
+        pending = [index for index in range(len(shards)) if index not in shard_results]
+        last_error = None
+
+        for attempt in range(self.worker.SHARD_MAX_RETRIES + 1):
+            if attempt > 0:
+                logger.warning(f"Retrying {len(pending)} failed shard(s), attempt {attempt + 1}")
+                await asyncio.sleep(2 ** (attempt - 1))
+
+            outcomes = await asyncio.gather(
+                *(
+                    self.process_shard(blob, gcs_uri, processor_name, shards[index], shared_document, prepared)
+                    for index in pending
+                ),
+                return_exceptions=True
+            )
+
+            failed = []
+            for index, outcome in zip(pending, outcomes):
+                if isinstance(outcome, Exception):
+                    logger.error(f"Shard {index} (pages {shards[index]}) failed: {outcome}")
+                    last_error = outcome
+                    failed.append(index)
+                else:
+                    shard_results[index] = outcome
+                    if checkpoint:
+                        await self.run_gcs(checkpoint.save, shards[index], outcome)
+
+            pending = failed
+            if not pending:
+                break
+
+        if pending:
+            raise Exception(f"{len(pending)} of {len(shards)} shards failed after retries: {last_error}")
+
+        return ExtractionResult.concatenate([shard_results.pop(index) for index in range(len(shards))])
+
+    async def process_message(self, received):
+        """Async counterpart of worker.process_message; always gives the message's slot back"""
+        try:
+            with tracing.message_span(received.message.attributes, received.message.publish_time), \
+                    metrics.in_flight.track_inprogress(), metrics.stage("message"):
+                await self.handle_message(received)
+        except Exception as e:
+            # Only reached if setting up the span or metrics fails; handle_message settles its own errors
+            logger.error(f"Unhandled exception processing message: {e}", exc_info=True)
+            self.pending_nacks.append(received.ack_id)
+        finally:
+            self.in_flight.pop(received.ack_id, None)
+            self.in_flight_slots.release()
+
+    async def handle_message(self, received):
+        ack_id = received.ack_id
+        try:
+            message_data = json.loads(received.message.data.decode('utf-8'))
+            case_id = message_data['case_id']
+            document_id = message_data['document_id']
+            gcs_uri = message_data['gcs_uri']
+            document_type = message_data.get('document_type', 'unknown')
+            tracing.annotate(case_id=case_id, document_id=document_id, document_type=document_type)
+
+            logger.info("Processing document", sample="worker.step", document_id=document_id, case_id=case_id)
+
+            # Check if already processed (idempotency); its status writes are replayed before the ack
+            recorded = None if self.worker.MOCK_MODE else await self.run_bq(
+                self.worker.load_recorded_extraction, case_id, document_id, message_data.get('timestamp')
+            )
+            if recorded is not None:
+                logger.info(f"Document {document_id} already processed, replaying its status")
+                _, written = await self.run_bq(
+                    functools.partial(self.worker.record_extraction, write_fields=False),
+                    case_id, document_id, document_type, recorded, None, message_data.get('loan_type')
+                )
+                await self.wait_until_written(written)
+                self.pending_acks.append(ack_id)
+                return
+
+            extracting_event = await self.run_bq(self.worker.update_document_status, document_id, "EXTRACTING", case_id)
+
+            checkpoint = self.worker.checkpoint_store.open(document_id)
+            if self.worker.MOCK_MODE:
+                logger.info("[MOCK] Extracting fields", gcs_uri=gcs_uri)
+                extraction = ExtractionResult.from_fields(self.worker.extract_fields_mock(document_type))
+                processor_id = "mock-processor"
+            else:
+                processor_id = self.worker.resolve_processor_name(document_type)
+                extraction = None
+                if message_data.get('blob_reused'):
+                    extraction = await self.run_bq(self.worker.find_prior_extraction, gcs_uri, document_id, processor_id)
+                if extraction is None:
+                    extraction = await self.extract_fields(gcs_uri, processor_id, checkpoint)
+
+            score, written = await self.run_bq(
+                self.worker.record_extraction, case_id, document_id, document_type, extraction, processor_id,
+                message_data.get('loan_type')
+            )
+            if checkpoint:
+                await self.run_gcs(checkpoint.discard)
+
+            # Acked only once its status writes are durable
+            await self.wait_until_written(self.worker.status_written([extracting_event], written))
+
+            logger.info(
+                "Successfully processed document", document_id=document_id, case_id=case_id,
+                weighted_confidence=round(score['weighted_confidence'], 2)
+            )
+            self.pending_acks.append(ack_id)
+            tracing.record_end_to_end(message_data, received.message.publish_time, "extracted")
+
+        except UnreadableDocumentError as e:
+            logger.warning(f"Skipping extraction for unreadable document {document_id}: {e}")
+            event = await self.run_bq(self.worker.update_document_status, document_id, "UNREADABLE", case_id)
+            try:
+                await self.wait_until_written(self.worker.status_written([event]))
+            except Exception as error:
+                logger.error(f"Status for unreadable document {document_id} not written, will retry: {error}")
+                self.pending_nacks.append(ack_id)
+                return
+            self.pending_acks.append(ack_id)
+            tracing.record_end_to_end(message_data, received.message.publish_time, "unreadable")
+
+        except Exception as e:
+            logger.error(f"Error processing message: {e}", exc_info=True)
+            self.pending_nacks.append(ack_id)
+
+    async def flush_acks(self):
+        """Send queued acks and nacks in batches"""
+        acks, self.pending_acks = self.pending_acks, []
+        nacks, self.pending_nacks = self.pending_nacks, []
+        metrics.count_settled(len(acks), len(nacks))
+
+        for start in range(0, len(acks), MAX_ACK_IDS_PER_REQUEST):
+            await self.subscriber.acknowledge(
+                subscription=self.subscription_path,
+                ack_ids=acks[start:start + MAX_ACK_IDS_PER_REQUEST]
+            )
+
+        # A zero deadline redelivers the message (subscription retry policy applies)
+        for start in range(0, len(nacks), MAX_ACK_IDS_PER_REQUEST):
+            await self.subscriber.modify_ack_deadline(
+                subscription=self.subscription_path,
+                ack_ids=nacks[start:start + MAX_ACK_IDS_PER_REQUEST],
+                ack_deadline_seconds=0
+            )
+
+    async def ack_loop(self):
+        while not (self.stopping.is_set() and not self.tasks):
+            await asyncio.sleep(ASYNC_ACK_FLUSH_SECONDS)
+            try:
+                await self.flush_acks()
+            except Exception as e:
+                logger.error(f"Failed to flush acks: {e}", exc_info=True)
+
+    async def extend_leases(self, ack_deadline_seconds):
+        """Push the ack deadline out for every message still being processed"""
+        ack_ids = list(self.in_flight)
+        for start in range(0, len(ack_ids), MAX_ACK_IDS_PER_REQUEST):
+            await self.subscriber.modify_ack_deadline(
+                subscription=self.subscription_path,
+                ack_ids=ack_ids[start:start + MAX_ACK_IDS_PER_REQUEST],
+                ack_deadline_seconds=ack_deadline_seconds
+            )
+        if ack_ids:
+            logger.info("Extended leases", sample="worker.step", messages=len(ack_ids))
+
+    async def lease_loop(self):
+        while not (self.stopping.is_set() and not self.tasks):
+            await asyncio.sleep(ASYNC_LEASE_INTERVAL_SECONDS)
+            try:
+                await self.extend_leases(ASYNC_ACK_DEADLINE_SECONDS)
+            except Exception as e:
+                logger.error(f"Failed to extend leases: {e}", exc_info=True)
+
+    async def pull_loop(self):
+        while not self.stopping.is_set():
+            # Wait for at least one free slot, then pull up to the number of free slots
+            await self.in_flight_slots.acquire()
+            free_slots = 1
+            while free_slots < ASYNC_PULL_BATCH and not self.in_flight_slots.locked():
+                await self.in_flight_slots.acquire()
+                free_slots += 1
+
+            try:
+                response = await self.subscriber.pull(
+                    subscription=self.subscription_path,
+                    max_messages=free_slots,
+                    timeout=ASYNC_PULL_TIMEOUT_SECONDS
+                )
+                received_messages = list(response.received_messages)
+            except Exception as e:
+                logger.warning(f"Pull failed: {e}")
+                received_messages = []
+                await asyncio.sleep(1)
+
+            # Return slots that were not used by this pull
+            for _ in range(free_slots - len(received_messages)):
+                self.in_flight_slots.release()
+
+            for received in received_messages:
+                metrics.observe_age(received.message.publish_time)
+                self.in_flight[received.ack_id] = time.monotonic()
+                task = asyncio.create_task(self.process_message(received))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def run(self):
+        asyncio.get_running_loop().set_default_executor(
+            futures.ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix='async-io')
+        )
+        self.subscriber = SubscriberAsyncClient()
+        if not self.worker.MOCK_MODE:
+            self.docai_client = documentai.DocumentProcessorServiceAsyncClient()
+
+        logger.info(
+            f"Async engine listening on {self.subscription_path} "
+            f"(max in flight: {ASYNC_MAX_IN_FLIGHT}, pull batch: {ASYNC_PULL_BATCH})"
+        )
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.on_signal)
+
+        background = [asyncio.create_task(self.ack_loop()), asyncio.create_task(self.lease_loop())]
+        pull_task = asyncio.create_task(self.pull_loop())
+        stop_task = asyncio.create_task(self.stopping.wait())
+        try:
+            await asyncio.wait([pull_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Stop pulling; in-flight messages get the drain grace period, and those
+            # waiting on their case status get it from the aggregator right away
+            self.stopping.set()
+            pull_task.cancel()
+            self.worker.case_aggregator.hurry()
+            stop_task.cancel()
+            await self.drain(graceful_drain.WORKER_DRAIN_GRACE_SECONDS)
+            await self.flush_acks()
+            for task in background:
+                task.cancel()
+
+    def on_signal(self):
+        if self.signalled_at is None:
+            self.signalled_at = time.monotonic()
+        self.stopping.set()
+
+    async def drain(self, grace_seconds):
+        """Let in-flight messages finish (lease_loop keeps extending them), then nack the rest"""
+        if not self.tasks:
+            return
+        logger.info(f"Waiting up to {grace_seconds}s for {len(self.tasks)} in-flight message(s)")
+        _, still_running = await asyncio.wait(set(self.tasks), timeout=grace_seconds)
+        if still_running:
+            self.pending_nacks.extend(self.in_flight)
+            logger.warning(f"Grace period over, nacking {len(self.in_flight)} in-flight message(s) for redelivery")
+            for task in still_running:
+                task.cancel()
+
+
+def main(worker):
+    """Run the engine until SIGTERM; returns the deadline for the rest of the shutdown"""
+    engine = AsyncWorkerEngine(worker, worker.subscription_path)
+    asyncio.run(engine.run())
+    logger.info("Shutting down worker...")
+    started = engine.signalled_at if engine.signalled_at is not None else time.monotonic()
+    return started + graceful_drain.WORKER_SHUTDOWN_BUDGET_SECONDS
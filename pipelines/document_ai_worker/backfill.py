@@ -0,0 +1,376 @@
+"""
+Tytan LendingOps & MemberAssist - Document AI reprocessing backfill
+Streams document rows from the documents table (filtered by upload date, document
+type or the processor that produced their current extraction), re-extracts them
+with the worker's extraction path under a rate limit, and writes the fields to a
+shadow table for comparison with extracted_fields. Progress is checkpointed so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python backfill.py --since 2024-01-01 --until 2024-07-01 --document-type paystub \
+        --processor projects/p/locations/us/processors/abc/processorVersions/pretrained-v2 --rate 5
+    python backfill.py --resume backfill-20240701T120000.json
+    python backfill.py --resume backfill-20240701T120000.json --retry-failed
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent import futures
+from collections import deque
+
+from google.cloud import bigquery
+
+import worker
+from extraction_results import ExtractionResult
+
+logger = logging.getLogger(__name__)
+
+SHADOW_TABLE_ID = os.getenv('BACKFILL_SHADOW_TABLE', 'extracted_fields_shadow')
+
+# Rows fetched per BigQuery result page while streaming documents
+BACKFILL_PAGE_SIZE = int(os.getenv('BACKFILL_PAGE_SIZE', '500'))
+
+
+class RateLimiter:
+    """Token bucket shared by the backfill threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BackfillCheckpoint:
+    """
+    Run settings plus a resume cursor, stored as JSON locally or at a gs:// URI
+
+    Documents complete out of order, so the cursor only advances past the longest
+    prefix (in query order) that has finished; anything after it is redone on resume.
+    """
+
+    def __init__(self, location, settings, cursor=None, processed=0, failed=None):
+        self.location = location
+        self.settings = settings
+        self.cursor = cursor  # [uploaded_at, document_id] of the last finished document in order
+        self.processed = processed
+        self.failed = failed or {}  # document_id -> error
+
+        self.lock = threading.Lock()
+        self.outstanding = deque()  # (cursor key, document_id) in query order
+        self.finished = set()
+
+    @classmethod
+    def load(cls, location):
+        data = json.loads(read_location(location))
+        return cls(location, data["settings"], data.get("cursor"), data.get("processed", 0), data.get("failed"))
+
+    def started(self, key, document_id):
+        with self.lock:
+            self.outstanding.append((key, document_id))
+
+    def done(self, document_id, error=None):
+        with self.lock:
+            self.finished.add(document_id)
+            self.processed += 1
+            if error is None:
+                self.failed.pop(document_id, None)
+            else:
+                self.failed[document_id] = str(error)[:500]
+
+            while self.outstanding and self.outstanding[0][1] in self.finished:
+                key, finished_id = self.outstanding.popleft()
+                self.finished.discard(finished_id)
+                self.cursor = key
+
+    def save(self):
+        with self.lock:
+            data = {
+                "settings": self.settings,
+                "cursor": self.cursor,
+                "processed": self.processed,
+                "failed": self.failed,
+                "saved_at": datetime.utcnow().isoformat() + "Z"
+            }
+        write_location(self.location, json.dumps(data, indent=2))
+
+
+def read_location(location):
+    if location.startswith("gs://"):
+        bucket_name, blob_name = location[5:].split("/", 1)
+        return worker.storage_client.bucket(bucket_name).blob(blob_name).download_as_bytes()
+    with open(location) as f:
+        return f.read()
+
+
+def write_location(location, content):
+    if location.startswith("gs://"):
+        bucket_name, blob_name = location[5:].split("/", 1)
+        worker.storage_client.bucket(bucket_name).blob(blob_name).upload_from_string(
+            content, content_type="application/json"
+        )
+        return
+    temporary = f"{location}.tmp"
+    with open(temporary, 'w') as f:
+        f.write(content)
+    os.replace(temporary, location)
+
+
+def build_document_query(settings, cursor=None, document_ids=None, count_only=False):
+    """Select documents matching the run's filters, in (uploaded_at, document_id) order"""
+    conditions = []
+    parameters = []
+
+    if document_ids is not None:
+        conditions.append("d.document_id IN UNNEST(@document_ids)")
+        parameters.append(bigquery.ArrayQueryParameter("document_ids", "STRING", document_ids))
+    if settings.get("since"):
+        conditions.append("d.uploaded_at >= @since")
+        parameters.append(bigquery.ScalarQueryParameter("since", "TIMESTAMP", settings["since"]))
+    if settings.get("until"):
+        conditions.append("d.uploaded_at < @until")
+        parameters.append(bigquery.ScalarQueryParameter("until", "TIMESTAMP", settings["until"]))
+    if settings.get("document_types"):
+        conditions.append("d.document_type IN UNNEST(@document_types)")
+        parameters.append(bigquery.ArrayQueryParameter("document_types", "STRING", settings["document_types"]))
+    if settings.get("source_processor_id"):
+        conditions.append(f"""d.document_id IN (
+                SELECT document_id FROM `{worker.PROJECT_ID}.{worker.DATASET_ID}.extracted_fields`
+                WHERE processor_id = @source_processor_id
+            )""")
+        parameters.append(bigquery.ScalarQueryParameter("source_processor_id", "STRING", settings["source_processor_id"]))
+    if cursor:
+        conditions.append("(d.uploaded_at > @cursor_at OR (d.uploaded_at = @cursor_at AND d.document_id > @cursor_id))")
+        parameters.append(bigquery.ScalarQueryParameter("cursor_at", "TIMESTAMP", cursor[0]))
+        parameters.append(bigquery.ScalarQueryParameter("cursor_id", "STRING", cursor[1]))
+
+    where = ("WHERE " + "\n              AND ".join(conditions)) if conditions else ""
+    if count_only:
+        select = "SELECT COUNT(*) AS count"
+        order = ""
+    else:
+        select = "SELECT d.document_id, d.case_id, d.document_type, d.gcs_uri, d.uploaded_at"
+        order = "ORDER BY d.uploaded_at, d.document_id"
+        if settings.get("limit"):
+            order += f"\n            LIMIT {int(settings['limit'])}"
+
+    query = f"""
+            {select}
+            FROM `{worker.PROJECT_ID}.{worker.DATASET_ID}.documents` d
+            {where}
+            {order}
+        """
+    return query, bigquery.QueryJobConfig(query_parameters=parameters)
+
+
+def stream_documents(settings, cursor=None, document_ids=None):
+    """Yield document rows page by page instead of materializing the result"""
+    query, job_config = build_document_query(settings, cursor, document_ids)
+    for row in worker.bq_client.query(query, job_config=job_config).result(page_size=BACKFILL_PAGE_SIZE):
+        yield dict(row)
+
+
+def count_documents(settings, cursor=None, document_ids=None):
+    query, job_config = build_document_query(settings, cursor, document_ids, count_only=True)
+    return list(worker.bq_client.query(query, job_config=job_config).result())[0]['count']
+
+
+def reextract_document(row, settings):
+    """Re-extract one document and write its fields to the shadow table; returns the field count"""
+    processor_name = settings.get("processor") or worker.resolve_processor_name(row['document_type'])
+
+    if worker.MOCK_MODE:
+        extraction = ExtractionResult.from_fields(worker.extract_fields_mock(row['document_type']))
+    else:
+        extraction = worker.extract_fields_real(row['gcs_uri'], processor_name)
+
+    rows_to_insert = extraction.to_bigquery_rows(
+        row['case_id'], row['document_id'], processor_name, datetime.utcnow().isoformat() + "Z"
+    )
+    for shadow_row in rows_to_insert:
+        shadow_row["backfill_run_id"] = settings["run_id"]
+
+    table_id = f"{worker.PROJECT_ID}.{worker.DATASET_ID}.{settings['shadow_table']}"
+    if worker.MOCK_MODE:
+        logger.info(f"[MOCK] Would insert {len(rows_to_insert)} rows into {table_id}")
+    elif rows_to_insert:
+        errors = worker.bq_client.insert_rows_json(
+            table_id, rows_to_insert, row_ids=[r["extraction_id"] for r in rows_to_insert]
+        )
+        if errors:
+            raise Exception(f"BigQuery insert failed: {errors}")
+
+    return len(rows_to_insert)
+
+
+class ProgressReporter:
+    def __init__(self, total, already_processed):
+        self.total = total
+        self.already_processed = already_processed
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.fields = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def record(self, fields=0, failed=False):
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.fields += fields
+            self.failed += int(failed)
+
+    def line(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            rate = self.completed / elapsed if elapsed else 0.0
+            remaining = max(0, self.total - self.completed)
+            eta = remaining / rate if rate else None
+            percent = 100.0 * self.completed / self.total if self.total else 100.0
+            return (
+                f"{self.completed}/{self.total} ({percent:.1f}%) this run, {self.already_processed} before resume | "
+                f"{rate:.2f} docs/s | {self.fields} fields | {self.failed} failed | {self.in_flight} in flight | "
+                f"ETA {format_duration(eta)}"
+            )
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def run_backfill(checkpoint, retry_failed=False, report_interval=10.0, checkpoint_interval=30.0):
+    settings = checkpoint.settings
+    document_ids = sorted(checkpoint.failed) if retry_failed else None
+    cursor = None if retry_failed else checkpoint.cursor
+
+    total = count_documents(settings, cursor, document_ids)
+    if settings.get("limit"):
+        total = min(total, int(settings["limit"]))
+    logger.info(f"Backfill {settings['run_id']}: {total} document(s) to re-extract into {settings['shadow_table']}")
+
+    limiter = RateLimiter(settings["rate"])
+    progress = ProgressReporter(total, checkpoint.processed)
+    # Bounded like the worker's flow control: never more than `concurrency` documents leased
+    slots = threading.BoundedSemaphore(settings["concurrency"])
+
+    def process(row):
+        try:
+            fields = reextract_document(row, settings)
+            progress.record(fields)
+            checkpoint.done(row['document_id'])
+        except Exception as e:
+            logger.error(f"Backfill failed for document {row['document_id']}: {e}")
+            progress.record(failed=True)
+            checkpoint.done(row['document_id'], error=e)
+        finally:
+            slots.release()
+
+    last_report = last_save = time.monotonic()
+    with futures.ThreadPoolExecutor(max_workers=settings["concurrency"], thread_name_prefix='backfill') as pool:
+        for submitted, row in enumerate(stream_documents(settings, cursor, document_ids)):
+            if settings.get("limit") and submitted >= int(settings["limit"]):
+                break
+            limiter.acquire()
+            slots.acquire()
+            progress.begin()
+            uploaded_at = row['uploaded_at']
+            key = [uploaded_at.isoformat() if hasattr(uploaded_at, 'isoformat') else uploaded_at, row['document_id']]
+            if not retry_failed:
+                checkpoint.started(key, row['document_id'])
+            pool.submit(process, row)
+
+            now = time.monotonic()
+            if now - last_report >= report_interval:
+                logger.info(progress.line())
+                last_report = now
+            if now - last_save >= checkpoint_interval:
+                checkpoint.save()
+                last_save = now
+
+    checkpoint.save()
+    logger.info(progress.line())
+    logger.info(f"Backfill {settings['run_id']} finished; checkpoint at {checkpoint.location}")
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-extract documents into a shadow table for processor upgrades")
+    parser.add_argument('--since', help="Earliest uploaded_at (inclusive), e.g. 2024-01-01")
+    parser.add_argument('--until', help="Latest uploaded_at (exclusive)")
+    parser.add_argument('--document-type', action='append', dest='document_types', help="Repeatable")
+    parser.add_argument('--source-processor-id', help="Only documents whose current extraction used this processor")
+    parser.add_argument('--processor', help="Processor (version) to re-extract with; defaults to the worker's mapping")
+    parser.add_argument('--rate', type=float, default=2.0, help="Documents started per second")
+    parser.add_argument('--concurrency', type=int, default=8, help="Documents in flight")
+    parser.add_argument('--limit', type=int, help="Stop after this many documents (per invocation)")
+    parser.add_argument('--shadow-table', default=SHADOW_TABLE_ID)
+    parser.add_argument('--run-id', help="Defaults to a UTC timestamp")
+    parser.add_argument('--checkpoint', help="Checkpoint file or gs:// URI (default backfill-<run id>.json)")
+    parser.add_argument('--resume', help="Resume from this checkpoint; filters come from the checkpoint")
+    parser.add_argument('--retry-failed', action='store_true', help="With --resume, re-run only failed documents")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument('--dry-run', action='store_true', help="Only count matching documents")
+    args = parser.parse_args()
+
+    if args.resume:
+        checkpoint = BackfillCheckpoint.load(args.resume)
+        logger.info(f"Resuming backfill {checkpoint.settings['run_id']} after {checkpoint.cursor}")
+    else:
+        run_id = args.run_id or datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        settings = {
+            "run_id": run_id,
+            "since": args.since,
+            "until": args.until,
+            "document_types": args.document_types,
+            "source_processor_id": args.source_processor_id,
+            "processor": args.processor,
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "limit": args.limit,
+            "shadow_table": args.shadow_table
+        }
+        checkpoint = BackfillCheckpoint(args.checkpoint or f"backfill-{run_id}.json", settings)
+
+    if args.dry_run:
+        print(f"{count_documents(checkpoint.settings, checkpoint.cursor)} document(s) match")
+        return
+
+    try:
+        run_backfill(checkpoint, retry_failed=args.retry_failed, report_interval=args.report_interval)
+    except KeyboardInterrupt:
+        checkpoint.save()
+        logger.info(f"Interrupted; resume with: python backfill.py --resume {checkpoint.location}")
+        sys.exit(130)
+    finally:
+        worker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
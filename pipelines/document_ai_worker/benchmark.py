@@ -0,0 +1,652 @@
+"""
+Tytan LendingOps & MemberAssist - Document AI worker throughput benchmark
+Feeds synthetic Pub/Sub messages through worker.callback with fake Document AI,
+Cloud Storage and BigQuery backends, sweeps concurrency and shard settings, and
+reports throughput, per-stage latency percentiles and memory.
+
+With --lanes, runs a bulk backlog plus a trickle of interactive messages through
+the priority lane scheduler instead and reports queue lag per traffic class.
+
+With --sigterm-after, sends the process SIGTERM mid-run, lets the worker drain,
+then redelivers everything that was not acked to a "new instance" and reports how
+many Document AI pages the shard checkpoints saved.
+
+Usage:
+    python benchmark.py --messages 500 --concurrency 8,16,32 --shard-page-size 5,10
+    python benchmark.py --docai-latency-ms 2500 --docai-error-rate 0.05 --output report.json
+    python benchmark.py --lanes interactive:8,bulk:1 --messages 400 --interactive-messages 40
+    python benchmark.py --lanes fifo:1 --messages 400 --interactive-messages 40   # baseline
+    python benchmark.py --sigterm-after 3 --drain-grace 2 --messages 100 --page-mix 60:1
+    python benchmark.py --sigterm-after 3 --drain-grace 2 --messages 100 --page-mix 60:1 --no-checkpoints
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import signal
+import logging
+import argparse
+import threading
+import itertools
+from concurrent import futures
+from collections import defaultdict
+from datetime import datetime, timezone
+from unittest import mock
+
+# Stages timed by wrapping the worker functions of the same name
+STAGES = [
+    "load_recorded_extraction",
+    "update_document_status",
+    "extract_fields_real",
+    "write_extracted_fields",
+    "update_case_status"
+]
+
+
+class BackendProfile:
+    """Latency and error behaviour of one fake backend"""
+
+    def __init__(self, latency_ms, jitter, error_rate):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def wait(self, scale=1.0):
+        if self.latency_ms > 0:
+            latency = random.lognormvariate(0, self.jitter) * self.latency_ms * scale
+            time.sleep(latency / 1000)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Injected backend error")
+
+
+class FakeBlob:
+    def __init__(self, name, content, profile):
+        self.name = name
+        self.content = content
+        self.size = len(content)
+        self.content_type = "application/pdf"
+        self.generation = 1
+        self.profile = profile
+
+    def open(self, mode='rb', chunk_size=None):
+        self.profile.wait()
+        return io.BytesIO(self.content)
+
+    def download_to_file(self, file_obj):
+        self.profile.wait()
+        file_obj.write(self.content)
+
+    def download_as_bytes(self, start=None, end=None):
+        self.profile.wait()
+        return self.content[start or 0:None if end is None else end + 1]
+
+
+class FakeStoredBlob:
+    """Object written by the worker itself (shard checkpoints)"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.client.profile.wait()
+        with self.client.lock:
+            self.client.objects[self.name] = data.encode('utf-8') if isinstance(data, str) else data
+
+    def download_as_bytes(self):
+        self.client.profile.wait()
+        return self.client.objects[self.name]
+
+    def delete(self):
+        self.client.profile.wait()
+        with self.client.lock:
+            self.client.objects.pop(self.name, None)
+
+
+class FakeStorageClient:
+    """Serves synthetic PDFs whose page count is encoded in the blob name"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.pdf_cache = {}
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def synthetic_pdf(self, page_count):
+        from pypdf import PdfWriter
+
+        with self.lock:
+            if page_count not in self.pdf_cache:
+                writer = PdfWriter()
+                for _ in range(page_count):
+                    writer.add_blank_page(612, 792)
+                buffer = io.BytesIO()
+                writer.write(buffer)
+                self.pdf_cache[page_count] = buffer.getvalue()
+            return self.pdf_cache[page_count]
+
+    def bucket(self, bucket_name):
+        return self
+
+    def blob(self, blob_name):
+        return FakeStoredBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        self.profile.wait()
+        if blob_name.endswith('.pdf'):
+            page_count = int(blob_name.rsplit('-p', 1)[1].split('.')[0])
+            return FakeBlob(blob_name, self.synthetic_pdf(page_count), self.profile)
+        with self.lock:
+            return FakeStoredBlob(self, blob_name) if blob_name in self.objects else None
+
+
+class FakeDocumentAIClient:
+    """Returns entity-only documents; latency scales with the pages in the request"""
+
+    def __init__(self, profile, fields_mean, fields_stddev, pages_for_request):
+        self.profile = profile
+        self.fields_mean = fields_mean
+        self.fields_stddev = fields_stddev
+        self.pages_for_request = pages_for_request
+        self.pages_processed = 0
+        self.terminated = False
+        self.lock = threading.Lock()
+
+    def process_document(self, request):
+        from google.cloud import documentai_v1 as documentai
+
+        pages = self.pages_for_request(request)
+        self.profile.wait(scale=max(1.0, pages / 5))
+        if self.terminated:
+            raise RuntimeError("Instance terminated")
+        with self.lock:
+            self.pages_processed += pages
+
+        field_count = max(1, int(random.gauss(self.fields_mean, self.fields_stddev)))
+        entities = [
+            documentai.Document.Entity(
+                type_=f"field_{index % 40}",
+                mention_text=f"value-{index}",
+                confidence=random.uniform(0.6, 1.0),
+                page_anchor=documentai.Document.PageAnchor(page_refs=[
+                    documentai.Document.PageAnchor.PageRef(
+                        page=index % pages,
+                        bounding_poly=documentai.BoundingPoly(vertices=[
+                            documentai.Vertex(x=10, y=10), documentai.Vertex(x=200, y=10),
+                            documentai.Vertex(x=200, y=40), documentai.Vertex(x=10, y=40)
+                        ])
+                    )
+                ])
+            )
+            for index in range(field_count)
+        ]
+        return documentai.ProcessResponse(document=documentai.Document(entities=entities))
+
+
+class FakeQueryJob:
+    def __init__(self, profile, rows):
+        self.profile = profile
+        self.rows = rows
+
+    def result(self):
+        self.profile.wait()
+        return self.rows
+
+
+class FakeBigQueryClient:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def query(self, query, job_config=None):
+        # Idempotency checks see nothing processed; case lookups find no prior documents
+        rows = []
+        return FakeQueryJob(self.profile, rows)
+
+    def insert_rows_json(self, table_id, rows, **kwargs):
+        try:
+            self.profile.wait()
+        except RuntimeError as e:
+            return [{"errors": str(e)}]
+        return []
+
+
+class FakeMessage:
+    def __init__(self, data, published_at, results, traffic_class=None):
+        self.data = data
+        self.published_at = published_at
+        self.publish_time = datetime.now(timezone.utc)
+        self.results = results
+        self.traffic_class = traffic_class
+        self.outcome = None
+
+    def ack(self):
+        self.settle("ack")
+
+    def nack(self):
+        self.settle("nack")
+
+    def settle(self, outcome):
+        # Like Pub/Sub, only the first ack/nack for a delivery counts
+        if self.outcome is None:
+            self.outcome = outcome
+            self.results.record_outcome(outcome, time.monotonic() - self.published_at, self.traffic_class)
+
+
+class FakeSubscriber:
+    """Stands in for SubscriberClient.subscribe: the benchmark delivers messages itself"""
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def subscribe(self, subscription_path, callback, flow_control=None):
+        self.callbacks[subscription_path] = callback
+        return futures.Future()
+
+
+class RunResults:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_latencies = defaultdict(list)
+        self.end_to_end = []
+        self.outcomes = defaultdict(int)
+        self.class_latencies = defaultdict(list)
+
+    def record_stage(self, stage, seconds):
+        with self.lock:
+            self.stage_latencies[stage].append(seconds)
+
+    def record_outcome(self, outcome, seconds, traffic_class=None):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.end_to_end.append(seconds)
+            if traffic_class:
+                self.class_latencies[traffic_class].append(seconds)
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": pick(1.0), "count": len(ordered)}
+
+
+def parse_page_mix(spec):
+    """Parse "pages:weight,..." e.g. "1:0.6,4:0.3,60:0.1" """
+    mix = []
+    for part in spec.split(','):
+        pages, weight = part.split(':')
+        mix.append((int(pages), float(weight)))
+    return mix
+
+
+def load_worker(args):
+    """Import worker.py with fake backends in place of the GCP clients"""
+    os.environ['MOCK_MODE'] = 'false'
+    # Keep case status projection writes in memory rather than in Firestore
+    os.environ['CASE_PROJECTION_BACKEND'] = 'sqlite'
+    os.environ['CASE_PROJECTION_SQLITE_PATH'] = ':memory:'
+    os.environ.setdefault('DOCAI_IDENTITY_PROCESSOR', 'projects/bench/locations/us/processors/identity')
+    os.environ.setdefault('DOCAI_FORM_PROCESSOR', 'projects/bench/locations/us/processors/form')
+    os.environ.setdefault('CHECKPOINT_BUCKET', 'bench-checkpoints')
+
+    gcs_profile = BackendProfile(args.gcs_latency_ms, args.latency_jitter, args.gcs_error_rate)
+    bq_profile = BackendProfile(args.bq_latency_ms, args.latency_jitter, args.bq_error_rate)
+    docai_profile = BackendProfile(args.docai_latency_ms, args.latency_jitter, args.docai_error_rate)
+
+    def pages_for_request(request):
+        if request.raw_document.content:
+            from pypdf import PdfReader
+            return len(PdfReader(io.BytesIO(request.raw_document.content)).pages)
+        return int(request.gcs_document.gcs_uri.rsplit('-p', 1)[1].split('.')[0])
+
+    storage_fake = FakeStorageClient(gcs_profile)
+    bq_fake = FakeBigQueryClient(bq_profile)
+    docai_fake = FakeDocumentAIClient(docai_profile, args.fields_mean, args.fields_stddev, pages_for_request)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import worker
+
+    # Clients are built on first use, so the fakes are handed over before anything needs one
+    worker.subscriber.use(mock.MagicMock())
+    worker.bq_client.use(bq_fake)
+    worker.storage_client.use(storage_fake)
+    worker.docai_client.use(docai_fake)
+
+    return worker
+
+
+def instrument(worker, results_ref):
+    """Wrap worker stage functions so each call is timed into the current run"""
+    for stage in STAGES:
+        original = getattr(worker, stage)
+
+        def timed(*args, _original=original, _stage=stage, **kwargs):
+            started = time.monotonic()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                results_ref[0].record_stage(_stage, time.monotonic() - started)
+
+        setattr(worker, stage, timed)
+
+
+def run_once(worker, results_ref, args, concurrency, shard_page_size, shard_workers):
+    results = RunResults()
+    results_ref[0] = results
+
+    worker.SHARD_PAGE_SIZE = shard_page_size
+    worker.shard_executor = futures.ThreadPoolExecutor(max_workers=shard_workers, thread_name_prefix='docai-shard')
+
+    page_mix = parse_page_mix(args.page_mix)
+    page_choices = [pages for pages, _ in page_mix]
+    page_weights = [weight for _, weight in page_mix]
+
+    _, peak_before = worker.get_memory_usage_mb()
+    started = time.monotonic()
+
+    # The callback pool stands in for the subscriber's scheduler threads (flow control max)
+    messages = []
+    with futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-callback') as pool:
+        for index in range(args.messages):
+            page_count = random.choices(page_choices, page_weights)[0]
+            payload = build_payload(
+                index, page_count, random.choice(["drivers_license", "paystub", "bank_statement_60days"])
+            )
+            message = FakeMessage(json.dumps(payload).encode('utf-8'), time.monotonic(), results)
+            messages.append(message)
+            pool.submit(worker.callback, message)
+    # Acks follow the messages' status writes, after the callbacks return
+    wait_for_outcomes(messages)
+
+    elapsed = time.monotonic() - started
+    worker.shard_executor.shutdown(wait=True)
+    rss_mb, peak_after = worker.get_memory_usage_mb()
+
+    return {
+        "concurrency": concurrency,
+        "shard_page_size": shard_page_size,
+        "shard_max_workers": shard_workers,
+        "messages": args.messages,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_docs_per_second": round(args.messages / elapsed, 2) if elapsed else None,
+        "acked": results.outcomes["ack"],
+        "nacked": results.outcomes["nack"],
+        "end_to_end_latency": percentiles(results.end_to_end),
+        "stage_latency": {stage: percentiles(results.stage_latencies[stage]) for stage in STAGES},
+        "memory_mb": {"rss": round(rss_mb, 1), "peak_rss": round(peak_after, 1), "peak_growth": round(peak_after - peak_before, 1)}
+    }
+
+
+def build_payload(index, page_count, document_type):
+    return {
+        "case_id": f"CU-BENCH-{index % 1000:05d}",
+        "document_id": f"doc-bench-{index:06d}",
+        "gcs_uri": f"gs://bench-bucket/cases/bench/doc-{index:06d}-p{page_count}.pdf",
+        "document_type": document_type
+    }
+
+
+def run_lanes(worker, results_ref, args):
+    """Bulk backlog enqueued up front, interactive messages trickling in while it drains"""
+    import lane_scheduler
+    import metrics
+
+    results = RunResults()
+    results_ref[0] = results
+
+    lane_weights = [part.split(':') for part in args.lanes.split(',')]
+    lanes = [(name, f"projects/bench/subscriptions/{name}", int(weight)) for name, weight in lane_weights]
+    lane_names = [name for name, _, _ in lanes]
+
+    def lane_for(traffic_class):
+        # Traffic without a lane of its own shares the first lane (e.g. --lanes fifo:1)
+        return lanes[lane_names.index(traffic_class)] if traffic_class in lane_names else lanes[0]
+
+    lane_scheduler.LANE_WORKER_THREADS = int(args.concurrency.split(',')[0])
+    subscriber = FakeSubscriber()
+    scheduler = lane_scheduler.LaneScheduler(subscriber, lanes, handler=worker.callback, on_receive=metrics.received)
+    scheduler.start()
+
+    page_mix = parse_page_mix(args.page_mix)
+    page_choices = [pages for pages, _ in page_mix]
+    page_weights = [weight for _, weight in page_mix]
+
+    def deliver(index, traffic_class, page_count, document_type):
+        payload = build_payload(index, page_count, document_type)
+        message = FakeMessage(json.dumps(payload).encode('utf-8'), time.monotonic(), results, traffic_class)
+        subscriber.callbacks[lane_for(traffic_class)[1]](message)
+
+    started = time.monotonic()
+    for index in range(args.messages):
+        page_count = random.choices(page_choices, page_weights)[0]
+        deliver(index, "bulk", page_count, random.choice(["paystub", "bank_statement_60days"]))
+
+    for index in range(args.interactive_messages):
+        time.sleep(args.interactive_interval)
+        deliver(args.messages + index, "interactive", 1, "drivers_license")
+
+    total = args.messages + args.interactive_messages
+    while sum(results.outcomes.values()) < total:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    lane_metrics = scheduler.lane_metrics()
+    scheduler.stop()
+
+    return {
+        "lanes": args.lanes,
+        "concurrency": lane_scheduler.LANE_WORKER_THREADS,
+        "messages": total,
+        "elapsed_seconds": round(elapsed, 2),
+        "acked": results.outcomes["ack"],
+        "nacked": results.outcomes["nack"],
+        "latency_by_class": {name: percentiles(samples) for name, samples in results.class_latencies.items()},
+        "lane_metrics": lane_metrics
+    }
+
+
+def wait_for_outcomes(messages, timeout=30):
+    deadline = time.monotonic() + timeout
+    while any(message.outcome is None for message in messages) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_drain(worker, results_ref, args):
+    """SIGTERM mid-run, drain, then redeliver unacked messages to a fresh instance"""
+    docai = worker.docai_client
+    worker.checkpoint_store.enabled = not args.no_checkpoints
+    concurrency = int(args.concurrency.split(',')[0])
+
+    page_mix = parse_page_mix(args.page_mix)
+    page_choices = [pages for pages, _ in page_mix]
+    page_weights = [weight for _, weight in page_mix]
+    payloads = [
+        build_payload(index, random.choices(page_choices, page_weights)[0], "bank_statement_60days")
+        for index in range(args.messages)
+    ]
+
+    def pages_of(payload):
+        return int(payload["gcs_uri"].rsplit('-p', 1)[1].split('.')[0])
+
+    # First instance: streaming pull delivers everything, SIGTERM arrives mid-run
+    first = RunResults()
+    results_ref[0] = first
+    controller = worker.drain_controller
+    controller.install()
+    handler = controller.wrap(worker.callback)
+
+    messages = [FakeMessage(json.dumps(payload).encode('utf-8'), time.monotonic(), first) for payload in payloads]
+    pool = futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-callback')
+    for message in messages:
+        pool.submit(handler, message)
+
+    threading.Timer(args.sigterm_after, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    controller.wait_for_signal(futures.Future())
+    signalled_at = time.monotonic()
+    nacked_in_flight = controller.drain(args.drain_grace)
+    drain_seconds = time.monotonic() - signalled_at
+
+    # The platform kills the instance after the grace period
+    docai.terminated = True
+    pool.shutdown(wait=True)
+    docai.terminated = False
+    first_pages = docai.pages_processed
+
+    # Second instance receives the redeliveries
+    redelivered = [payload for payload, message in zip(payloads, messages) if message.outcome != "ack"]
+    second = RunResults()
+    results_ref[0] = second
+    docai.pages_processed = 0
+    started = time.monotonic()
+    redeliveries = [FakeMessage(json.dumps(payload).encode('utf-8'), time.monotonic(), second) for payload in redelivered]
+    with futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-callback') as pool:
+        for message in redeliveries:
+            pool.submit(worker.callback, message)
+    # Acks follow the messages' status writes, after the callbacks return
+    worker.case_aggregator.flush()
+    wait_for_outcomes(redeliveries)
+    redelivery_seconds = time.monotonic() - started
+
+    redelivered_pages = sum(pages_of(payload) for payload in redelivered)
+    return {
+        "checkpoints": not args.no_checkpoints,
+        "messages": args.messages,
+        "concurrency": concurrency,
+        "drain_seconds": round(drain_seconds, 2),
+        "first_instance": {
+            "acked": first.outcomes["ack"],
+            "nacked": first.outcomes["nack"],
+            "nacked_in_flight_after_grace": nacked_in_flight,
+            "docai_pages": first_pages
+        },
+        "redelivery": {
+            "messages": len(redelivered),
+            "acked": second.outcomes["ack"],
+            "elapsed_seconds": round(redelivery_seconds, 2),
+            "pages_in_documents": redelivered_pages,
+            "docai_pages": docai.pages_processed,
+            "pages_saved": redelivered_pages - docai.pages_processed
+        },
+        "checkpoints_left": len(worker.storage_client.objects)
+    }
+
+
+def print_drain_summary(run):
+    first, redelivery = run["first_instance"], run["redelivery"]
+    print(f"checkpoints={'on' if run['checkpoints'] else 'off'} messages={run['messages']} drain={run['drain_seconds']}s")
+    print(
+        f"first instance: acked={first['acked']} nacked={first['nacked']} "
+        f"(in flight at grace end: {first['nacked_in_flight_after_grace']}) docai pages={first['docai_pages']}"
+    )
+    print(
+        f"redelivery: messages={redelivery['messages']} acked={redelivery['acked']} "
+        f"pages in documents={redelivery['pages_in_documents']} docai pages={redelivery['docai_pages']} "
+        f"saved={redelivery['pages_saved']}"
+    )
+    print(f"checkpoints left behind: {run['checkpoints_left']}")
+
+
+def print_lane_summary(run):
+    print(f"lanes={run['lanes']} concurrency={run['concurrency']} elapsed={run['elapsed_seconds']}s nack={run['nacked']}")
+    header = f"{'class':>12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, latency in sorted(run["latency_by_class"].items()):
+        print(f"{name:>12} {latency['count']:>6} {latency['p50_ms']:>9} {latency['p95_ms']:>9} {latency['max_ms']:>9}")
+
+
+def print_summary(runs):
+    header = f"{'conc':>5} {'shard':>5} {'swrk':>5} {'docs/s':>8} {'e2e p50':>9} {'e2e p95':>9} {'e2e p99':>9} {'nack':>5} {'peak MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for run in runs:
+        e2e = run["end_to_end_latency"]
+        print(
+            f"{run['concurrency']:>5} {run['shard_page_size']:>5} {run['shard_max_workers']:>5} "
+            f"{run['throughput_docs_per_second']:>8} {e2e.get('p50_ms', 0):>9} {e2e.get('p95_ms', 0):>9} "
+            f"{e2e.get('p99_ms', 0):>9} {run['nacked']:>5} {run['memory_mb']['peak_rss']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the Document AI worker")
+    parser.add_argument('--messages', type=int, default=200, help="Messages per run")
+    parser.add_argument('--concurrency', default='4,8,16,32', help="Comma-separated callback concurrency levels")
+    parser.add_argument('--shard-page-size', default='10', help="Comma-separated SHARD_PAGE_SIZE values")
+    parser.add_argument('--shard-max-workers', default='8', help="Comma-separated SHARD_MAX_WORKERS values")
+    parser.add_argument('--page-mix', default='1:0.6,4:0.3,60:0.1', help="Page count distribution as pages:weight,...")
+    parser.add_argument('--fields-mean', type=float, default=20, help="Mean entities per Document AI response")
+    parser.add_argument('--fields-stddev', type=float, default=8, help="Stddev of entities per response")
+    parser.add_argument('--docai-latency-ms', type=float, default=800, help="Median Document AI latency per 5 pages")
+    parser.add_argument('--docai-error-rate', type=float, default=0.01)
+    parser.add_argument('--bq-latency-ms', type=float, default=150, help="Median BigQuery job/insert latency")
+    parser.add_argument('--bq-error-rate', type=float, default=0.0)
+    parser.add_argument('--gcs-latency-ms', type=float, default=30, help="Median GCS request latency")
+    parser.add_argument('--gcs-error-rate', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.3, help="Lognormal sigma applied to all latencies")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--lanes', help="Run the priority lane scenario with lanes as name:weight,...")
+    parser.add_argument('--interactive-messages', type=int, default=20, help="Interactive messages in the lane scenario")
+    parser.add_argument('--interactive-interval', type=float, default=0.25, help="Seconds between interactive messages")
+    parser.add_argument('--sigterm-after', type=float, help="Run the drain scenario, sending SIGTERM after this many seconds")
+    parser.add_argument('--drain-grace', type=float, default=2.0, help="Drain grace period in the drain scenario")
+    parser.add_argument('--no-checkpoints', action='store_true', help="Disable shard checkpoints in the drain scenario")
+    parser.add_argument('--output', help="Write the full JSON report to this path")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    worker = load_worker(args)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results_ref = [None]
+    instrument(worker, results_ref)
+
+    if args.sigterm_after is not None:
+        run = run_drain(worker, results_ref, args)
+        print_drain_summary(run)
+        runs = [run]
+    elif args.lanes:
+        run = run_lanes(worker, results_ref, args)
+        print_lane_summary(run)
+        runs = [run]
+    else:
+        runs = run_sweep(worker, results_ref, args)
+
+    # Stop the CPU pool and flush writers now, rather than leaving them to interpreter teardown
+    worker.shutdown()
+
+    report = {"settings": vars(args), "runs": runs}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nFull report written to {args.output}")
+
+
+def run_sweep(worker, results_ref, args):
+    runs = []
+    for concurrency, shard_page_size, shard_workers in itertools.product(
+        [int(v) for v in args.concurrency.split(',')],
+        [int(v) for v in args.shard_page_size.split(',')],
+        [int(v) for v in args.shard_max_workers.split(',')]
+    ):
+        run = run_once(worker, results_ref, args, concurrency, shard_page_size, shard_workers)
+        runs.append(run)
+        print(
+            f"concurrency={concurrency} shard_page_size={shard_page_size} shard_max_workers={shard_workers}: "
+            f"{run['throughput_docs_per_second']} docs/s",
+            file=sys.stderr
+        )
+
+    print_summary(runs)
+    return runs
+
+
+if __name__ == '__main__':
+    main()
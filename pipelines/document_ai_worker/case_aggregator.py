@@ -0,0 +1,199 @@
+"""
+Tytan LendingOps & MemberAssist - Per-case status aggregator
+Keeps running state for each case (documents seen, their confidence and review
+outcome, still-required document types) and emits at most one case status write
+per case per flush window, computed from the combined state rather than from
+whichever document finished last.
+
+The state is in memory only, so record() returns a future the worker waits on
+before acking: it resolves once the case status reflecting that document has
+been written (right away when the document leaves an already written status
+unchanged). After a crash, state is re-seeded from the document statuses, which
+are written before the ack too.
+
+A redelivered document that was already extracted only goes through note(): a
+case status computed on replay would be newer than, and overwrite, any status
+set since (a reviewer's READY_FOR_DECISION, say).
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent import futures
+
+import case_projection
+
+logger = logging.getLogger(__name__)
+
+CASE_STATUS_FLUSH_SECONDS = float(os.getenv('CASE_STATUS_FLUSH_SECONDS', '5'))
+
+# Flush interval once the worker is draining, so messages waiting on their case status settle quickly
+CASE_STATUS_DRAIN_FLUSH_SECONDS = float(os.getenv('CASE_STATUS_DRAIN_FLUSH_SECONDS', '0.1'))
+
+# Cases with no activity for this long are dropped from memory (re-seeded on next use)
+CASE_STATE_TTL_SECONDS = float(os.getenv('CASE_STATE_TTL_SECONDS', '3600'))
+
+
+class CaseState:
+    """Running state for one case"""
+
+    def __init__(self, loan_type):
+        self.loan_type = loan_type
+        self.documents = {}  # document_id -> (document_type, weighted_confidence or None, needs_review)
+        self.last_emitted_status = None
+        self.emitted = None  # Future for the write of last_emitted_status
+        self.waiters = []  # Futures of records waiting for the next flush
+        self.dirty = False
+        self.last_seen = time.monotonic()
+
+    def record_document(self, document_id, document_type, weighted_confidence, needs_review):
+        self.documents[document_id] = (document_type, weighted_confidence, needs_review)
+        self.dirty = True
+        self.last_seen = time.monotonic()
+
+    def missing_documents(self):
+        received = {document_type for document_type, _, _ in self.documents.values()}
+        return [doc for doc in case_projection.get_required_documents(self.loan_type) if doc not in received]
+
+    def summary(self):
+        confidences = [c for _, c, _ in self.documents.values() if c is not None]
+        return {
+            "documents_seen": len(self.documents),
+            "documents_needing_review": sum(1 for _, _, review in self.documents.values() if review),
+            "min_confidence": min(confidences) if confidences else None,
+            "avg_confidence": sum(confidences) / len(confidences) if confidences else None,
+            "missing_documents": self.missing_documents()
+        }
+
+    def status(self):
+        """Combined case status: any document needing review wins, then missing documents"""
+        if any(review for _, _, review in self.documents.values()):
+            return "NEEDS_REVIEW"
+        if self.missing_documents():
+            return "AWAITING_DOCUMENTS"
+        return "READY_FOR_REVIEW"
+
+
+class CaseStatusAggregator:
+    """
+    Collects per-document outcomes and flushes one status per changed case
+
+    load_case(case_id) seeds state for cases this instance has not seen yet and
+    returns (loan_type, [(document_id, document_type, needs_review), ...]);
+    emit(case_id, status, summary) writes the case status and returns a future
+    that resolves once the write is durable (or None if it already is).
+    """
+
+    def __init__(self, load_case, emit):
+        self.load_case = load_case
+        self.emit = emit
+        self.cases = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.hurried = threading.Event()
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, name='case-status-aggregator', daemon=True)
+        self.thread.start()
+
+    def record(self, case_id, document_id, document_type, score, loan_type=None):
+        """Fold one document's scoring outcome into its case; returns a future for the case status write"""
+        with self.lock:
+            known = case_id in self.cases
+
+        # Seed from what is already recorded so other instances' documents count too
+        seed = None if known else self.load_case(case_id)
+
+        with self.lock:
+            state = self.cases.get(case_id)
+            if state is None:
+                seeded_loan_type, documents = seed or (None, [])
+                state = CaseState(loan_type or seeded_loan_type)
+                for seeded_id, seeded_type, needs_review in documents:
+                    state.documents[seeded_id] = (seeded_type, None, needs_review)
+                self.cases[case_id] = state
+
+            state.record_document(document_id, document_type, score['weighted_confidence'], score['needs_review'])
+
+            if state.emitted is not None and state.status() == state.last_emitted_status:
+                return state.emitted
+            waiter = futures.Future()
+            state.waiters.append(waiter)
+            return waiter
+
+    def note(self, case_id, document_id, document_type, score):
+        """Fold a replayed document into a case held in memory without emitting a case status"""
+        with self.lock:
+            state = self.cases.get(case_id)
+            if state is not None:
+                state.documents[document_id] = (document_type, score['weighted_confidence'], score['needs_review'])
+                state.last_seen = time.monotonic()
+
+    def flush(self):
+        """Emit the combined status of every case that changed since the last flush"""
+        pending = []
+        now = time.monotonic()
+        with self.lock:
+            for case_id, state in list(self.cases.items()):
+                if state.dirty:
+                    state.dirty = False
+                    waiters, state.waiters = state.waiters, []
+                    status = state.status()
+                    if status != state.last_emitted_status:
+                        state.last_emitted_status = status
+                        state.emitted = futures.Future()
+                        pending.append((case_id, status, state.summary(), state.emitted))
+                    for waiter in waiters:
+                        _settle_from(waiter, state.emitted)
+                elif now - state.last_seen > CASE_STATE_TTL_SECONDS:
+                    del self.cases[case_id]
+
+        for case_id, status, summary, emitted in pending:
+            try:
+                written = self.emit(case_id, status, summary)
+            except Exception as e:
+                logger.error(f"Failed to emit status for case {case_id}: {e}", exc_info=True)
+                with self.lock:
+                    state = self.cases.get(case_id)
+                    if state is not None:
+                        state.dirty = True
+                        state.last_emitted_status = None
+                        state.emitted = None
+                # The waiting messages are nacked and re-record the case when redelivered
+                emitted.set_exception(e)
+                continue
+
+            if written is None:
+                emitted.set_result(None)
+            else:
+                _settle_from(emitted, written)
+
+    def hurry(self):
+        """Flush every CASE_STATUS_DRAIN_FLUSH_SECONDS from now on (the worker is draining)"""
+        self.hurried.set()
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(CASE_STATUS_DRAIN_FLUSH_SECONDS if self.hurried.is_set() else CASE_STATUS_FLUSH_SECONDS)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                return
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout=10)
+        self.flush()
+
+
+def _settle_from(target, source):
+    """Resolve target the way source resolves"""
+    def copy(done):
+        if done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(None)
+    source.add_done_callback(copy)
@@ -0,0 +1,256 @@
+"""
+Tytan LendingOps & MemberAssist - CPU stage for the Document AI worker
+Runs CPU-bound document work (PDF splitting, image preparation, entity/bounding-box
+parsing) in a process pool so it does not hold the GIL on the Pub/Sub callback and lease
+management threads. Document bytes are handed to pool processes through shared
+memory rather than pickled copies.
+"""
+
+import os
+import io
+import json
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent import futures
+
+import preprocess
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 0 runs every step inline on the calling thread
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', str(os.cpu_count() or 1)))
+
+# Responses with fewer entities than this are parsed inline (IPC would cost more than it saves)
+CPU_OFFLOAD_MIN_ENTITIES = int(os.getenv('CPU_OFFLOAD_MIN_ENTITIES', '200'))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared process pool, creating it on first use (None when disabled)"""
+    global _pool
+    if CPU_POOL_WORKERS <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            # forkserver avoids forking a parent that already runs gRPC threads; the task modules
+            # are imported lazily in the parent, but once in the server so every child starts with them
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['cpu_stage', 'pypdf', 'google.cloud.documentai_v1'])
+            _pool = futures.ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=context)
+            logger.info(f"Started CPU stage with {CPU_POOL_WORKERS} worker process(es)")
+
+    return _pool
+
+
+def shutdown_pool(wait=True):
+    """Stop the pool; without wait, queued work is cancelled and running work abandoned"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=not wait)
+            _pool = None
+
+
+class SharedMemoryReader(io.RawIOBase):
+    """Seekable read-only file over a shared memory buffer, without copying it"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        count = min(len(target), len(self.buffer) - self.position)
+        target[:count] = self.buffer[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = len(self.buffer) + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class SharedDocument:
+    """
+    Document bytes held in a shared memory segment
+
+    The creating process owns the segment and must close() it; pool processes
+    attach by name and read it in place.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self.shm.name
+
+    @classmethod
+    def from_bytes(cls, data):
+        shared = cls(len(data))
+        shared.shm.buf[:len(data)] = data
+        return shared
+
+    @classmethod
+    def from_blob(cls, blob):
+        """Stream a GCS blob straight into shared memory (blob.size must be loaded)"""
+        shared = cls(blob.size)
+        try:
+            blob.download_to_file(_SharedMemoryWriter(shared.shm.buf))
+        except Exception:
+            shared.close()
+            raise
+        return shared
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _SharedMemoryWriter:
+    """Minimal file-like sink for Blob.download_to_file"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    def write(self, data):
+        self.buffer[self.position:self.position + len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+
+def iter_entity_fields(document, page_offset=0):
+    """
+    Yield (field_name, value, confidence, page_number, bounding_box) tuples for
+    Document AI entities, shifting page numbers by page_offset
+    """
+    for entity in document.entities:
+        page_refs = entity.page_anchor.page_refs
+        yield (
+            entity.type_,
+            entity.mention_text,
+            entity.confidence,
+            (page_refs[0].page if page_refs else 0) + page_offset,
+            json.dumps({
+                "vertices": [
+                    {"x": v.x, "y": v.y}
+                    for v in page_refs[0].bounding_poly.vertices
+                ]
+            }) if page_refs and page_refs[0].bounding_poly else None
+        )
+
+
+def _attach(name, size):
+    segment = shared_memory.SharedMemory(name=name)
+    return segment, segment.buf[:size]
+
+
+def _split_pdf_task(name, size, start_page, end_page):
+    from pypdf import PdfReader, PdfWriter
+
+    segment, buffer = _attach(name, size)
+    reader = None
+    try:
+        reader = PdfReader(SharedMemoryReader(buffer))
+        writer = PdfWriter()
+        for page_index in range(start_page, end_page):
+            writer.add_page(reader.pages[page_index])
+
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+    finally:
+        del reader
+        buffer.release()
+        segment.close()
+
+
+def _prepare_image_task(name, size, mime_type):
+    segment, buffer = _attach(name, size)
+    try:
+        return preprocess.prepare_image(bytes(buffer), mime_type)
+    finally:
+        buffer.release()
+        segment.close()
+
+
+def _parse_entities_task(name, size, page_offset):
+    from google.cloud import documentai_v1 as documentai
+
+    segment, buffer = _attach(name, size)
+    try:
+        document = documentai.Document.deserialize(bytes(buffer))
+    finally:
+        buffer.release()
+        segment.close()
+    return list(iter_entity_fields(document, page_offset))
+
+
+def split_pdf_pages(shared_document, start_page, end_page):
+    """Build a standalone PDF of pages [start_page, end_page) from a SharedDocument"""
+    pool = get_pool()
+    if pool is None:
+        return _split_pdf_task(shared_document.name, shared_document.size, start_page, end_page)
+
+    return pool.submit(
+        _split_pdf_task, shared_document.name, shared_document.size, start_page, end_page
+    ).result()
+
+
+def prepare_image(shared_document, mime_type):
+    """Auto-rotate, deskew and downscale an image held in a SharedDocument"""
+    pool = get_pool()
+    if pool is None:
+        return _prepare_image_task(shared_document.name, shared_document.size, mime_type)
+
+    return pool.submit(_prepare_image_task, shared_document.name, shared_document.size, mime_type).result()
+
+
+def parse_entities(document, page_offset=0):
+    """
+    Parse a Document AI response into field tuples, in the pool for large responses
+
+    Inline, the tuples are yielded one entity at a time as the caller builds its
+    columns; from the pool they come back as one list (results cross the process
+    boundary pickled).
+    """
+    pool = get_pool()
+    if pool is None or len(document.entities) < CPU_OFFLOAD_MIN_ENTITIES:
+        return iter_entity_fields(document, page_offset)
+
+    from google.cloud import documentai_v1 as documentai
+
+    with SharedDocument.from_bytes(documentai.Document.serialize(document)) as shared:
+        return pool.submit(_parse_entities_task, shared.name, shared.size, page_offset).result()
@@ -0,0 +1,215 @@
+"""
+Tytan LendingOps & MemberAssist - Columnar extraction results
+Holds extracted fields as NumPy column arrays and scores them against
+per-document-type, per-field confidence thresholds
+"""
+
+import os
+import json
+import uuid
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fallback threshold for document types and fields without an explicit entry
+CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', '0.85'))
+
+# Per-document-type thresholds. "threshold" gates the weighted document score;
+# each field entry is (minimum confidence, weight in the weighted score).
+DEFAULT_FIELD_THRESHOLDS = {
+    "drivers_license": {
+        "threshold": 0.90,
+        "fields": {
+            "full_name": (0.92, 2.0),
+            "date_of_birth": (0.95, 3.0),
+            "license_number": (0.95, 3.0),
+            "address": (0.85, 1.0),
+            "expiration_date": (0.92, 2.0),
+            "state": (0.85, 0.5),
+            "gender": (0.70, 0.25),
+            "height": (0.60, 0.25)
+        }
+    },
+    "paystub": {
+        "threshold": 0.88,
+        "fields": {
+            "employee_name": (0.90, 2.0),
+            "employer_name": (0.88, 1.5),
+            "employer_ein": (0.90, 3.0),
+            "gross_pay": (0.92, 3.0),
+            "net_pay": (0.92, 2.0),
+            "ytd_gross": (0.85, 1.0)
+        }
+    },
+    "bank_statement_30days": {
+        "threshold": 0.88,
+        "fields": {
+            "account_holder": (0.92, 2.0),
+            "account_number": (0.90, 2.0),
+            "ending_balance": (0.92, 3.0),
+            "beginning_balance": (0.90, 1.5)
+        }
+    }
+}
+
+# Paystub and bank statement variants share the same field rules
+DEFAULT_FIELD_THRESHOLDS["paystub_recent_2"] = DEFAULT_FIELD_THRESHOLDS["paystub"]
+DEFAULT_FIELD_THRESHOLDS["bank_statement_60days"] = DEFAULT_FIELD_THRESHOLDS["bank_statement_30days"]
+
+
+def load_field_thresholds():
+    """Merge FIELD_THRESHOLDS_JSON overrides (same shape as the defaults) over the defaults"""
+    thresholds = {doc_type: {"threshold": rules["threshold"], "fields": dict(rules["fields"])}
+                  for doc_type, rules in DEFAULT_FIELD_THRESHOLDS.items()}
+
+    overrides = os.getenv('FIELD_THRESHOLDS_JSON', '')
+    if not overrides:
+        return thresholds
+
+    try:
+        for doc_type, rules in json.loads(overrides).items():
+            entry = thresholds.setdefault(doc_type, {"threshold": CONFIDENCE_THRESHOLD, "fields": {}})
+            entry["threshold"] = float(rules.get("threshold", entry["threshold"]))
+            for field_name, (min_confidence, weight) in rules.get("fields", {}).items():
+                entry["fields"][field_name] = (float(min_confidence), float(weight))
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ignoring invalid FIELD_THRESHOLDS_JSON: {e}")
+
+    return thresholds
+
+
+FIELD_THRESHOLDS = load_field_thresholds()
+
+
+class ExtractionResult:
+    """Extracted fields for one document, stored as parallel column arrays"""
+
+    def __init__(self, field_names, values, confidences, page_numbers, bounding_boxes):
+        self.field_names = np.asarray(field_names, dtype=object)
+        self.values = np.asarray(values, dtype=object)
+        self.confidences = np.asarray(confidences, dtype=np.float64)
+        self.page_numbers = np.asarray(page_numbers, dtype=np.int64)
+        self.bounding_boxes = np.asarray(bounding_boxes, dtype=object)
+
+    def __len__(self):
+        return len(self.field_names)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Build from an iterable of (field_name, value, confidence, page_number, bounding_box)
+        tuples, appending each to its column as it arrives so a generator is never held whole
+        """
+        field_names, values, confidences, page_numbers, bounding_boxes = [], [], [], [], []
+        for field_name, value, confidence, page_number, bounding_box in columns:
+            field_names.append(field_name)
+            values.append(value)
+            confidences.append(confidence)
+            page_numbers.append(page_number)
+            bounding_boxes.append(bounding_box)
+        return cls(field_names, values, confidences, page_numbers, bounding_boxes)
+
+    def to_columns(self):
+        """Inverse of from_columns: (field_name, value, confidence, page_number, bounding_box) tuples"""
+        return list(zip(
+            self.field_names.tolist(),
+            self.values.tolist(),
+            self.confidences.tolist(),
+            self.page_numbers.tolist(),
+            self.bounding_boxes.tolist()
+        ))
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Build from field dicts (mock extractions)"""
+        return cls.from_columns(
+            (f['field_name'], f['value'], f['confidence'], f.get('page_number', 0), f.get('bounding_box'))
+            for f in fields
+        )
+
+    @classmethod
+    def concatenate(cls, results):
+        """Merge results (e.g. shards) in the given order"""
+        results = [r for r in results if len(r)]
+        if not results:
+            return cls.empty()
+        return cls(
+            np.concatenate([r.field_names for r in results]),
+            np.concatenate([r.values for r in results]),
+            np.concatenate([r.confidences for r in results]),
+            np.concatenate([r.page_numbers for r in results]),
+            np.concatenate([r.bounding_boxes for r in results])
+        )
+
+    def field_rules(self, document_type):
+        """Return (per-field thresholds, per-field weights, document threshold) for this result"""
+        rules = FIELD_THRESHOLDS.get(document_type, {})
+        field_rules = rules.get("fields", {})
+        document_threshold = rules.get("threshold", CONFIDENCE_THRESHOLD)
+
+        # Look up each distinct field name once and broadcast back over the column
+        unique_names, inverse = np.unique(self.field_names.astype(str), return_inverse=True)
+        unique_rules = np.array(
+            [field_rules.get(name, (CONFIDENCE_THRESHOLD, 1.0)) for name in unique_names],
+            dtype=np.float64
+        ).reshape(-1, 2)
+
+        return unique_rules[inverse, 0], unique_rules[inverse, 1], document_threshold
+
+    def score(self, document_type):
+        """
+        Score the result and decide review routing
+
+        A document needs review when its weighted confidence is below the document
+        type's threshold or any field falls below its own threshold. Fields that
+        all carry weight 0 give no weighted confidence, which scores as 0.
+        """
+        if not len(self):
+            return {
+                "avg_confidence": 0.0,
+                "weighted_confidence": 0.0,
+                "low_confidence_fields": [],
+                "needs_review": True
+            }
+
+        thresholds, weights, document_threshold = self.field_rules(document_type)
+        below_threshold = self.confidences < thresholds
+        total_weight = weights.sum()
+        weighted_confidence = float(np.dot(self.confidences, weights) / total_weight) if total_weight > 0 else 0.0
+
+        return {
+            "avg_confidence": float(self.confidences.mean()),
+            "weighted_confidence": weighted_confidence,
+            "low_confidence_fields": self.field_names[below_threshold].tolist(),
+            "needs_review": bool(below_threshold.any()) or weighted_confidence < document_threshold
+        }
+
+    def to_bigquery_rows(self, case_id, document_id, processor_id, extracted_at):
+        """Convert columns straight into extracted_fields rows"""
+        return [
+            {
+                "extraction_id": str(uuid.uuid4()),
+                "case_id": case_id,
+                "document_id": document_id,
+                "field_name": field_name,
+                "value": str(value),
+                "confidence": confidence,
+                "page_number": page_number,
+                "bounding_box": bounding_box,
+                "extracted_at": extracted_at,
+                "processor_id": processor_id,
+                "is_corrected": False
+            }
+            for field_name, value, confidence, page_number, bounding_box in zip(
+                self.field_names.tolist(),
+                self.values.tolist(),
+                self.confidences.tolist(),
+                self.page_numbers.tolist(),
+                self.bounding_boxes.tolist()
+            )
+        ]
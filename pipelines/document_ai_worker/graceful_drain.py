@@ -0,0 +1,262 @@
+"""
+Tytan LendingOps & MemberAssist - Graceful drain for the Document AI worker
+On SIGTERM (Cloud Run scale-in or redeploy) the worker closes its streaming pulls,
+so nothing more is delivered to it (a message turned away would still count as a
+delivery attempt towards the dead-letter limit). In-flight messages get one lease
+extension covering the drain and are acked or nacked with direct API calls from
+then on. They have up to WORKER_DRAIN_GRACE_SECONDS to finish; whatever is still
+running is nacked so it is redelivered right away and resumes from its shard
+checkpoints instead of waiting out the lease. The rest of the shutdown budget is
+for flushing case and status state, within Cloud Run's 10 seconds before SIGKILL.
+"""
+
+import os
+import time
+import signal
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Cloud Run sends SIGKILL 10 seconds after SIGTERM; the drain and every shutdown step fit in this
+WORKER_SHUTDOWN_BUDGET_SECONDS = float(os.getenv('WORKER_SHUTDOWN_BUDGET_SECONDS', '9'))
+
+# Part of the budget in-flight messages get to finish; the remainder is for the final flushes
+WORKER_DRAIN_GRACE_SECONDS = float(os.getenv('WORKER_DRAIN_GRACE_SECONDS', '6'))
+
+# Lease given to in-flight messages when pulling stops (the client no longer extends it)
+DRAIN_LEASE_SECONDS = 60
+
+# Timeout for each direct ack/nack/lease call made while draining
+DRAIN_RPC_TIMEOUT_SECONDS = 2
+
+
+class StreamMessage:
+    """Leased message settled over its streaming pull until pulling stops, then with direct API calls"""
+
+    __slots__ = ("message", "subscription_path", "controller")
+
+    def __init__(self, message, subscription_path, controller):
+        self.message = message
+        self.subscription_path = subscription_path
+        self.controller = controller
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    def ack(self):
+        self.controller.settle(self, ack=True)
+
+    def nack(self):
+        self.controller.settle(self, ack=False)
+
+
+class DrainTrackedMessage:
+    """Message wrapper that leaves the in-flight set on its first ack or nack (later ones are ignored)"""
+
+    __slots__ = ("message", "controller", "lock", "done")
+
+    def __init__(self, message, controller):
+        self.message = message
+        self.controller = controller
+        self.lock = threading.Lock()
+        self.done = False
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    def _claim(self):
+        with self.lock:
+            first, self.done = not self.done, True
+        return first
+
+    def ack(self):
+        if self._claim():
+            try:
+                self.message.ack()
+            finally:
+                self.controller.settled(self)
+
+    def nack(self):
+        if self._claim():
+            try:
+                self.message.nack()
+            finally:
+                self.controller.settled(self)
+
+
+class DrainController:
+    """Tracks in-flight messages and turns away new ones once draining"""
+
+    def __init__(self, on_drain=None):
+        self.on_drain = on_drain  # Called once when draining starts
+        self.draining = threading.Event()
+        self.signalled_at = None
+        self.condition = threading.Condition()
+        self.in_flight = set()
+        self.subscriber = None  # Set once pulling stops; messages are settled through it directly
+
+    def install(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """Register signal handlers (main thread only)"""
+        for signum in signals:
+            signal.signal(signum, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, draining...")
+        if self.signalled_at is None:
+            self.signalled_at = time.monotonic()
+        self.draining.set()
+
+    def shutdown_deadline(self):
+        """Monotonic time by which the whole shutdown has to be over"""
+        started = self.signalled_at if self.signalled_at is not None else time.monotonic()
+        return started + WORKER_SHUTDOWN_BUDGET_SECONDS
+
+    def stream_callback(self, subscription_path, callback):
+        """Wrap a subscriber callback so its messages can still be settled after pulling stops"""
+        def receive(message):
+            return callback(StreamMessage(message, subscription_path, self))
+        return receive
+
+    def wrap(self, handler):
+        """
+        Wrap a message handler so in-flight messages are tracked and new ones nacked while draining
+
+        A message stays in flight until it is acked or nacked, which can be after the
+        handler returns (the worker acks once the message's status writes are durable).
+        Once pulling has stopped, only messages the client had already received but
+        not yet handed over can still turn up here.
+        """
+        def guarded(message):
+            with self.condition:
+                admitted = not self.draining.is_set()
+                if admitted:
+                    tracked = DrainTrackedMessage(message, self)
+                    self.in_flight.add(tracked)
+            if not admitted:
+                message.nack()
+                return
+
+            try:
+                handler(tracked)
+            except BaseException:
+                self.settled(tracked)
+                raise
+
+        return guarded
+
+    def settled(self, tracked):
+        with self.condition:
+            self.in_flight.discard(tracked)
+            self.condition.notify_all()
+
+    def settle(self, message, ack):
+        """Ack or nack a StreamMessage, over its stream or, once pulling stopped, directly"""
+        subscriber = self.subscriber
+        if subscriber is None:
+            if ack:
+                message.message.ack()
+            else:
+                message.message.nack()
+            return
+
+        try:
+            if ack:
+                subscriber.acknowledge(
+                    request={"subscription": message.subscription_path, "ack_ids": [message.ack_id]},
+                    timeout=DRAIN_RPC_TIMEOUT_SECONDS
+                )
+            else:
+                subscriber.modify_ack_deadline(
+                    request={
+                        "subscription": message.subscription_path, "ack_ids": [message.ack_id],
+                        "ack_deadline_seconds": 0
+                    },
+                    timeout=DRAIN_RPC_TIMEOUT_SECONDS
+                )
+        except Exception as e:
+            # The drain lease runs out and Pub/Sub redelivers the message
+            logger.warning(f"Could not {'ack' if ack else 'nack'} message {message.message_id} after pulling stopped: {e}")
+
+    def stop_pulling(self, subscriber, *pull_futures):
+        """
+        Close the streaming pulls so nothing more is delivered while draining
+
+        The client stops extending leases when its stream closes, so in-flight
+        messages get DRAIN_LEASE_SECONDS now and are settled directly from here on.
+        """
+        with self.condition:
+            self.subscriber = subscriber
+            in_flight = list(self.in_flight)
+        for future in pull_futures:
+            future.cancel()
+
+        ack_ids = defaultdict(list)
+        for message in in_flight:
+            subscription_path = getattr(message, 'subscription_path', None)
+            if subscription_path is not None:
+                ack_ids[subscription_path].append(message.ack_id)
+        for subscription_path, ids in ack_ids.items():
+            try:
+                subscriber.modify_ack_deadline(
+                    request={
+                        "subscription": subscription_path, "ack_ids": ids, "ack_deadline_seconds": DRAIN_LEASE_SECONDS
+                    },
+                    timeout=DRAIN_RPC_TIMEOUT_SECONDS
+                )
+            except Exception as e:
+                logger.warning(f"Could not extend leases of {len(ids)} in-flight message(s) on {subscription_path}: {e}")
+        logger.info(f"Stopped pulling; {len(in_flight)} message(s) in flight")
+
+    def wait_for_signal(self, *pull_futures):
+        """Block until a drain is requested (True) or a streaming pull stops on its own (False)"""
+        while not self.draining.wait(1.0):
+            if any(future.done() for future in pull_futures):
+                return False
+        return True
+
+    def drain(self, grace_seconds=WORKER_DRAIN_GRACE_SECONDS):
+        """Wait for in-flight messages, then nack what is left; returns the number nacked"""
+        if self.signalled_at is None:
+            self.signalled_at = time.monotonic()
+        self.draining.set()
+        if self.on_drain is not None:
+            self.on_drain()
+        with self.condition:
+            if self.in_flight:
+                logger.info(f"Waiting up to {grace_seconds}s for {len(self.in_flight)} in-flight message(s)")
+            self.condition.wait_for(lambda: not self.in_flight, timeout=grace_seconds)
+            remaining = list(self.in_flight)
+
+        for message in remaining:
+            message.nack()
+
+        if remaining:
+            logger.warning(f"Grace period over, nacked {len(remaining)} in-flight message(s) for redelivery")
+        else:
+            logger.info("Drained all in-flight messages")
+        return len(remaining)
+
+
+def run_bounded(step, timeout, name=None):
+    """Run one shutdown step for at most timeout seconds; returns False if it had to be abandoned"""
+    name = name or getattr(step, '__qualname__', repr(step))
+    errors = []
+
+    def run():
+        try:
+            step()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, name=f'shutdown-{name}', daemon=True)
+    thread.start()
+    thread.join(max(0.0, timeout))
+    if thread.is_alive():
+        logger.error(f"Shutdown step {name} did not finish within {timeout:.1f}s; abandoning it")
+        return False
+    if errors:
+        logger.error(f"Shutdown step {name} failed: {errors[0]}", exc_info=errors[0])
+        return False
+    return True
@@ -0,0 +1,204 @@
+"""
+Tytan LendingOps & MemberAssist - Priority lanes for the Document AI worker
+Pulls from one subscription per lane (interactive, standard, bulk), queues the
+leased messages per lane, and shares a fixed pool of processing threads across
+lanes with weighted-fair (stride) scheduling. A lane whose oldest message has
+waited longer than LANE_MAX_WAIT_SECONDS is served first, so no lane starves.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Processing threads shared by all lanes
+LANE_WORKER_THREADS = int(os.getenv('LANE_WORKER_THREADS', '16'))
+
+# Messages each lane may hold leased (queued + processing) at once
+LANE_MAX_LEASED = int(os.getenv('LANE_MAX_LEASED', '100'))
+
+# Starvation protection: serve a lane first once its head has waited this long
+LANE_MAX_WAIT_SECONDS = float(os.getenv('LANE_MAX_WAIT_SECONDS', '120'))
+
+# How often lane queue depth and queue-lag percentiles are logged
+LANE_METRICS_INTERVAL_SECONDS = float(os.getenv('LANE_METRICS_INTERVAL_SECONDS', '60'))
+
+STRIDE_SCALE = 1_000_000
+
+
+def parse_lanes(spec):
+    """
+    Parse WORKER_LANES, e.g.
+    "interactive:document-ai-worker-interactive-sub:8,standard:document-ai-worker-sub:3,bulk:document-ai-worker-bulk-sub:1"
+    """
+    lanes = []
+    for part in spec.split(','):
+        name, subscription_id, weight = part.strip().split(':')
+        lanes.append((name, subscription_id, int(weight)))
+    return lanes
+
+
+class Lane:
+    def __init__(self, name, subscription_path, weight):
+        self.name = name
+        self.subscription_path = subscription_path
+        self.weight = max(1, weight)
+        self.stride = STRIDE_SCALE // self.weight
+        self.pass_value = 0
+        self.queue = deque()  # (message, received_at)
+        self.lag_samples = deque(maxlen=2000)
+        self.dispatched = 0
+
+
+class LaneScheduler:
+    """Weighted-fair scheduling of worker concurrency across priority lanes"""
+
+    def __init__(self, subscriber, lanes, handler, on_receive=None, wrap_stream=None):
+        self.subscriber = subscriber
+        self.handler = handler
+        self.on_receive = on_receive
+        self.wrap_stream = wrap_stream  # (subscription_path, callback) -> callback, applied per lane
+        self.lanes = [Lane(name, path, weight) for name, path, weight in lanes]
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.draining = False
+        self.pull_futures = []
+        self.threads = []
+
+    def enqueue(self, lane, message):
+        """Subscriber callback: queue the leased message on its lane"""
+        if self.on_receive is not None:
+            message = self.on_receive(message)
+        with self.condition:
+            if self.draining:
+                message.nack()
+                return
+            if not lane.queue:
+                # An idle lane rejoins at the current virtual time instead of bursting on old credit
+                active = [other.pass_value for other in self.lanes if other.queue]
+                lane.pass_value = max(lane.pass_value, min(active)) if active else lane.pass_value
+            lane.queue.append((message, time.monotonic()))
+            self.condition.notify()
+
+    def next_message(self):
+        """Pick the next message: starving lanes first, then lowest pass value"""
+        with self.condition:
+            while not self.stopped:
+                ready = [lane for lane in self.lanes if lane.queue]
+                if ready:
+                    now = time.monotonic()
+                    starving = [lane for lane in ready if now - lane.queue[0][1] > LANE_MAX_WAIT_SECONDS]
+                    if starving:
+                        lane = max(starving, key=lambda candidate: now - candidate.queue[0][1])
+                    else:
+                        lane = min(ready, key=lambda candidate: candidate.pass_value)
+
+                    message, _ = lane.queue.popleft()
+                    lane.pass_value += lane.stride
+                    lane.dispatched += 1
+                    lane.lag_samples.append(queue_lag_seconds(message))
+                    return lane, message
+
+                self.condition.wait()
+
+        return None, None
+
+    def _work(self):
+        while True:
+            lane, message = self.next_message()
+            if message is None:
+                return
+            try:
+                self.handler(message)
+            except Exception as e:
+                logger.error(f"Unhandled exception in lane {lane.name}: {e}", exc_info=True)
+                message.nack()
+
+    def lane_metrics(self):
+        metrics = {}
+        with self.condition:
+            for lane in self.lanes:
+                samples = sorted(lane.lag_samples)
+                metrics[lane.name] = {
+                    "queued": len(lane.queue),
+                    "dispatched": lane.dispatched,
+                    "queue_lag_p50_seconds": percentile(samples, 0.50),
+                    "queue_lag_p95_seconds": percentile(samples, 0.95)
+                }
+        return metrics
+
+    def _report(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped, timeout=LANE_METRICS_INTERVAL_SECONDS)
+                if self.stopped:
+                    return
+            logger.info(f"Lane metrics: {self.lane_metrics()}")
+
+    def start(self):
+        from google.cloud import pubsub_v1
+
+        for lane in self.lanes:
+            callback = lambda message, lane=lane: self.enqueue(lane, message)
+            if self.wrap_stream is not None:
+                callback = self.wrap_stream(lane.subscription_path, callback)
+            future = self.subscriber.subscribe(
+                lane.subscription_path,
+                callback=callback,
+                flow_control=pubsub_v1.types.FlowControl(max_messages=LANE_MAX_LEASED)
+            )
+            self.pull_futures.append(future)
+            logger.info(f"Lane {lane.name} (weight {lane.weight}) listening on {lane.subscription_path}")
+
+        for index in range(LANE_WORKER_THREADS):
+            thread = threading.Thread(target=self._work, name=f'lane-worker-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        reporter = threading.Thread(target=self._report, name='lane-metrics', daemon=True)
+        reporter.start()
+        self.threads.append(reporter)
+
+    def release_queued(self):
+        """Stop accepting messages and return everything still queued to Pub/Sub for redelivery"""
+        with self.condition:
+            self.draining = True
+            released = 0
+            for lane in self.lanes:
+                while lane.queue:
+                    message, _ = lane.queue.popleft()
+                    message.nack()
+                    released += 1
+        if released:
+            logger.info(f"Released {released} queued message(s)")
+
+    def stop(self, timeout=30):
+        """Cancel the pulls, release queued messages and wait up to timeout for the threads"""
+        for future in self.pull_futures:
+            future.cancel()
+
+        self.release_queued()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+def queue_lag_seconds(message):
+    """Time between publish and dispatch to a processing thread"""
+    publish_time = getattr(message, 'publish_time', None)
+    if publish_time is None:
+        return 0.0
+    return max(0.0, time.time() - publish_time.timestamp())
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
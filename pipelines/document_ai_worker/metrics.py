@@ -0,0 +1,171 @@
+"""
+Tytan LendingOps & MemberAssist - Prometheus metrics for the Document AI worker
+Per-stage latency histograms, in-flight messages, backend request and error
+counts, message age at receipt and ack/nack counts, served on :METRICS_PORT/metrics
+(Cloud Run's PORT by default, which also gives the service a listening port).
+
+Label children are resolved once per stage and cached, so recording on the hot
+path is a perf_counter pair and a locked add.
+"""
+
+import os
+import time
+import logging
+import functools
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_PORT = int(os.getenv('METRICS_PORT', os.getenv('PORT', '8080')))
+
+# Ranged GCS reads are milliseconds, Document AI shards are seconds, whole messages up to minutes
+STAGE_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Publish -> receipt; lanes and backlogs push this into minutes
+MESSAGE_AGE_BUCKETS_SECONDS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+stage_duration = Histogram(
+    "docai_worker_stage_duration_seconds",
+    "Time spent per processing stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS_SECONDS
+)
+backend_requests = Counter(
+    "docai_worker_backend_requests_total", "Calls to Document AI, BigQuery and Cloud Storage", ["backend"]
+)
+backend_errors = Counter(
+    "docai_worker_backend_errors_total", "Failed calls to Document AI, BigQuery and Cloud Storage", ["backend"]
+)
+in_flight = Gauge("docai_worker_in_flight_messages", "Messages currently being processed")
+message_age = Histogram(
+    "docai_worker_message_age_seconds",
+    "Time from publish to receipt by the worker",
+    buckets=MESSAGE_AGE_BUCKETS_SECONDS
+)
+messages_settled = Counter("docai_worker_messages_total", "Messages acked or nacked", ["result"])
+extraction_reuse = Counter(
+    "docai_worker_extraction_reuse_total",
+    "Documents whose blob was already stored, by whether an earlier extraction of it was reused",
+    ["result"]
+)
+status_events_dropped = Counter(
+    "docai_worker_status_events_dropped_total", "Status events discarded without being written to BigQuery"
+)
+lane_queued = Gauge("docai_worker_lane_queued_messages", "Messages leased and waiting for a thread", ["lane"])
+
+_acked = messages_settled.labels("ack")
+_nacked = messages_settled.labels("nack")
+_children = {}
+
+
+def start_server():
+    """Serve /metrics on METRICS_PORT from a daemon thread"""
+    if not METRICS_ENABLED:
+        return
+    start_http_server(METRICS_PORT)
+    logger.info(f"Serving metrics on :{METRICS_PORT}/metrics")
+
+
+class Stage:
+    """Times one stage; counts a backend call, and an error if the block raises or error() is called"""
+
+    __slots__ = ("histogram", "requests", "errors", "started", "failed")
+
+    def __init__(self, histogram, requests, errors):
+        self.histogram = histogram
+        self.requests = requests
+        self.errors = errors
+        self.failed = False
+
+    def error(self):
+        self.failed = True
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+        if self.requests is not None:
+            self.requests.inc()
+            if exc_type is not None or self.failed:
+                self.errors.inc()
+        return False
+
+
+def stage(name, backend=None):
+    """Context manager timing a stage; pass backend to also count requests and errors"""
+    children = _children.get((name, backend))
+    if children is None:
+        children = _children[(name, backend)] = (
+            stage_duration.labels(name),
+            backend_requests.labels(backend) if backend else None,
+            backend_errors.labels(backend) if backend else None
+        )
+    return Stage(*children)
+
+
+def timed(name, backend=None):
+    """Decorator form of stage()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, backend):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TrackedMessage:
+    """Pub/Sub message wrapper that counts how the message was settled"""
+
+    __slots__ = ("message",)
+
+    def __init__(self, message):
+        self.message = message
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    def ack(self):
+        _acked.inc()
+        self.message.ack()
+
+    def nack(self):
+        _nacked.inc()
+        self.message.nack()
+
+
+def received(message):
+    """Record a message's age at receipt and wrap it so its ack/nack is counted"""
+    observe_age(getattr(message, 'publish_time', None))
+    return TrackedMessage(message)
+
+
+def tracked(handler):
+    """Wrap a subscriber callback with received()"""
+    @functools.wraps(handler)
+    def wrapper(message):
+        return handler(received(message))
+    return wrapper
+
+
+def observe_age(publish_time):
+    if publish_time is not None:
+        message_age.observe(max(0.0, time.time() - publish_time.timestamp()))
+
+
+def count_settled(acks=0, nacks=0):
+    """For engines that settle messages by ack ID in batches"""
+    if acks:
+        _acked.inc(acks)
+    if nacks:
+        _nacked.inc(nacks)
+
+
+def watch_lanes(scheduler):
+    """Export each lane's queue depth, read at scrape time"""
+    for lane in scheduler.lanes:
+        lane_queued.labels(lane.name).set_function(lambda lane=lane: len(lane.queue))
@@ -0,0 +1,162 @@
+"""
+Tytan LendingOps & MemberAssist - Document preprocessing before extraction
+Detects the real file type from magic bytes instead of trusting the upload's
+content type, and prepares phone photos for Document AI: EXIF auto-rotation,
+deskew, downscaling to the resolution the processors need and recompression.
+Files that cannot be read are rejected before any Document AI call is made.
+"""
+
+import io
+import os
+import logging
+import numpy as np
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# HEIC/HEIF (iPhone photos) needs the optional pillow-heif plugin
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# Longest image edge sent to Document AI; ~300 DPI for a letter page, well above what ID cards need
+PREPROCESS_MAX_LONG_EDGE_PX = int(os.getenv('PREPROCESS_MAX_LONG_EDGE_PX', '3000'))
+
+# Images larger than this are recompressed even when their dimensions are fine
+PREPROCESS_MAX_IMAGE_BYTES = int(os.getenv('PREPROCESS_MAX_IMAGE_BYTES', str(2 * 1024 * 1024)))
+PREPROCESS_JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', '85'))
+
+# Deskew: search range, smallest correction worth applying, and working resolution
+PREPROCESS_DESKEW = os.getenv('PREPROCESS_DESKEW', 'true').lower() == 'true'
+PREPROCESS_DESKEW_MAX_DEGREES = float(os.getenv('PREPROCESS_DESKEW_MAX_DEGREES', '10'))
+PREPROCESS_DESKEW_MIN_DEGREES = float(os.getenv('PREPROCESS_DESKEW_MIN_DEGREES', '0.5'))
+DESKEW_WORKING_EDGE_PX = 800
+
+# Bytes needed to sniff every supported format (PDF headers may follow leading junk)
+SNIFF_BYTES = 1024
+
+# Types Document AI accepts as-is
+DOCAI_SUPPORTED_MIME_TYPES = {
+    "application/pdf", "image/jpeg", "image/png", "image/tiff", "image/gif", "image/bmp", "image/webp"
+}
+
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+class UnreadableDocumentError(ValueError):
+    """The file is empty, of an unknown type, or cannot be decoded; extraction is skipped"""
+
+
+class PreparedDocument:
+    """
+    What to send to Document AI
+
+    content is None when the original object can be sent by GCS reference with
+    the sniffed mime_type; otherwise it holds the re-encoded bytes.
+    """
+
+    def __init__(self, mime_type, content=None, notes=None):
+        self.mime_type = mime_type
+        self.content = content
+        self.notes = notes or []
+
+
+def sniff_mime_type(header):
+    """Detect the file type from its first SNIFF_BYTES bytes; None if unknown"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"II*\x00", b"MM\x00*")):
+        return "image/tiff"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header.startswith(b"BM"):
+        return "image/bmp"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "image/heic"
+    if b"%PDF-" in header[:SNIFF_BYTES]:
+        return "application/pdf"
+    return None
+
+
+def estimate_skew(image):
+    """
+    Estimate the rotation (degrees, counter-clockwise) that best aligns text lines
+
+    Projection profile search: the right angle makes the row sums of dark pixels
+    most uneven (lines and gaps). Returns 0.0 when no angle clearly beats upright.
+    """
+    gray = image.convert("L")
+    gray.thumbnail((DESKEW_WORKING_EDGE_PX, DESKEW_WORKING_EDGE_PX))
+    pixels = np.asarray(gray, dtype=np.float32)
+    ink = Image.fromarray(((pixels < min(128.0, pixels.mean() * 0.8)) * 255).astype(np.uint8))
+
+    def score(angle):
+        rows = np.asarray(ink.rotate(angle, resample=Image.NEAREST), dtype=np.float32).sum(axis=1)
+        return float(np.var(rows))
+
+    upright = score(0.0)
+    candidates = np.arange(-PREPROCESS_DESKEW_MAX_DEGREES, PREPROCESS_DESKEW_MAX_DEGREES + 0.5, 1.0)
+    best = max(candidates, key=score)
+    fine = np.arange(best - 1.0, best + 1.0001, 0.25)
+    best = max(fine, key=score)
+
+    # Photos with little text have flat profiles; only trust a clear improvement
+    if upright <= 0 or score(best) < upright * 1.1:
+        return 0.0
+    return float(best)
+
+
+def prepare_image(data, mime_type):
+    """Auto-rotate, deskew, downscale and recompress an image; returns a PreparedDocument"""
+    if mime_type == "image/heic" and not HEIF_SUPPORTED:
+        raise UnreadableDocumentError("HEIC image received but pillow-heif is not installed")
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError, SyntaxError, ValueError) as e:
+        raise UnreadableDocumentError(f"Cannot decode {mime_type}: {e}")
+
+    # Multi-page TIFF/GIF go through unchanged when Document AI accepts them
+    if getattr(image, "n_frames", 1) > 1 and mime_type in DOCAI_SUPPORTED_MIME_TYPES:
+        return PreparedDocument(mime_type, notes=["multi-frame image sent as-is"])
+
+    notes = []
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+        notes.append("EXIF orientation applied")
+
+    long_edge = max(image.size)
+    if long_edge > PREPROCESS_MAX_LONG_EDGE_PX:
+        scale = PREPROCESS_MAX_LONG_EDGE_PX / long_edge
+        original_size = image.size
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+        notes.append(f"downscaled {original_size[0]}x{original_size[1]} -> {image.width}x{image.height}")
+
+    if PREPROCESS_DESKEW:
+        angle = estimate_skew(image)
+        if abs(angle) >= PREPROCESS_DESKEW_MIN_DEGREES:
+            image = image.convert("RGB").rotate(
+                angle, resample=Image.BICUBIC, expand=True, fillcolor=(255, 255, 255)
+            )
+            notes.append(f"deskewed {angle:+.2f} degrees")
+
+    if mime_type not in DOCAI_SUPPORTED_MIME_TYPES:
+        notes.append(f"converted from {mime_type}")
+    elif len(data) > PREPROCESS_MAX_IMAGE_BYTES:
+        notes.append(f"recompressed {len(data)} bytes")
+    elif not notes:
+        return PreparedDocument(mime_type)
+
+    output = io.BytesIO()
+    image.convert("L" if image.mode in ("1", "L", "LA", "I;16") else "RGB").save(
+        output, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True
+    )
+    return PreparedDocument("image/jpeg", output.getvalue(), notes)
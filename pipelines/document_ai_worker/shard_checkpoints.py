@@ -0,0 +1,95 @@
+"""
+Tytan LendingOps & MemberAssist - Shard checkpoints for resumable extraction
+Each shard's extracted fields are written to Cloud Storage as soon as Document AI
+returns them. When a message is redelivered (drain timeout, crash, scale-in),
+shards that already have a checkpoint are loaded instead of re-extracted.
+Checkpoints are removed once the document's results are recorded; a bucket
+lifecycle rule cleans up anything left behind.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+from extraction_results import ExtractionResult
+
+logger = logging.getLogger(__name__)
+
+# Empty disables checkpointing
+CHECKPOINT_BUCKET = os.getenv('CHECKPOINT_BUCKET', '')
+CHECKPOINT_PREFIX = os.getenv('CHECKPOINT_PREFIX', 'shards')
+
+
+class ShardCheckpoint:
+    """Checkpoints for one document's extraction attempt"""
+
+    def __init__(self, bucket, document_id):
+        self.bucket = bucket
+        self.document_id = document_id
+        self.plan_key = None
+        self.paths = set()
+
+    def bind(self, blob, processor_name):
+        """
+        Key checkpoints by source object generation and processor so a replaced
+        upload or a processor change never reuses stale fields
+        """
+        source = f"{blob.name}#{getattr(blob, 'generation', None)}#{processor_name}"
+        self.plan_key = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+    def path(self, page_range):
+        shard = "all" if page_range is None else f"{page_range[0]}-{page_range[1]}"
+        return f"{CHECKPOINT_PREFIX}/{self.document_id}/{self.plan_key}/{shard}.json"
+
+    def completed(self, shards):
+        """Load checkpointed shards; returns {shard index: ExtractionResult}"""
+        results = {}
+        for index, page_range in enumerate(shards):
+            path = self.path(page_range)
+            blob = self.bucket.get_blob(path)
+            if blob is None:
+                continue
+            try:
+                results[index] = ExtractionResult.from_columns(
+                    tuple(row) for row in json.loads(blob.download_as_bytes())
+                )
+                self.paths.add(path)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+
+        if results:
+            logger.info(f"Resuming document {self.document_id}: {len(results)} of {len(shards)} shard(s) checkpointed")
+        return results
+
+    def save(self, page_range, result):
+        path = self.path(page_range)
+        try:
+            self.bucket.blob(path).upload_from_string(
+                json.dumps(result.to_columns()), content_type="application/json"
+            )
+            self.paths.add(path)
+        except Exception as e:
+            # A missing checkpoint only costs a re-extraction on redelivery
+            logger.warning(f"Failed to checkpoint {path}: {e}")
+
+    def discard(self):
+        for path in list(self.paths):
+            try:
+                self.bucket.blob(path).delete()
+            except Exception as e:
+                logger.warning(f"Failed to delete checkpoint {path}: {e}")
+            self.paths.discard(path)
+
+
+class ShardCheckpointStore:
+    def __init__(self, storage_client, bucket_name=CHECKPOINT_BUCKET, mock_mode=False):
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.enabled = bool(bucket_name) and not mock_mode
+
+    def open(self, document_id):
+        """Checkpoint handle for one document, or None when checkpointing is disabled"""
+        if not self.enabled:
+            return None
+        return ShardCheckpoint(self.storage_client.bucket(self.bucket_name), document_id)
@@ -0,0 +1,185 @@
+"""
+Tytan LendingOps & MemberAssist - Append-only status events
+Case and document status transitions are appended to the status_events table in
+batches instead of being applied with UPDATE DML. The current status is read from
+the case_status_current / document_status_current views, and a scheduled MERGE
+compacts it back into cases and documents.
+
+The buffer is in memory, so the worker acks a message only once its events are
+written: written(events) returns a future for that, and wakes the writer so the
+wait is one insert rather than the flush interval (concurrent messages share the
+insert). Events that cannot be written are failed, logged and counted, and the
+messages waiting on them are nacked for redelivery.
+"""
+
+import os
+import json
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime
+from concurrent import futures
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STATUS_FLUSH_SECONDS = float(os.getenv('STATUS_FLUSH_SECONDS', '1.0'))
+STATUS_BATCH_SIZE = int(os.getenv('STATUS_BATCH_SIZE', '500'))
+
+# Events kept for retry when BigQuery rejects a batch; the oldest are dropped beyond this
+STATUS_MAX_BUFFERED = int(os.getenv('STATUS_MAX_BUFFERED', '10000'))
+
+
+class StatusEventsDropped(RuntimeError):
+    """Status events were discarded without being written"""
+
+
+def combine_futures(pending):
+    """Future resolved once every future in pending is, or failed with the first failure"""
+    combined = futures.Future()
+    pending = list(pending)
+    if not pending:
+        combined.set_result(None)
+        return combined
+
+    remaining = [len(pending)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            if combined.done():
+                return
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+            elif not remaining[0]:
+                combined.set_result(None)
+
+    for future in pending:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def build_status_event(entity_type, entity_id, case_id, status, source, details=None):
+    """Build a status_events row"""
+    return {
+        "event_id": str(uuid.uuid4()),
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "case_id": case_id,
+        "status": status,
+        "event_time": datetime.utcnow().isoformat() + "Z",
+        "source": source,
+        "details": json.dumps(details) if details else None
+    }
+
+
+class StatusEventWriter:
+    """Buffers status events and streams them to BigQuery in batches from a background thread"""
+
+    def __init__(self, bq_client, table_id, source, mock_mode=False):
+        self.bq_client = bq_client
+        self.table_id = table_id
+        self.source = source
+        self.mock_mode = mock_mode
+
+        self.buffer = []
+        self.waiters = {}  # event_id -> Future resolved once the event is written
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, name='status-event-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, entity_type, entity_id, case_id, status, details=None):
+        event = build_status_event(entity_type, entity_id, case_id, status, self.source, details)
+        with self.lock:
+            self.buffer.append(event)
+            self.waiters[event["event_id"]] = futures.Future()
+            if len(self.buffer) >= STATUS_BATCH_SIZE:
+                self.wakeup.set()
+        return event
+
+    def written(self, events):
+        """Future resolved once all of events are in BigQuery (failed if any is dropped)"""
+        with self.lock:
+            pending = [self.waiters[event["event_id"]] for event in events if event["event_id"] in self.waiters]
+        if pending:
+            self.wakeup.set()
+        return combine_futures(pending)
+
+    def flush(self):
+        """Write everything buffered so far; failed batches are kept for the next flush"""
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+
+        for start in range(0, len(batch), STATUS_BATCH_SIZE):
+            rows = batch[start:start + STATUS_BATCH_SIZE]
+            if self.mock_mode:
+                logger.info(f"[MOCK] Would insert {len(rows)} status events into {self.table_id}")
+                self._resolve(rows)
+                continue
+
+            try:
+                with metrics.stage("bigquery.status_events", "bigquery") as stage:
+                    errors = self.bq_client.insert_rows_json(
+                        self.table_id, rows, row_ids=[row["event_id"] for row in rows]
+                    )
+                    if errors:
+                        stage.error()
+            except Exception as e:
+                errors = [str(e)]
+
+            if errors:
+                logger.error(f"Failed to insert {len(rows)} status events, will retry: {errors}")
+                self._requeue(batch[start:])
+                return False
+            self._resolve(rows)
+        return True
+
+    def _resolve(self, rows, error=None):
+        with self.lock:
+            waiters = [self.waiters.pop(row["event_id"], None) for row in rows]
+        for waiter in waiters:
+            if waiter is None:
+                continue
+            if error is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(error)
+
+    def _drop(self, rows, reason):
+        if not rows:
+            return
+        logger.error(f"Dropped {len(rows)} unwritten status events ({reason}); their messages will be redelivered")
+        metrics.status_events_dropped.inc(len(rows))
+        self._resolve(rows, StatusEventsDropped(f"{len(rows)} status events dropped: {reason}"))
+
+    def _requeue(self, rows):
+        with self.lock:
+            self.buffer = rows + self.buffer
+            dropped = self.buffer[:-STATUS_MAX_BUFFERED]
+            self.buffer = self.buffer[-STATUS_MAX_BUFFERED:]
+        self._drop(dropped, f"more than {STATUS_MAX_BUFFERED} buffered")
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(STATUS_FLUSH_SECONDS)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self, timeout=10):
+        """Stop the writer and make a last flush; events still unwritten after it are dropped"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout=timeout)
+        if not self.flush():
+            with self.lock:
+                unwritten, self.buffer = self.buffer, []
+            self._drop(unwritten, "writer closed")
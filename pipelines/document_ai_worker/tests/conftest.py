@@ -0,0 +1,20 @@
+import os
+import sys
+import argparse
+
+import pytest
+
+# The worker's modules live at the pipeline root, next to worker.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def worker():
+    """worker.py on benchmark.py's fake GCS, BigQuery and Document AI backends (short latencies)"""
+    import benchmark
+
+    args = argparse.Namespace(
+        gcs_latency_ms=1, bq_latency_ms=1, docai_latency_ms=5, latency_jitter=0.0,
+        gcs_error_rate=0.0, bq_error_rate=0.0, docai_error_rate=0.0, fields_mean=10, fields_stddev=3
+    )
+    return benchmark.load_worker(args)
@@ -0,0 +1,67 @@
+"""
+Scoring of columnar extraction results against per-document-type field weights
+and thresholds.
+"""
+
+import warnings
+
+import pytest
+
+import extraction_results
+from extraction_results import ExtractionResult
+
+
+def result(*fields):
+    return ExtractionResult.from_fields(
+        {"field_name": name, "value": f"value-{name}", "confidence": confidence} for name, confidence in fields
+    )
+
+
+def test_weighted_confidence_uses_field_weights():
+    # drivers_license weights: full_name 2.0, date_of_birth 3.0, state 0.5
+    score = result(("full_name", 0.96), ("date_of_birth", 0.98), ("state", 0.90)).score("drivers_license")
+
+    assert score["weighted_confidence"] == pytest.approx((0.96 * 2.0 + 0.98 * 3.0 + 0.90 * 0.5) / 5.5)
+    assert score["avg_confidence"] == pytest.approx((0.96 + 0.98 + 0.90) / 3)
+    assert score["low_confidence_fields"] == []
+    assert score["needs_review"] is False
+
+
+def test_field_below_its_threshold_needs_review():
+    # date_of_birth needs 0.95 even though the weighted score clears the document threshold
+    score = result(("full_name", 0.99), ("date_of_birth", 0.94), ("license_number", 0.99)).score("drivers_license")
+
+    assert score["weighted_confidence"] > 0.90
+    assert score["low_confidence_fields"] == ["date_of_birth"]
+    assert score["needs_review"] is True
+
+
+def test_unknown_fields_and_types_use_the_fallback_threshold_and_weight(monkeypatch):
+    monkeypatch.setattr(extraction_results, "CONFIDENCE_THRESHOLD", 0.85)
+    score = result(("anything", 0.90), ("else", 0.70)).score("unknown_type")
+
+    assert score["weighted_confidence"] == pytest.approx(0.80)
+    assert score["low_confidence_fields"] == ["else"]
+    assert score["needs_review"] is True
+
+
+def test_all_zero_weight_fields_score_as_no_confidence(monkeypatch):
+    monkeypatch.setitem(extraction_results.FIELD_THRESHOLDS, "utility_bill", {
+        "threshold": 0.80,
+        "fields": {"account_holder": (0.50, 0.0), "service_address": (0.50, 0.0)}
+    })
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        score = result(("account_holder", 0.99), ("service_address", 0.99)).score("utility_bill")
+
+    assert score["weighted_confidence"] == 0.0
+    assert score["low_confidence_fields"] == []
+    assert score["needs_review"] is True
+
+
+def test_empty_result_needs_review():
+    score = ExtractionResult.empty().score("drivers_license")
+
+    assert score["weighted_confidence"] == 0.0
+    assert score["needs_review"] is True
@@ -0,0 +1,241 @@
+"""
+SIGTERM drain of a worker process: the streaming pull is closed right away, no
+message is delivered afterwards, and every message that was delivered is acked
+or nacked before the process exits (within Cloud Run's 10 seconds), with acks
+only for documents whose status events were written.
+
+The worker runs in a subprocess with benchmark.py's fake GCS, BigQuery and
+Document AI backends and a fake subscriber that behaves like the streaming pull
+client: flow control counts messages until they are settled, and an ack or nack
+sent over a stream that has been closed is lost.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import benchmark
+
+result_path = sys.argv[1]
+args = argparse.Namespace(
+    gcs_latency_ms=10, bq_latency_ms=50, docai_latency_ms=1500, latency_jitter=0.3,
+    gcs_error_rate=0.0, bq_error_rate=0.0, docai_error_rate=0.0, fields_mean=10, fields_stddev=3
+)
+worker = benchmark.load_worker(args)
+
+lock = threading.Lock()
+outcomes = {}
+status_rows = []
+
+bq_fake = worker.bq_client.build()
+insert_rows_json = bq_fake.insert_rows_json
+
+
+def recording_insert(table_id, rows, **kwargs):
+    errors = insert_rows_json(table_id, rows, **kwargs)
+    if not errors and table_id.endswith(".status_events"):
+        with lock:
+            status_rows.extend((row["entity_id"], row["status"]) for row in rows)
+    return errors
+
+
+bq_fake.insert_rows_json = recording_insert
+
+
+class RawMessage:
+    def __init__(self, subscriber, index):
+        payload = benchmark.build_payload(index, 5, "bank_statement_60days")
+        self.subscriber = subscriber
+        self.document_id = payload["document_id"]
+        self.data = json.dumps(payload).encode("utf-8")
+        self.ack_id = f"ack-{index}"
+        self.message_id = f"msg-{index}"
+        self.ordering_key = payload["case_id"]
+        self.attributes = {}
+        self.publish_time = datetime.now(timezone.utc)
+
+    def ack(self):
+        self.subscriber.settle(self.ack_id, "stream_ack")
+
+    def nack(self):
+        self.subscriber.settle(self.ack_id, "stream_nack")
+
+
+class FakeStreamingPull:
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        if not self.cancelled.is_set():
+            self.subscriber.cancelled_at = time.monotonic()
+            with lock:
+                self.subscriber.in_flight_at_cancel = sum(1 for kinds in outcomes.values() if not kinds)
+            self.cancelled.set()
+
+    def done(self):
+        return self.cancelled.is_set()
+
+    def result(self, timeout=None):
+        self.cancelled.wait(timeout)
+
+
+class FakeSubscriber:
+    """Streaming pull with flow control of 8 unsettled messages"""
+
+    def __init__(self):
+        self.slots = threading.Semaphore(8)
+        self.pull = FakeStreamingPull(self)
+        self.messages = {}
+        self.delivered_after_cancel = 0
+        self.cancelled_at = None
+        self.in_flight_at_cancel = 0
+
+    def subscription_path(self, project, subscription):
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def subscribe(self, subscription_path, callback, flow_control=None):
+        threading.Thread(target=self.deliver, args=(callback,), daemon=True).start()
+        return self.pull
+
+    def deliver(self, callback):
+        for index in range(1000):
+            self.slots.acquire()
+            if self.pull.cancelled.is_set():
+                return
+            message = RawMessage(self, index)
+            with lock:
+                outcomes[message.ack_id] = []
+                self.messages[message.ack_id] = message
+            if index == 16:
+                open(result_path + ".ready", "w").close()
+            threading.Thread(target=callback, args=(message,), daemon=True).start()
+
+    def settle(self, ack_id, kind):
+        if self.pull.cancelled.is_set() and kind.startswith("stream_"):
+            kind = "lost_" + kind[len("stream_"):]
+        with lock:
+            first = not outcomes[ack_id]
+            outcomes[ack_id].append(kind)
+        if first and not kind.startswith("lost_"):
+            self.slots.release()
+
+    def acknowledge(self, request, timeout=None):
+        for ack_id in request["ack_ids"]:
+            self.settle(ack_id, "direct_ack")
+
+    def modify_ack_deadline(self, request, timeout=None):
+        if request["ack_deadline_seconds"] == 0:
+            for ack_id in request["ack_ids"]:
+                self.settle(ack_id, "direct_nack")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+fake = FakeSubscriber()
+worker.subscriber.use(fake)
+worker.main()
+done_at = time.monotonic()
+
+with lock:
+    written = sorted({entity_id for entity_id, status in status_rows if status in ("EXTRACTED", "NEEDS_REVIEW")})
+    result = {
+        "outcomes": {fake.messages[ack_id].document_id: kinds for ack_id, kinds in outcomes.items()},
+        "written": written,
+        "delivered_after_cancel": fake.delivered_after_cancel,
+        "in_flight_at_cancel": fake.in_flight_at_cancel,
+        "cancel_seconds": fake.cancelled_at - worker.drain_controller.signalled_at,
+        "shutdown_seconds": done_at - worker.drain_controller.signalled_at
+    }
+with open(result_path, "w") as f:
+    json.dump(result, f)
+'''
+
+
+def run_worker_until_sigterm(tmp_path, env_overrides=None):
+    result_path = str(tmp_path / "result.json")
+    env = dict(
+        os.environ, METRICS_ENABLED="false", WORKER_LANES="", WORKER_ENGINE="threads", CPU_POOL_WORKERS="0",
+        PYTHONUNBUFFERED="1", **(env_overrides or {})
+    )
+    with open(tmp_path / "worker.log", "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-c", CHILD, result_path], cwd=WORKER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            deadline = time.monotonic() + 60
+            while not os.path.exists(result_path + ".ready"):
+                assert process.poll() is None, (tmp_path / "worker.log").read_text()[-4000:]
+                assert time.monotonic() < deadline, "worker did not start taking messages"
+                time.sleep(0.05)
+
+            process.send_signal(signal.SIGTERM)
+            signalled = time.monotonic()
+            # Cloud Run sends SIGKILL 10 seconds after SIGTERM
+            returncode = process.wait(timeout=10)
+            exit_seconds = time.monotonic() - signalled
+        finally:
+            if process.poll() is None:
+                process.kill()
+
+    assert returncode == 0, (tmp_path / "worker.log").read_text()[-4000:]
+    with open(result_path) as f:
+        return json.load(f), exit_seconds
+
+
+def test_sigterm_stops_pulling_and_settles_every_in_flight_message(tmp_path):
+    result, exit_seconds = run_worker_until_sigterm(tmp_path)
+    outcomes = result["outcomes"]
+
+    # Pulling stops at the signal, so nothing is delivered (or turned away) during the drain
+    assert result["cancel_seconds"] < 1
+    assert result["delivered_after_cancel"] == 0
+    assert result["in_flight_at_cancel"] > 0
+
+    # Every delivered message is settled exactly once, and no ack or nack went to the closed stream
+    unsettled = [document_id for document_id, kinds in outcomes.items() if not kinds]
+    lost = [document_id for document_id, kinds in outcomes.items() if any(kind.startswith("lost_") for kind in kinds)]
+    assert not unsettled
+    assert not lost
+    assert all(len(kinds) == 1 for kinds in outcomes.values())
+
+    # Messages in flight at the signal were settled after the stream closed
+    assert any(kinds[0].startswith("direct_") for kinds in outcomes.values())
+
+    # An ack means the document's status is in BigQuery
+    acked = {document_id for document_id, kinds in outcomes.items() if kinds[0].endswith("_ack")}
+    assert acked <= set(result["written"])
+
+    assert result["shutdown_seconds"] < 9.5
+    assert exit_seconds < 10
+
+
+def test_messages_still_running_at_grace_end_are_nacked_directly(tmp_path):
+    # Document AI takes far longer than the grace period, so nothing in flight can finish
+    result, exit_seconds = run_worker_until_sigterm(tmp_path, {"WORKER_DRAIN_GRACE_SECONDS": "0.5"})
+    outcomes = result["outcomes"]
+
+    assert all(len(kinds) == 1 for kinds in outcomes.values())
+    assert result["in_flight_at_cancel"] > 0
+    nacked = [document_id for document_id, kinds in outcomes.items() if kinds == ["direct_nack"]]
+    assert len(nacked) >= 1
+    assert result["shutdown_seconds"] < 9.5
+    assert exit_seconds < 10
@@ -0,0 +1,68 @@
+"""
+A redelivered message for a document whose fields are already in BigQuery
+replays its document status but must not write a case status: one computed
+now would be newer than, and overwrite, a status a reviewer set since.
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from extraction_results import ExtractionResult
+
+
+class Message:
+    def __init__(self, payload):
+        self.data = json.dumps(payload).encode("utf-8")
+        self.settled = threading.Event()
+        self.outcome = None
+
+    def ack(self):
+        self.outcome = self.outcome or "ack"
+        self.settled.set()
+
+    def nack(self):
+        self.outcome = self.outcome or "nack"
+        self.settled.set()
+
+
+def test_replayed_message_leaves_later_case_status_unchanged(worker, monkeypatch):
+    case_id, document_id = "CU-2026-REPLAY", "DOC-REPLAY-1"
+    projection = worker.projection.build()
+    created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    projection.case_created(case_id, "M-REPLAY", "personal", "AWAITING_DOCUMENTS", created_at)
+    # Extracted earlier (low confidence, so it needed review), then reviewed
+    projection.status_changed(case_id, "READY_FOR_DECISION", datetime.now(timezone.utc))
+
+    recorded = ExtractionResult.from_fields([
+        {"field_name": "employee_name", "value": "Jane Doe", "confidence": 0.40},
+        {"field_name": "gross_pay", "value": "4200.00", "confidence": 0.50}
+    ])
+    monkeypatch.setattr(worker, "load_recorded_extraction", lambda *args, **kwargs: recorded)
+
+    written_events = []
+    bq_fake = worker.bq_client.build()
+    insert_rows_json = bq_fake.insert_rows_json
+
+    def recording_insert(table_id, rows, **kwargs):
+        errors = insert_rows_json(table_id, rows, **kwargs)
+        if not errors and table_id.endswith(".status_events"):
+            written_events.extend((row["entity_type"], row["entity_id"], row["status"]) for row in rows)
+        return errors
+
+    monkeypatch.setattr(bq_fake, "insert_rows_json", recording_insert)
+
+    message = Message({
+        "case_id": case_id, "document_id": document_id, "loan_type": "personal",
+        "document_type": "paystub_recent_2", "gcs_uri": "gs://bench-docs/replay-p2.pdf"
+    })
+    worker.handle_message(message)
+
+    assert message.settled.wait(10)
+    assert message.outcome == "ack"
+    # Anything the aggregator had pending would be written now
+    worker.case_aggregator.flush()
+
+    assert ("document", document_id, "NEEDS_REVIEW") in written_events
+    assert not [event for event in written_events if event[0] == "case" and event[1] == case_id]
+    assert projection.get(case_id)["status"] == "READY_FOR_DECISION"
@@ -0,0 +1,140 @@
+"""
+Page-sharded extraction: shard results are merged in page order with page
+numbers shifted back to the whole document, only failed shards are retried,
+and shards checkpointed by an earlier delivery are not sent again.
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.cloud import documentai_v1 as documentai
+
+from shard_checkpoints import ShardCheckpoint
+
+SHARDS = [(0, 10), (10, 20), (20, 25)]
+
+
+class ShardedDocumentAI:
+    """Answers each shard with one entity per page, numbered within the shard as Document AI does"""
+
+    def __init__(self, failures=None):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.failures = dict(failures or {})  # page range -> failures left before it succeeds
+
+    def process_document(self, request):
+        start, end = map(int, request.raw_document.content.decode().split("-"))
+        with self.lock:
+            self.calls.append((start, end))
+            if self.failures.get((start, end), 0) > 0:
+                self.failures[(start, end)] -= 1
+                raise RuntimeError(f"Document AI unavailable for pages {start}-{end}")
+
+        return SimpleNamespace(document=documentai.Document(entities=[
+            documentai.Document.Entity(
+                type_=f"field_{start + local_page}",
+                mention_text=f"value on page {start + local_page}",
+                confidence=0.9,
+                page_anchor=documentai.Document.PageAnchor(page_refs=[
+                    documentai.Document.PageAnchor.PageRef(
+                        page=local_page,
+                        bounding_poly=documentai.BoundingPoly(vertices=[documentai.Vertex(x=1, y=2)])
+                    )
+                ])
+            )
+            for local_page in range(end - start)
+        ]))
+
+
+class MemoryBucket:
+    """Checkpoint bucket: blob(path) for writes, get_blob(path) for reads"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, path):
+        bucket = self
+
+        class Blob:
+            def upload_from_string(self, data, content_type=None):
+                bucket.objects[path] = data.encode("utf-8") if isinstance(data, str) else data
+
+            def delete(self):
+                bucket.objects.pop(path, None)
+
+        return Blob()
+
+    def get_blob(self, path):
+        if path not in self.objects:
+            return None
+        return SimpleNamespace(download_as_bytes=lambda: self.objects[path])
+
+
+@pytest.fixture
+def docai(worker, monkeypatch):
+    # Shards are cut by ranged reads; the stub reads the page range back from the request
+    monkeypatch.setattr(worker.cpu_stage, "CPU_POOL_WORKERS", 0)
+    monkeypatch.setattr(worker, "read_pdf_page_range", lambda blob, start, end: f"{start}-{end}".encode())
+    stub = ShardedDocumentAI()
+    monkeypatch.setattr(worker, "docai_client", stub)
+    return stub
+
+
+def source_blob():
+    return SimpleNamespace(name="blobs/sha256/ab/abc", generation=7, content_type="application/pdf")
+
+
+def extract(worker, checkpoint=None):
+    return worker.extract_fields_from_shards(
+        source_blob(), "gs://docs/blobs/sha256/ab/abc", "projects/p/processors/form", SHARDS, checkpoint=checkpoint
+    )
+
+
+def test_merged_shards_carry_whole_document_page_numbers(worker, docai):
+    extraction = extract(worker)
+
+    assert extraction.page_numbers.tolist() == list(range(25))
+    assert extraction.field_names.tolist() == [f"field_{page}" for page in range(25)]
+    assert sorted(docai.calls) == SHARDS
+
+
+def test_plan_shards_covers_every_page_once(worker):
+    shards = worker.plan_shards(25, 10)
+
+    assert shards == SHARDS
+    assert worker.plan_shards(5, 10) is None
+
+
+def test_failed_shard_is_retried_alone(worker, docai):
+    docai.failures[(10, 20)] = 1
+
+    extraction = extract(worker)
+
+    assert sorted(docai.calls) == [(0, 10), (10, 20), (10, 20), (20, 25)]
+    assert extraction.page_numbers.tolist() == list(range(25))
+
+
+def test_redelivery_resumes_from_checkpointed_shards(worker, docai, monkeypatch):
+    monkeypatch.setattr(worker, "SHARD_MAX_RETRIES", 0)
+    bucket = MemoryBucket()
+    docai.failures[(20, 25)] = 1
+
+    first = ShardCheckpoint(bucket, "doc-1")
+    first.bind(source_blob(), "projects/p/processors/form")
+    with pytest.raises(Exception, match="1 of 3 shards failed"):
+        extract(worker, first)
+    assert len(bucket.objects) == 2
+
+    # The message is redelivered: only the shard without a checkpoint goes to Document AI
+    docai.calls.clear()
+    second = ShardCheckpoint(bucket, "doc-1")
+    second.bind(source_blob(), "projects/p/processors/form")
+    extraction = extract(worker, second)
+
+    assert docai.calls == [(20, 25)]
+    assert extraction.page_numbers.tolist() == list(range(25))
+    assert extraction.field_names.tolist() == [f"field_{page}" for page in range(25)]
+
+    second.discard()
+    assert bucket.objects == {}
@@ -0,0 +1,184 @@
+"""
+Tytan LendingOps & MemberAssist - Tracing for the Document AI worker
+Continues the trace started by the API's upload request: the W3C trace context
+arrives in the Pub/Sub message attributes, queue wait becomes a span of its own,
+and each stage (preprocess, GCS reads, Document AI, BigQuery, status updates) is
+a child span. An end-to-end latency histogram (upload received -> EXTRACTED) is
+recorded per document type.
+
+TRACE_EXPORTER selects where spans and metrics go:
+    none     tracing disabled (default; the API calls below are no-ops)
+    file     JSON lines appended to TRACE_FILE / TRACE_METRICS_FILE
+    otlp     OTLP/HTTP to a collector (OTEL_EXPORTER_OTLP_ENDPOINT, default localhost:4318)
+    console  stdout
+"""
+
+import os
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+from opentelemetry import trace, metrics, propagate, context
+from opentelemetry.trace import SpanKind
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none').lower()
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_METRICS_FILE = os.getenv('TRACE_METRICS_FILE', 'trace-metrics.jsonl')
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', '1.0'))
+TRACE_METRICS_EXPORT_SECONDS = float(os.getenv('TRACE_METRICS_EXPORT_SECONDS', '60'))
+
+SERVICE_NAME = "document-ai-worker"
+
+# Upload -> EXTRACTED buckets, seconds
+END_TO_END_BUCKETS_SECONDS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+tracer = trace.get_tracer(SERVICE_NAME)
+meter = metrics.get_meter(SERVICE_NAME)
+
+end_to_end_histogram = meter.create_histogram(
+    "document.end_to_end.duration",
+    unit="s",
+    description="Time from the upload request reaching the API to the document's final worker outcome"
+)
+
+_providers = []
+
+
+def _json_line(item):
+    return item.to_json(indent=None) + os.linesep
+
+
+def init_tracing():
+    """Install tracer and meter providers for TRACE_EXPORTER; safe to call more than once"""
+    if TRACE_EXPORTER == 'none' or _providers:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader, ConsoleMetricExporter
+    from opentelemetry.sdk.metrics.view import View, ExplicitBucketHistogramAggregation
+
+    if TRACE_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        span_exporter = OTLPSpanExporter()
+        metric_exporter = OTLPMetricExporter()
+    elif TRACE_EXPORTER == 'file':
+        span_file = open(TRACE_FILE, 'a', buffering=1)
+        metric_file = open(TRACE_METRICS_FILE, 'a', buffering=1)
+        span_exporter = ConsoleSpanExporter(out=span_file, formatter=_json_line)
+        metric_exporter = ConsoleMetricExporter(out=metric_file, formatter=_json_line)
+    else:
+        span_exporter = ConsoleSpanExporter()
+        metric_exporter = ConsoleMetricExporter()
+
+    resource = Resource.create({"service.name": SERVICE_NAME})
+
+    tracer_provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO)))
+    tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+
+    meter_provider = MeterProvider(
+        resource=resource,
+        metric_readers=[
+            PeriodicExportingMetricReader(metric_exporter, export_interval_millis=TRACE_METRICS_EXPORT_SECONDS * 1000)
+        ],
+        views=[
+            View(
+                instrument_name="document.end_to_end.duration",
+                aggregation=ExplicitBucketHistogramAggregation(END_TO_END_BUCKETS_SECONDS)
+            )
+        ]
+    )
+    metrics.set_meter_provider(meter_provider)
+
+    _providers.extend([tracer_provider, meter_provider])
+    logger.info(f"Tracing enabled ({TRACE_EXPORTER} exporter, sample ratio {TRACE_SAMPLE_RATIO})")
+
+
+def shutdown():
+    """Flush pending spans and metrics"""
+    for provider in _providers:
+        provider.shutdown()
+
+
+def traced(span_name):
+    """Decorator: run the function inside a child span of the current trace"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes):
+    """Add attributes to the current span"""
+    trace.get_current_span().set_attributes(attributes)
+
+
+def bind_context(func):
+    """Carry the caller's trace context into another thread (e.g. the shard executor)"""
+    captured = context.get_current()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = context.attach(captured)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            context.detach(token)
+    return wrapper
+
+
+@contextmanager
+def message_span(attributes, publish_time, **span_attributes):
+    """
+    Span for one Pub/Sub delivery, parented to the publisher's trace context
+
+    A pubsub.queue_wait span covers publish -> receipt: a sibling of the
+    processing span under the API's trace, or its child for messages published
+    without trace context (backfill, manual republish).
+    """
+    parent = propagate.extract(dict(attributes or {}))
+    has_parent = trace.get_current_span(parent).get_span_context().is_valid
+
+    with tracer.start_as_current_span(
+        "process_document", context=parent, kind=SpanKind.CONSUMER, attributes=span_attributes
+    ) as span:
+        if publish_time is not None:
+            tracer.start_span(
+                "pubsub.queue_wait",
+                context=parent if has_parent else None,
+                kind=SpanKind.CONSUMER,
+                start_time=int(publish_time.timestamp() * 1e9)
+            ).end()
+        yield span
+
+
+def record_end_to_end(message_data, publish_time, outcome):
+    """Record upload -> outcome latency for the message's document type"""
+    started = None
+    received_at = message_data.get('received_at')
+    if received_at:
+        try:
+            started = datetime.fromisoformat(received_at.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            started = None
+    if started is None and publish_time is not None:
+        started = publish_time.timestamp()
+    if started is None:
+        return
+
+    end_to_end_histogram.record(
+        max(0.0, time.time() - started),
+        {"document_type": message_data.get('document_type', 'unknown'), "outcome": outcome}
+    )
@@ -4,48 +4,105 @@ Consumes Pub/Sub events, extracts data with Document AI, writes to BigQuery
 """
 
 import os
-import logging
+import io
+import sys
 import json
 import time
-from datetime import datetime
-from google.cloud import pubsub_v1, bigquery, storage
-from google.cloud import documentai_v1 as documentai
+import resource
+import threading
+from datetime import datetime, timedelta, timezone
 from concurrent import futures
-import uuid
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from extraction_results import ExtractionResult
+from status_events import StatusEventWriter, combine_futures
+from case_aggregator import CaseStatusAggregator
+import cpu_stage
+import lane_scheduler
+import graceful_drain
+import preprocess
+import tracing
+import metrics
+import gcp_clients
+import case_projection
+import structured_logging
+from preprocess import UnreadableDocumentError
+from shard_checkpoints import ShardCheckpointStore
+
+# Configure logging (non-blocking; per-step lines of each message are sampled)
+structured_logging.configure({"worker.step": 0.1})
+logger = structured_logging.get_logger(__name__)
 
 # Configuration
 PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
 REGION = os.getenv('REGION', 'us-central1')
 DATASET_ID = os.getenv('DATASET_ID', 'tytan_lending_ops')
 SUBSCRIPTION_ID = os.getenv('SUBSCRIPTION_ID', 'document-ai-worker-sub')
+WORKER_ENGINE = os.getenv('WORKER_ENGINE', 'streaming')  # "streaming" (thread pool) or "asyncio"
+
+# Priority lanes (streaming engine only; main() refuses them with WORKER_ENGINE=asyncio):
+# "name:subscription:weight,..."; empty = single SUBSCRIPTION_ID
+WORKER_LANES = os.getenv('WORKER_LANES', '')
 MOCK_MODE = os.getenv('MOCK_MODE', 'true').lower() == 'true'
 
 # Document AI processor IDs (set these in environment or use mock mode)
 DOCAI_IDENTITY_PROCESSOR = os.getenv('DOCAI_IDENTITY_PROCESSOR', '')
 DOCAI_FORM_PROCESSOR = os.getenv('DOCAI_FORM_PROCESSOR', '')
 
-# Confidence threshold
-CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', '0.85'))
+# Large-document sharding (online processing accepts at most 15 pages per request)
+SHARD_PAGE_THRESHOLD = int(os.getenv('SHARD_PAGE_THRESHOLD', '15'))
+SHARD_PAGE_SIZE = int(os.getenv('SHARD_PAGE_SIZE', '10'))
+SHARD_MAX_WORKERS = int(os.getenv('SHARD_MAX_WORKERS', '8'))
+SHARD_MAX_RETRIES = int(os.getenv('SHARD_MAX_RETRIES', '2'))
+
+# How long an asyncio-engine message waits for its status writes before it is nacked instead of acked
+STATUS_ACK_TIMEOUT_SECONDS = float(os.getenv('STATUS_ACK_TIMEOUT_SECONDS', '30'))
+
+# How far back find_prior_extraction looks for an extraction of the same blob (bounds the partitions scanned)
+EXTRACTION_REUSE_LOOKBACK_DAYS = int(os.getenv('EXTRACTION_REUSE_LOOKBACK_DAYS', '365'))
+
+# Chunk size for ranged GCS reads when inspecting or splitting PDFs
+GCS_READ_CHUNK_BYTES = int(os.getenv('GCS_READ_CHUNK_BYTES', str(1024 * 1024)))
+
+# Only return the parts of the Document proto we parse (entities carry their own
+# page anchors and bounding polys); full text, page images, tokens and layout are dropped
+DOCAI_RESPONSE_FIELDS = ["entities"]
+
+# Shared pool so concurrent documents cannot exceed SHARD_MAX_WORKERS Document AI calls
+shard_executor = futures.ThreadPoolExecutor(
+    max_workers=SHARD_MAX_WORKERS,
+    thread_name_prefix='docai-shard'
+)
 
-# Initialize GCP clients
+# GCP clients are built on first use (see gcp_clients.py); main() warms them before subscribing
 try:
-    subscriber = pubsub_v1.SubscriberClient()
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    storage_client = storage.Client(project=PROJECT_ID)
+    subscriber = gcp_clients.LazyClient("pubsub", gcp_clients.subscriber_client)
+    bq_client = gcp_clients.LazyClient(
+        "bigquery", gcp_clients.bigquery_client, ping=lambda client: client.get_dataset(DATASET_ID)
+    )
+    storage_client = gcp_clients.LazyClient("storage", gcp_clients.storage_client)
 
     if not MOCK_MODE and DOCAI_IDENTITY_PROCESSOR:
-        docai_client = documentai.DocumentProcessorServiceClient()
+        docai_client = gcp_clients.LazyClient(
+            "documentai", gcp_clients.documentai_client,
+            ping=lambda client: client.get_processor(name=DOCAI_IDENTITY_PROCESSOR)
+        )
     else:
         docai_client = None
 
-    subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
+    subscription_path = f"projects/{PROJECT_ID}/subscriptions/{SUBSCRIPTION_ID}"
+
+    # Status transitions are appended to status_events in batches (no UPDATE DML)
+    status_writer = StatusEventWriter(
+        bq_client, f"{PROJECT_ID}.{DATASET_ID}.status_events", source="document-ai-worker", mock_mode=MOCK_MODE
+    )
+
+    # Completed shards are checkpointed so redelivered messages resume
+    checkpoint_store = ShardCheckpointStore(storage_client, mock_mode=MOCK_MODE)
+
+    # Case status read model served to the webhook and GET /cases/<id>
+    projection = gcp_clients.LazyClient(
+        "case_projection", lambda: case_projection.open_projection(MOCK_MODE),
+        ping=lambda store: store.get("CU-0000-00000")
+    )
 
     logger.info(f"Initialized worker for subscription: {subscription_path}")
     logger.info(f"Mock mode: {MOCK_MODE}")
@@ -113,186 +170,629 @@ def extract_fields_mock(document_type):
     return mock_extractions.get(document_type, default_extraction)
 
 
-def extract_fields_real(gcs_uri, processor_name):
-    """Extract fields using Document AI"""
+def read_memory_status():
+    """Return (VmRSS, VmHWM) of this process in MB from /proc/self/status, or None off Linux"""
+    try:
+        usage = {}
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':', 1)
+                    usage[key] = int(value.split()[0]) / 1024
+        return usage['VmRSS'], usage['VmHWM']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+# Lifetime peak RSS, kept here because reset_peak_rss() clears the kernel's VmHWM
+_lifetime_peak_rss_mb = 0.0
+_memory_lock = threading.Lock()
+
+
+def reset_peak_rss():
+    """
+    Restart the kernel's peak RSS counter (VmHWM) so the next reading covers one document
+
+    Returns the current RSS in MB. Other documents processed concurrently share the
+    process, so the peak read afterwards is an upper bound for this document's own.
+    """
+    global _lifetime_peak_rss_mb
+    with _memory_lock:
+        status = read_memory_status()
+        if status is None:
+            return get_memory_usage_mb()[0]
+        _lifetime_peak_rss_mb = max(_lifetime_peak_rss_mb, status[1])
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+        return status[0]
+
+
+def get_document_peak_rss_mb():
+    """Peak RSS in MB since the last reset_peak_rss() (the process peak where it cannot be reset)"""
+    status = read_memory_status()
+    return status[1] if status is not None else get_memory_usage_mb()[1]
+
+
+def get_memory_usage_mb():
+    """Return (current RSS, lifetime peak RSS) of this process in MB"""
+    status = read_memory_status()
+    if status is not None:
+        with _memory_lock:
+            return status[0], max(_lifetime_peak_rss_mb, status[1])
+    # Non-Linux fallback: ru_maxrss is reported in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return peak, peak
+
+
+def get_blob(gcs_uri):
+    """Resolve a gs:// URI to a Storage blob with its metadata loaded"""
+    if not gcs_uri.startswith("gs://"):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+
+    bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise ValueError(f"Document not found: {gcs_uri}")
+
+    return blob
+
+
+@tracing.traced("preprocess")
+@metrics.timed("preprocess")
+def prepare_document(blob):
+    """
+    Detect the real file type from magic bytes and prepare images for extraction
+
+    Raises UnreadableDocumentError for empty, unrecognized or undecodable files.
+    """
+    if not blob.size:
+        raise UnreadableDocumentError("Empty file")
+
+    header = blob.download_as_bytes(start=0, end=preprocess.SNIFF_BYTES - 1)
+    mime_type = preprocess.sniff_mime_type(header)
+    if mime_type is None:
+        raise UnreadableDocumentError(f"Unrecognized file type (uploaded as {blob.content_type})")
+    if mime_type != blob.content_type:
+        logger.info(f"{blob.name} was uploaded as {blob.content_type} but is {mime_type}")
+
+    if mime_type == "application/pdf":
+        return preprocess.PreparedDocument(mime_type)
+
+    with tracing.tracer.start_as_current_span("gcs.download"), metrics.stage("gcs.download", "gcs"):
+        shared_image = cpu_stage.SharedDocument.from_blob(blob)
+    with shared_image:
+        prepared = cpu_stage.prepare_image(shared_image, mime_type)
+
+    if prepared.content is not None:
+        logger.info(
+            "Prepared image", sample="worker.step", blob=blob.name, size_bytes=blob.size,
+            prepared_bytes=len(prepared.content), notes=prepared.notes
+        )
+    return prepared
+
+
+@tracing.traced("gcs.read_pdf_index")
+@metrics.timed("gcs.read_pdf_index", "gcs")
+def count_pdf_pages(blob):
+    """
+    Count pages of a PDF in GCS using ranged reads
+
+    pypdf only reads the trailer, xref table and page tree, so the document is
+    never fully buffered. Returns None if the blob is not a readable PDF.
+    """
+    from pypdf import PdfReader
+
     try:
-        # Download document from GCS
-        if gcs_uri.startswith("gs://"):
-            # Parse GCS URI
-            parts = gcs_uri.replace("gs://", "").split("/", 1)
-            bucket_name = parts[0]
-            blob_name = parts[1]
-
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            document_content = blob.download_as_bytes()
+        with blob.open('rb', chunk_size=GCS_READ_CHUNK_BYTES) as stream:
+            return len(PdfReader(stream).pages)
+    except Exception as e:
+        logger.info(f"Could not read {blob.name} as PDF, sending as a single document: {e}")
+        return None
+
+
+def plan_shards(page_count, pages_per_shard):
+    """
+    Split a page count into page-range shards
+
+    Returns a list of (start_page, end_page) tuples with zero-based, end-exclusive
+    page indexes, or None if the document is small enough to process whole.
+    """
+    if page_count is None or page_count <= SHARD_PAGE_THRESHOLD:
+        return None
+
+    shards = [
+        (start, min(start + pages_per_shard, page_count))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+
+    logger.info(
+        "Split document into shards", sample="worker.step", page_count=page_count, shards=len(shards),
+        pages_per_shard=pages_per_shard
+    )
+    return shards
+
+
+@tracing.traced("gcs.read_pages")
+@metrics.timed("gcs.read_pages", "gcs")
+def read_pdf_page_range(blob, start_page, end_page):
+    """Build a standalone PDF containing only pages [start_page, end_page) of a GCS blob"""
+    from pypdf import PdfReader, PdfWriter
+
+    with blob.open('rb', chunk_size=GCS_READ_CHUNK_BYTES) as stream:
+        reader = PdfReader(stream)
+        writer = PdfWriter()
+        for page_index in range(start_page, end_page):
+            writer.add_page(reader.pages[page_index])
+
+        buffer = io.BytesIO()
+        writer.write(buffer)
+
+    return buffer.getvalue()
+
+
+def build_process_request(processor_name, gcs_uri=None, content=None, mime_type="application/pdf"):
+    """Build a trimmed ProcessRequest from either a GCS reference or in-memory bytes"""
+    from google.cloud import documentai_v1 as documentai
+    from google.protobuf import field_mask_pb2
+
+    request = documentai.ProcessRequest(
+        name=processor_name,
+        field_mask=field_mask_pb2.FieldMask(paths=DOCAI_RESPONSE_FIELDS)
+    )
+
+    if gcs_uri:
+        request.gcs_document = documentai.GcsDocument(gcs_uri=gcs_uri, mime_type=mime_type)
+    else:
+        request.raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
+
+    return request
+
+
+def build_whole_document_request(processor_name, gcs_uri, prepared):
+    """Send prepared image bytes inline, or the original object by GCS reference"""
+    if prepared.content is not None:
+        return build_process_request(processor_name, content=prepared.content, mime_type=prepared.mime_type)
+    return build_process_request(processor_name, gcs_uri=gcs_uri, mime_type=prepared.mime_type)
+
+
+@tracing.traced("shard")
+def process_shard(blob, gcs_uri, processor_name, page_range, shared_document=None, prepared=None):
+    """
+    Send one shard to Document AI and return its fields with corrected page numbers
+
+    A page_range of None sends the whole (prepared) document; otherwise only that
+    page range is materialized in memory, cut from shared_document by the CPU
+    stage when one is given and from ranged GCS reads otherwise.
+    """
+    if page_range is None:
+        prepared = prepared or preprocess.PreparedDocument(blob.content_type or "application/pdf")
+        request = build_whole_document_request(processor_name, gcs_uri, prepared)
+        page_offset = 0
+    else:
+        page_offset = page_range[0]
+        if shared_document is not None:
+            content = cpu_stage.split_pdf_pages(shared_document, *page_range)
         else:
-            raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+            content = read_pdf_page_range(blob, *page_range)
+        request = build_process_request(processor_name, content=content, mime_type="application/pdf")
+        del content
 
-        # Prepare Document AI request
-        raw_document = documentai.RawDocument(
-            content=document_content,
-            mime_type="application/pdf"  # Assume PDF for now
-        )
+    with tracing.tracer.start_as_current_span("documentai.process_document", attributes={"processor": processor_name}), \
+            metrics.stage("documentai.process_document", "documentai"):
+        result = docai_client.process_document(request=request)
+    document = result.document
+    del result
+
+    return ExtractionResult.from_columns(cpu_stage.parse_entities(document, page_offset))
+
+
+def extract_fields_from_shards(
+    blob, gcs_uri, processor_name, shards, shared_document=None, checkpoint=None, prepared=None
+):
+    """
+    Process shards concurrently and merge their fields in page order
+
+    Only shards that failed are resubmitted, up to SHARD_MAX_RETRIES times.
+    Shards already checkpointed by an earlier delivery are not re-extracted.
+    """
+    shard_results = checkpoint.completed(shards) if checkpoint else {}
+    pending = [index for index in range(len(shards)) if index not in shard_results]
+    last_error = None
+
+    for attempt in range(SHARD_MAX_RETRIES + 1):
+        if attempt > 0:
+            logger.warning(f"Retrying {len(pending)} failed shard(s), attempt {attempt + 1}")
+            time.sleep(2 ** (attempt - 1))
+
+        submitted = {
+            shard_executor.submit(
+                tracing.bind_context(process_shard), blob, gcs_uri, processor_name, shards[index],
+                shared_document, prepared
+            ): index
+            for index in pending
+        }
+
+        failed = []
+        for future in futures.as_completed(submitted):
+            index = submitted[future]
+            try:
+                shard_results[index] = future.result()
+                if checkpoint:
+                    checkpoint.save(shards[index], shard_results[index])
+            except Exception as e:
+                logger.error(f"Shard {index} (pages {shards[index]}) failed: {e}")
+                last_error = e
+                failed.append(index)
+
+        pending = sorted(failed)
+        if not pending:
+            break
+
+    if pending:
+        raise Exception(f"{len(pending)} of {len(shards)} shards failed after retries: {last_error}")
+
+    return ExtractionResult.concatenate([shard_results.pop(index) for index in range(len(shards))])
+
+
+def extract_fields_real(gcs_uri, processor_name, checkpoint=None):
+    """Extract fields using Document AI"""
+    try:
+        blob = get_blob(gcs_uri)
+        if checkpoint:
+            checkpoint.bind(blob, processor_name)
 
-        request = documentai.ProcessRequest(
-            name=processor_name,
-            raw_document=raw_document
-        )
+        # Sniff the real type; images are rotated, deskewed and downscaled first
+        prepared = prepare_document(blob)
+
+        # Split large PDFs into page ranges that are processed in parallel;
+        # everything else goes to Document AI whole
+        page_count = count_pdf_pages(blob) if prepared.mime_type == "application/pdf" else None
+        shards = plan_shards(page_count, SHARD_PAGE_SIZE)
+
+        # With the CPU stage enabled, download once into shared memory and let pool
+        # processes cut the shards; otherwise each shard is cut from ranged reads
+        shared_document = None
+        if shards and cpu_stage.get_pool() is not None:
+            with tracing.tracer.start_as_current_span("gcs.download"), metrics.stage("gcs.download", "gcs"):
+                shared_document = cpu_stage.SharedDocument.from_blob(blob)
 
         # Call Document AI
-        logger.info(f"Calling Document AI processor: {processor_name}")
-        result = docai_client.process_document(request=request)
+        try:
+            logger.info(
+                "Calling Document AI processor", sample="worker.step", processor=processor_name,
+                shards=len(shards or [None])
+            )
+            extraction = extract_fields_from_shards(
+                blob, gcs_uri, processor_name, shards or [None], shared_document, checkpoint, prepared
+            )
+        finally:
+            if shared_document is not None:
+                shared_document.close()
 
-        # Parse entities
-        extracted_fields = []
-        for entity in result.document.entities:
-            field = {
-                "field_name": entity.type_,
-                "value": entity.mention_text,
-                "confidence": entity.confidence,
-                "page_number": entity.page_anchor.page_refs[0].page if entity.page_anchor.page_refs else 0,
-                "bounding_box": json.dumps({
-                    "vertices": [
-                        {"x": v.x, "y": v.y}
-                        for v in entity.page_anchor.page_refs[0].bounding_poly.vertices
-                    ]
-                }) if entity.page_anchor.page_refs and entity.page_anchor.page_refs[0].bounding_poly else None
-            }
-            extracted_fields.append(field)
-
-        logger.info(f"Extracted {len(extracted_fields)} fields")
-        return extracted_fields
+        logger.info("Extracted fields", sample="worker.step", fields=len(extraction))
+        return extraction
 
+    except UnreadableDocumentError:
+        raise
     except Exception as e:
         logger.error(f"Document AI extraction failed: {e}", exc_info=True)
         raise
 
 
-def check_if_already_processed(case_id, document_id):
-    """Check if extraction already exists (idempotency)"""
+def stored_bounding_box(value):
+    """A bounding_box read back from BigQuery, as the JSON text the extractor produces"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def extraction_from_rows(rows):
+    """Rebuild an ExtractionResult from extracted_fields rows (missing page numbers become 0)"""
+    return ExtractionResult.from_columns(
+        (
+            row['field_name'],
+            row['value'],
+            row['confidence'],
+            row['page_number'] if row['page_number'] is not None else 0,
+            stored_bounding_box(row['bounding_box'])
+        )
+        for row in rows
+    )
+
+
+@tracing.traced("bigquery.load_recorded_extraction")
+def load_recorded_extraction(case_id, document_id, uploaded_at=None):
+    """
+    The fields already written for this document, or None (idempotency)
+
+    A redelivered message whose fields exist is not extracted again, but its document
+    status is replayed from these fields: the earlier delivery may have failed after
+    writing the fields and before its status event was written.
+    """
     try:
         query = f"""
-            SELECT COUNT(*) as count
+            SELECT field_name, value, COALESCE(confidence, 0) AS confidence, page_number, bounding_box
             FROM `{PROJECT_ID}.{DATASET_ID}.extracted_fields`
             WHERE case_id = @case_id AND document_id = @document_id
+                AND is_corrected IS NOT TRUE
+                {"AND extracted_at >= @uploaded_at" if uploaded_at else ""}
+        """
+
+        from google.cloud import bigquery
+
+        parameters = [
+            bigquery.ScalarQueryParameter("case_id", "STRING", case_id),
+            bigquery.ScalarQueryParameter("document_id", "STRING", document_id)
+        ]
+        if uploaded_at:
+            # Fields are extracted after the upload, so older partitions can be skipped
+            parameters.append(bigquery.ScalarQueryParameter("uploaded_at", "TIMESTAMP", uploaded_at))
+        job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+
+        with metrics.stage("bigquery.check_processed", "bigquery"):
+            rows = list(bq_client.query(query, job_config=job_config).result())
+
+        return extraction_from_rows(rows) if rows else None
+
+    except Exception as e:
+        logger.error(f"Error checking if already processed: {e}")
+        return None
+
+
+@tracing.traced("bigquery.find_prior_extraction")
+@metrics.timed("bigquery.find_prior_extraction", "bigquery")
+def find_prior_extraction(gcs_uri, document_id, processor_id):
+    """
+    Latest extraction of the same blob for another document, or None
+
+    Documents with identical bytes share one content-addressed blob (see the API's
+    blob_store.py), so an earlier extraction of that gcs_uri by the same processor
+    is the result Document AI would return again. Reviewer corrections belong to the
+    earlier document and are not carried over. An earlier extraction with a field
+    missing its confidence is not reused (it could not be scored the same way).
+    """
+    try:
+        query = f"""
+            SELECT
+                e.field_name,
+                e.value,
+                e.confidence,
+                e.page_number,
+                e.bounding_box
+            FROM `{PROJECT_ID}.{DATASET_ID}.extracted_fields` e
+            JOIN `{PROJECT_ID}.{DATASET_ID}.documents` d
+                ON e.document_id = d.document_id
+            WHERE d.gcs_uri = @gcs_uri
+                AND e.document_id != @document_id
+                AND e.processor_id = @processor_id
+                AND e.is_corrected IS NOT TRUE
+                AND e.extracted_at >= @since
+                AND d.uploaded_at >= @since
+            QUALIFY DENSE_RANK() OVER (ORDER BY e.extracted_at DESC, e.document_id) = 1
+            ORDER BY e.page_number, e.field_name
         """
 
+        from google.cloud import bigquery
+
+        since = datetime.now(timezone.utc) - timedelta(days=EXTRACTION_REUSE_LOOKBACK_DAYS)
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("case_id", "STRING", case_id),
-                bigquery.ScalarQueryParameter("document_id", "STRING", document_id)
+                bigquery.ScalarQueryParameter("gcs_uri", "STRING", gcs_uri),
+                bigquery.ScalarQueryParameter("document_id", "STRING", document_id),
+                bigquery.ScalarQueryParameter("processor_id", "STRING", processor_id),
+                bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)
             ]
         )
 
-        result = bq_client.query(query, job_config=job_config).result()
-        row = list(result)[0]
-
-        return row['count'] > 0
+        rows = list(bq_client.query(query, job_config=job_config).result())
+        if any(row['confidence'] is None for row in rows):
+            logger.info("Prior extraction has fields without confidence, extracting again", gcs_uri=gcs_uri)
+            rows = []
+        extraction = extraction_from_rows(rows) if rows else None
 
     except Exception as e:
-        logger.error(f"Error checking if already processed: {e}")
-        return False
+        # Extracting again is always correct, only slower
+        logger.warning(f"Could not look up a prior extraction of {gcs_uri}: {e}")
+        metrics.extraction_reuse.labels("error").inc()
+        return None
+
+    if extraction is None:
+        metrics.extraction_reuse.labels("miss").inc()
+        return None
 
+    metrics.extraction_reuse.labels("hit").inc()
+    logger.info("Reusing prior extraction", document_id=document_id, gcs_uri=gcs_uri, fields=len(rows))
+    return extraction
 
-def write_extracted_fields(case_id, document_id, fields, processor_id):
+
+@tracing.traced("bigquery.write_fields")
+@metrics.timed("bigquery.write_fields", "bigquery")
+def write_extracted_fields(case_id, document_id, extraction, processor_id):
     """Write extracted fields to BigQuery"""
     try:
         table_id = f"{PROJECT_ID}.{DATASET_ID}.extracted_fields"
 
-        rows_to_insert = []
-        for field in fields:
-            row = {
-                "extraction_id": str(uuid.uuid4()),
-                "case_id": case_id,
-                "document_id": document_id,
-                "field_name": field['field_name'],
-                "value": str(field['value']),
-                "confidence": float(field['confidence']),
-                "page_number": field.get('page_number', 0),
-                "bounding_box": field.get('bounding_box'),
-                "extracted_at": datetime.utcnow().isoformat() + "Z",
-                "processor_id": processor_id,
-                "is_corrected": False
-            }
-            rows_to_insert.append(row)
+        rows_to_insert = extraction.to_bigquery_rows(
+            case_id, document_id, processor_id, datetime.utcnow().isoformat() + "Z"
+        )
 
         if MOCK_MODE:
-            logger.info(f"[MOCK] Would insert {len(rows_to_insert)} rows into {table_id}")
+            logger.info("[MOCK] Would insert extracted fields", rows=len(rows_to_insert), table=table_id)
         else:
             errors = bq_client.insert_rows_json(table_id, rows_to_insert)
             if errors:
                 logger.error(f"Failed to insert extracted fields: {errors}")
                 raise Exception(f"BigQuery insert failed: {errors}")
 
-        logger.info(f"Inserted {len(rows_to_insert)} extracted fields for document {document_id}")
+        logger.info(
+            "Inserted extracted fields", sample="worker.step", rows=len(rows_to_insert), document_id=document_id
+        )
 
     except Exception as e:
         logger.error(f"Error writing extracted fields: {e}", exc_info=True)
         raise
 
 
-def update_case_status(case_id, avg_confidence):
-    """Update case status based on extraction confidence"""
-    try:
-        if avg_confidence < CONFIDENCE_THRESHOLD:
-            new_status = "NEEDS_REVIEW"
-        else:
-            new_status = "READY_FOR_REVIEW"
+@metrics.timed("bigquery.load_case", "bigquery")
+def load_case_state(case_id):
+    """Load a case's loan type and its documents' current review outcome (aggregator seed)"""
+    if MOCK_MODE:
+        return None, []
+
+    query = f"""
+        SELECT
+            c.loan_type,
+            d.document_id,
+            d.document_type,
+            COALESCE(s.status, d.status) AS status
+        FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.documents` d
+            ON c.case_id = d.case_id
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.document_status_current` s
+            ON d.document_id = s.document_id
+        WHERE c.case_id = @case_id
+    """
+
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
+        ]
+    )
 
-        if MOCK_MODE:
-            logger.info(f"[MOCK] Would update case {case_id} to status: {new_status}")
-        else:
-            query = f"""
-                UPDATE `{PROJECT_ID}.{DATASET_ID}.cases`
-                SET status = @status, updated_at = CURRENT_TIMESTAMP()
-                WHERE case_id = @case_id
-            """
-
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("status", "STRING", new_status),
-                    bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
-                ]
-            )
+    loan_type = None
+    documents = []
+    for row in bq_client.query(query, job_config=job_config).result():
+        loan_type = row['loan_type']
+        # Only documents that finished extraction count towards the combined status
+        if row['document_id'] and row['status'] in ("EXTRACTED", "NEEDS_REVIEW"):
+            documents.append((row['document_id'], row['document_type'], row['status'] == "NEEDS_REVIEW"))
 
-            bq_client.query(query, job_config=job_config).result()
+    return loan_type, documents
 
-        logger.info(f"Updated case {case_id} status to {new_status} (avg confidence: {avg_confidence:.2f})")
+
+def update_case_status(case_id, new_status, summary):
+    """Record a case status transition computed from the case's combined document state"""
+    try:
+        event = status_writer.append("case", case_id, case_id, new_status, summary)
+        projection.status_changed(case_id, new_status, event["event_time"])
+
+        logger.info(
+            "Updated case status", case_id=case_id, status=new_status, documents_seen=summary['documents_seen'],
+            missing_documents=summary['missing_documents']
+        )
+        # The aggregator settles the messages behind this status once the event is written
+        return status_writer.written([event])
 
     except Exception as e:
         logger.error(f"Error updating case status: {e}", exc_info=True)
+        raise
 
 
-def update_document_status(document_id, status):
-    """Update document processing status"""
+@tracing.traced("status.document_update")
+def update_document_status(document_id, status, case_id=None):
+    """Record a document processing status transition; returns the buffered event"""
     try:
-        if MOCK_MODE:
-            logger.info(f"[MOCK] Would update document {document_id} to status: {status}")
-        else:
-            query = f"""
-                UPDATE `{PROJECT_ID}.{DATASET_ID}.documents`
-                SET status = @status
-                WHERE document_id = @document_id
-            """
-
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("status", "STRING", status),
-                    bigquery.ScalarQueryParameter("document_id", "STRING", document_id)
-                ]
-            )
-
-            bq_client.query(query, job_config=job_config).result()
+        event = status_writer.append("document", document_id, case_id, status)
 
-        logger.info(f"Updated document {document_id} status to {status}")
+        logger.info("Updated document status", sample="worker.step", document_id=document_id, status=status)
+        return event
 
     except Exception as e:
         logger.error(f"Error updating document status: {e}", exc_info=True)
+        return None
+
+
+def status_written(events, *pending):
+    """Future for the status events being written, together with other pending status writes"""
+    return combine_futures([status_writer.written([event for event in events if event is not None]), *pending])
+
+
+def settle_when_written(message, written, on_ack=None):
+    """
+    Ack the message once its status writes are in BigQuery, nack it if they fail
+
+    The writes are buffered in memory, so acking earlier could lose them with the
+    instance; waiting on a callback keeps the handler thread free meanwhile. Until
+    settled the message stays leased and counts as in flight for the drain.
+    """
+    def settle(done):
+        if done.exception() is not None:
+            logger.error(f"Status writes failed, nacking message for redelivery: {done.exception()}")
+            message.nack()
+            return
+        message.ack()
+        if on_ack is not None:
+            on_ack()
+
+    written.add_done_callback(settle)
+
+
+# One combined status write per case per flush window
+case_aggregator = CaseStatusAggregator(load_case_state, update_case_status)
+
+
+def resolve_processor_name(document_type):
+    """Return the processor for a document type, falling back to the generic form parser"""
+    processor_name = get_processor_for_document_type(document_type)
+    if not processor_name:
+        logger.warning(f"No processor configured for document type: {document_type}")
+        # Use generic form parser as fallback
+        processor_name = DOCAI_FORM_PROCESSOR
+
+    return processor_name
+
+
+def record_extraction(case_id, document_id, document_type, extraction, processor_id, loan_type=None,
+                      write_fields=True):
+    """
+    Write extracted fields, score them and update document and case status
+
+    Returns (score, future for the document and case status writes, to wait for
+    before acking). write_fields=False replays only the document status for fields
+    that were already written; the case status is left alone, since one emitted now
+    would overwrite any later case status.
+    """
+    # Write to BigQuery
+    if write_fields:
+        write_extracted_fields(case_id, document_id, extraction, processor_id)
+
+    # Score against per-document-type and per-field thresholds
+    score = extraction.score(document_type)
+    if score['low_confidence_fields']:
+        logger.info(
+            "Low confidence fields", document_id=document_id, fields=score['low_confidence_fields']
+        )
+
+    # Update document status
+    if score['needs_review']:
+        event = update_document_status(document_id, "NEEDS_REVIEW", case_id)
+    else:
+        event = update_document_status(document_id, "EXTRACTED", case_id)
+
+    if not write_fields:
+        case_aggregator.note(case_id, document_id, document_type, score)
+        return score, status_written([event])
+
+    # Fold into the case's combined state; the aggregator writes the case status
+    case_written = case_aggregator.record(case_id, document_id, document_type, score, loan_type)
+
+    return score, status_written([event], case_written)
 
 
 def process_message(message):
-    """Process a single Pub/Sub message"""
+    """Process a single Pub/Sub message, continuing the uploader's trace"""
+    with tracing.message_span(getattr(message, 'attributes', None), getattr(message, 'publish_time', None)), \
+            metrics.in_flight.track_inprogress(), metrics.stage("message"):
+        handle_message(message)
+
+
+def handle_message(message):
+    """Extract one document and record its results"""
     try:
         # Parse message
         message_data = json.loads(message.data.decode('utf-8'))
@@ -300,52 +800,71 @@ def process_message(message):
         document_id = message_data['document_id']
         gcs_uri = message_data['gcs_uri']
         document_type = message_data.get('document_type', 'unknown')
+        tracing.annotate(case_id=case_id, document_id=document_id, document_type=document_type)
 
-        logger.info(f"Processing document {document_id} for case {case_id}")
+        logger.info("Processing document", sample="worker.step", document_id=document_id, case_id=case_id)
+        rss_start_mb = reset_peak_rss()
 
-        # Check if already processed (idempotency)
-        if not MOCK_MODE and check_if_already_processed(case_id, document_id):
-            logger.info(f"Document {document_id} already processed, skipping")
-            message.ack()
+        # Check if already processed (idempotency); its document status is replayed before the ack
+        recorded = None if MOCK_MODE else load_recorded_extraction(
+            case_id, document_id, message_data.get('timestamp')
+        )
+        if recorded is not None:
+            logger.info(f"Document {document_id} already processed, replaying its document status")
+            _, written = record_extraction(
+                case_id, document_id, document_type, recorded, None, message_data.get('loan_type'),
+                write_fields=False
+            )
+            settle_when_written(message, written)
             return
 
         # Update document status to EXTRACTING
-        update_document_status(document_id, "EXTRACTING")
+        extracting_event = update_document_status(document_id, "EXTRACTING", case_id)
 
         # Extract fields
+        checkpoint = checkpoint_store.open(document_id)
         if MOCK_MODE:
-            logger.info(f"[MOCK] Extracting fields from {gcs_uri}")
-            extracted_fields = extract_fields_mock(document_type)
+            logger.info("[MOCK] Extracting fields", gcs_uri=gcs_uri)
+            extraction = ExtractionResult.from_fields(extract_fields_mock(document_type))
             processor_id = "mock-processor"
         else:
-            processor_name = get_processor_for_document_type(document_type)
-            if not processor_name:
-                logger.warning(f"No processor configured for document type: {document_type}")
-                # Use generic form parser as fallback
-                processor_name = DOCAI_FORM_PROCESSOR
-
-            extracted_fields = extract_fields_real(gcs_uri, processor_name)
+            processor_name = resolve_processor_name(document_type)
+            # The API marks uploads whose bytes were already stored for another document
+            extraction = None
+            if message_data.get('blob_reused'):
+                extraction = find_prior_extraction(gcs_uri, document_id, processor_name)
+            if extraction is None:
+                extraction = extract_fields_real(gcs_uri, processor_name, checkpoint)
             processor_id = processor_name
 
-        # Write to BigQuery
-        write_extracted_fields(case_id, document_id, extracted_fields, processor_id)
-
-        # Calculate average confidence
-        confidences = [f['confidence'] for f in extracted_fields]
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-
-        # Update document status
-        if avg_confidence < CONFIDENCE_THRESHOLD:
-            update_document_status(document_id, "NEEDS_REVIEW")
-        else:
-            update_document_status(document_id, "EXTRACTED")
+        # Write results and update statuses
+        score, written = record_extraction(
+            case_id, document_id, document_type, extraction, processor_id, message_data.get('loan_type')
+        )
+        if checkpoint:
+            checkpoint.discard()
+
+        rss_end_mb, _ = get_memory_usage_mb()
+        peak_rss_mb = get_document_peak_rss_mb()
+        logger.info(
+            "Successfully processed document", document_id=document_id, case_id=case_id,
+            weighted_confidence=round(score['weighted_confidence'], 2), rss_start_mb=round(rss_start_mb),
+            rss_end_mb=round(rss_end_mb), peak_rss_mb=round(peak_rss_mb)
+        )
 
-        # Update case status
-        update_case_status(case_id, avg_confidence)
+        # Acknowledge message once its status writes are durable
+        settle_when_written(
+            message, status_written([extracting_event], written),
+            on_ack=lambda: tracing.record_end_to_end(message_data, getattr(message, 'publish_time', None), "extracted")
+        )
 
-        # Acknowledge message
-        logger.info(f"Successfully processed document {document_id} (avg confidence: {avg_confidence:.2f})")
-        message.ack()
+    except UnreadableDocumentError as e:
+        # Retrying cannot help; the member has to upload the document again
+        logger.warning(f"Skipping extraction for unreadable document {document_id}: {e}")
+        settle_when_written(
+            message, status_written([update_document_status(document_id, "UNREADABLE", case_id)]),
+            on_ack=lambda: tracing.record_end_to_end(message_data, getattr(message, 'publish_time', None), "unreadable")
+        )
 
     except Exception as e:
         logger.error(f"Error processing message: {e}", exc_info=True)
@@ -353,6 +872,11 @@ def process_message(message):
         message.nack()
 
 
+# Turns away new messages and tracks in-flight ones once SIGTERM arrives; messages that
+# finished extraction wait on their case status, so the aggregator stops batching then
+drain_controller = graceful_drain.DrainController(on_drain=case_aggregator.hurry)
+
+
 def callback(message):
     """Pub/Sub message callback"""
     try:
@@ -364,25 +888,99 @@ def callback(message):
 
 def main():
     """Main worker loop"""
+    if WORKER_ENGINE == 'asyncio' and WORKER_LANES:
+        # The asyncio engine pulls SUBSCRIPTION_ID only; starting it would leave the lane subscriptions unserved
+        raise ValueError("WORKER_LANES is not supported with WORKER_ENGINE=asyncio; unset one of them")
+
     logger.info("Starting Document AI Worker...")
     logger.info(f"Subscription: {subscription_path}")
     logger.info(f"Mock mode: {MOCK_MODE}")
+    logger.info(f"Engine: {WORKER_ENGINE}")
+    tracing.init_tracing()
+    metrics.start_server()
+
+    # Messages that arrive first wait on these builds instead of starting their own
+    gcp_clients.warm_up(projection, *(() if MOCK_MODE else (bq_client, storage_client, docai_client)))
+
+    if WORKER_ENGINE == 'asyncio':
+        import async_engine
+        shutdown(async_engine.main(sys.modules[__name__]))
+        return
+
+    if WORKER_LANES:
+        run_lanes()
+        return
+
+    drain_controller.install()
 
     # Subscribe to Pub/Sub
-    streaming_pull_future = subscriber.subscribe(subscription_path, callback=callback)
+    streaming_pull_future = subscriber.subscribe(
+        subscription_path,
+        callback=drain_controller.stream_callback(subscription_path, metrics.tracked(drain_controller.wrap(callback)))
+    )
 
     logger.info("Listening for messages...")
 
-    # Keep worker running
-    with subscriber:
-        try:
-            streaming_pull_future.result()
-        except TimeoutError:
-            streaming_pull_future.cancel()
-            streaming_pull_future.result()
-        except KeyboardInterrupt:
-            logger.info("Shutting down worker...")
-            streaming_pull_future.cancel()
+    # On SIGTERM the stream is closed right away, so nothing new is delivered, and
+    # in-flight messages get the drain grace period
+    with subscriber.build():
+        if drain_controller.wait_for_signal(streaming_pull_future):
+            drain_controller.stop_pulling(subscriber, streaming_pull_future)
+            drain_controller.drain()
+        logger.info("Shutting down worker...")
+        streaming_pull_future.cancel()
+        shutdown(drain_controller.shutdown_deadline())
+
+
+def run_lanes():
+    """Serve the interactive/standard/bulk subscriptions from one shared thread pool"""
+    lanes = [
+        (name, subscriber.subscription_path(PROJECT_ID, lane_subscription_id), weight)
+        for name, lane_subscription_id, weight in lane_scheduler.parse_lanes(WORKER_LANES)
+    ]
+    drain_controller.install()
+    scheduler = lane_scheduler.LaneScheduler(
+        subscriber, lanes, handler=drain_controller.wrap(callback), on_receive=metrics.received,
+        wrap_stream=drain_controller.stream_callback
+    )
+    metrics.watch_lanes(scheduler)
+    scheduler.start()
+
+    logger.info("Listening for messages on priority lanes...")
+
+    with subscriber.build():
+        if drain_controller.wait_for_signal(*scheduler.pull_futures):
+            # Nothing new is delivered; queued messages go back right away, in-flight ones get the grace period
+            drain_controller.stop_pulling(subscriber, *scheduler.pull_futures)
+            scheduler.release_queued()
+            drain_controller.drain()
+        logger.info("Shutting down worker...")
+        deadline = drain_controller.shutdown_deadline()
+        shutdown(deadline)
+        # Threads still busy belong to messages nacked at the end of the grace period
+        scheduler.stop(timeout=max(0.0, deadline - time.monotonic()))
+
+
+def shutdown(deadline=None):
+    """
+    Flush case and status state, then stop the CPU pool and tracing
+
+    With a deadline (SIGTERM), every step is bounded so the whole shutdown ends
+    by then; the flushes go first since messages are acked on them. Without one
+    (benchmark, backfill) each step runs to completion.
+    """
+    if deadline is None:
+        case_aggregator.close()
+        status_writer.close()
+        cpu_stage.shutdown_pool()
+        tracing.shutdown()
+        return
+
+    graceful_drain.run_bounded(case_aggregator.close, deadline - time.monotonic(), "case_aggregator")
+    graceful_drain.run_bounded(status_writer.close, deadline - time.monotonic(), "status_writer")
+    # Work still on the CPU pool belongs to messages that were already nacked
+    cpu_stage.shutdown_pool(wait=False)
+    graceful_drain.run_bounded(tracing.shutdown, deadline - time.monotonic(), "tracing")
 
 
 if __name__ == '__main__':
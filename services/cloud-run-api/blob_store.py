@@ -0,0 +1,236 @@
+"""
+Tytan LendingOps & MemberAssist - Content-addressed document storage
+Uploaded files are stored once per content, at blobs/sha256/<ab>/<sha256>, and
+every document with those bytes (in any case) points its gcs_uri there. An
+upload whose hash is already stored skips the transfer, and the worker reuses
+the earlier extraction of the blob instead of calling Document AI again.
+
+A blob's references are the documents rows naming it. Those rows expire with
+the documents table's partitions, i.e. after the retention period, so a blob is
+kept until the last reference to it has expired; the bucket's age-based delete
+only applies to the older cases/<case_id>/<document_id>.<ext> layout.
+
+    python blob_store.py refs <sha256>        # documents pointing at a blob
+    python blob_store.py gc --dry-run         # blobs no document points at
+
+An upload records its reference on the blob before its documents row is
+written: storing the blob, or reusing one, updates the blob's metadata
+(referenced_at). gc only considers blobs whose metadata is older than
+BLOB_GC_GRACE_HOURS, which leaves time for the documents row to land, and
+deletes them on the metageneration it listed. A blob reused while gc runs has
+a newer metageneration, so its delete fails and the blob is kept; a blob gc has
+already deleted cannot be reused, so the upload stores the bytes again.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
+DATASET_ID = os.getenv('DATASET_ID', 'tytan_lending_ops')
+BUCKET_NAME = os.getenv('BUCKET_NAME', f'{PROJECT_ID}-lending-docs')
+
+BLOB_PREFIX = "blobs/sha256/"
+
+# Unreferenced blobs referenced more recently than this are left alone (their documents row may still be on its way)
+BLOB_GC_GRACE_HOURS = float(os.getenv('BLOB_GC_GRACE_HOURS', '24'))
+
+
+def blob_path(file_hash):
+    """Object name for content with this SHA-256 (hex)"""
+    return f"{BLOB_PREFIX}{file_hash[:2]}/{file_hash}"
+
+
+class BlobStore:
+    """Document bytes stored once per SHA-256 in the documents bucket"""
+
+    def __init__(self, storage_client, bucket_name=BUCKET_NAME, mock_mode=False):
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.mock_mode = mock_mode
+        # Mock mode remembers hashes in memory so repeat uploads behave as in production
+        self.mock_hashes = set()
+        self.mock_lock = threading.Lock()
+
+    def uri(self, file_hash):
+        return f"gs://{self.bucket_name}/{blob_path(file_hash)}"
+
+    def store(self, content, file_hash, content_type=None):
+        """
+        Make sure the blob for file_hash exists and is marked as just referenced;
+        returns True if the bytes were stored, False if a stored blob was reused
+        """
+        # A blob gc deletes between the two steps is found missing on the next touch and stored again
+        for _ in range(3):
+            if self.touch(file_hash):
+                return False
+            if self.upload(content, file_hash, content_type):
+                return True
+        raise RuntimeError(f"Blob for {file_hash} was deleted on every attempt to reference it")
+
+    def touch(self, file_hash):
+        """
+        Mark an existing blob as referenced now; returns False if it does not exist
+
+        The metadata update bumps the blob's metageneration, which makes a gc delete
+        of the metageneration it listed earlier fail.
+        """
+        if self.mock_mode:
+            with self.mock_lock:
+                return file_hash in self.mock_hashes
+
+        from google.api_core import exceptions
+
+        blob = self.storage_client.bucket(self.bucket_name).blob(blob_path(file_hash))
+        blob.metadata = {"referenced_at": datetime.now(timezone.utc).isoformat()}
+        with metrics.stage("gcs.blob_touch", "gcs") as stage:
+            try:
+                blob.patch()
+            except exceptions.NotFound:
+                return False
+            except Exception:
+                stage.error()
+                raise
+        return True
+
+    def upload(self, content, file_hash, content_type=None):
+        """
+        Store content under its hash; returns False if it turned out to be there already
+
+        The write only creates (if_generation_match=0), so when the same bytes are
+        uploaded concurrently one upload stores them and the others touch and reuse
+        that blob (see store).
+        """
+        if self.mock_mode:
+            with self.mock_lock:
+                stored = file_hash not in self.mock_hashes
+                self.mock_hashes.add(file_hash)
+            return stored
+
+        from google.api_core import exceptions
+
+        blob = self.storage_client.bucket(self.bucket_name).blob(blob_path(file_hash))
+        with metrics.stage("gcs.upload", "gcs") as stage:
+            try:
+                blob.upload_from_string(content, content_type=content_type, if_generation_match=0)
+            except exceptions.PreconditionFailed:
+                return False
+            except Exception:
+                stage.error()
+                raise
+        return True
+
+
+def reference_counts(bq_client, bucket_name=BUCKET_NAME):
+    """gs:// URI -> number of documents rows pointing at it, for every referenced blob"""
+    from google.cloud import bigquery
+
+    query = f"""
+        SELECT gcs_uri, COUNT(*) AS refs
+        FROM `{PROJECT_ID}.{DATASET_ID}.documents`
+        WHERE STARTS_WITH(gcs_uri, @prefix)
+        GROUP BY gcs_uri
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("prefix", "STRING", f"gs://{bucket_name}/{BLOB_PREFIX}")
+        ]
+    )
+    return {row['gcs_uri']: row['refs'] for row in bq_client.query(query, job_config=job_config).result()}
+
+
+def references(bq_client, file_hash, bucket_name=BUCKET_NAME):
+    """Documents (in any case) pointing at the blob for file_hash"""
+    from google.cloud import bigquery
+
+    query = f"""
+        SELECT document_id, case_id, document_type, uploaded_at
+        FROM `{PROJECT_ID}.{DATASET_ID}.documents`
+        WHERE gcs_uri = @gcs_uri
+        ORDER BY uploaded_at
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("gcs_uri", "STRING", f"gs://{bucket_name}/{blob_path(file_hash)}")
+        ]
+    )
+    return [dict(row.items()) for row in bq_client.query(query, job_config=job_config).result()]
+
+
+def collect_garbage(storage_client, bq_client, bucket_name=BUCKET_NAME, grace_hours=BLOB_GC_GRACE_HOURS,
+                    dry_run=False):
+    """Delete blobs that no documents row references and that were last referenced before the grace period"""
+    from google.api_core import exceptions
+
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+
+    # List before counting references, so a blob stored or reused during the run is either too
+    # recently referenced to be a candidate, or has its documents row counted, or has a newer
+    # metageneration than the one listed
+    candidates = [
+        blob for blob in storage_client.list_blobs(bucket_name, prefix=BLOB_PREFIX)
+        if (blob.updated or blob.time_created) < cutoff
+    ]
+    refs = reference_counts(bq_client, bucket_name)
+
+    unreferenced = [blob for blob in candidates if not refs.get(f"gs://{bucket_name}/{blob.name}")]
+    deleted = 0
+    deleted_bytes = 0
+    for blob in unreferenced:
+        logger.info(f"{'Would delete' if dry_run else 'Deleting'} unreferenced blob {blob.name} ({blob.size} bytes)")
+        if not dry_run:
+            try:
+                # Only the version that was checked; a blob re-uploaded or reused since then is kept
+                blob.delete(if_generation_match=blob.generation, if_metageneration_match=blob.metageneration)
+            except (exceptions.PreconditionFailed, exceptions.NotFound):
+                logger.info(f"Kept blob {blob.name}: it was referenced or replaced during the run")
+                continue
+        deleted += 1
+        deleted_bytes += blob.size or 0
+
+    return {
+        "blobs_checked": len(candidates),
+        "referenced": len(candidates) - len(unreferenced),
+        "unreferenced": len(unreferenced),
+        "deleted": 0 if dry_run else deleted,
+        "bytes_freed": 0 if dry_run else deleted_bytes
+    }
+
+
+def main(argv=None):
+    import gcp_clients
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Content-addressed document storage maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    refs_parser = commands.add_parser('refs', help="List the documents pointing at a blob")
+    refs_parser.add_argument('file_hash', help="SHA-256 of the file (hex)")
+
+    gc_parser = commands.add_parser('gc', help="Delete blobs no document references")
+    gc_parser.add_argument('--grace-hours', type=float, default=BLOB_GC_GRACE_HOURS)
+    gc_parser.add_argument('--dry-run', action='store_true', help="Report without deleting")
+
+    args = parser.parse_args(argv)
+    bq_client = gcp_clients.bigquery_client()
+
+    if args.command == 'refs':
+        print(json.dumps(references(bq_client, args.file_hash), indent=2, default=str))
+    elif args.command == 'gc':
+        summary = collect_garbage(
+            gcp_clients.storage_client(), bq_client, grace_hours=args.grace_hours, dry_run=args.dry_run
+        )
+        print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,438 @@
+"""
+Tytan LendingOps & MemberAssist - Case status projection
+A compact per-case read model (status, loan type, received and missing document
+types) kept current from pipeline events as they happen: case created and
+document uploaded (API), and case status changes (API reviews, worker case
+aggregator). Single-case reads (the webhook, GET /cases/<id>) come from it
+instead of BigQuery, which is slow for point lookups and lags streaming inserts.
+A member index (member_id and contact phone -> case ids), written alongside each
+new record, lets the webhook find a member's cases without scanning `cases`.
+
+CASE_PROJECTION_BACKEND selects the store: firestore (production default) or
+sqlite (CASE_PROJECTION_SQLITE_PATH, one file in the temp directory by default so
+local services share it, ":memory:" for tests; default in mock mode).
+BigQuery stays the system of record: projection writes never fail the caller,
+and cases missing from the projection (or written while it was unavailable) are
+restored with:
+
+    python case_projection.py rebuild [--case-id CU-2024-00123] [--dry-run]
+    python case_projection.py get CU-2024-00123
+    python case_projection.py member [--member-id M-12345] [--phone +15551234567]
+
+This file is kept identical in services/cloud-run-api, services/dialogflow-webhook
+and pipelines/document_ai_worker (tests/test_shared_modules.py fails otherwise).
+It also holds get_required_documents for all three.
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import tempfile
+import argparse
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
+DATASET_ID = os.getenv('DATASET_ID', 'tytan_lending_ops')
+
+CASE_PROJECTION_BACKEND = os.getenv('CASE_PROJECTION_BACKEND', '')
+CASE_PROJECTION_COLLECTION = os.getenv('CASE_PROJECTION_COLLECTION', 'case_status')
+CASE_PROJECTION_INDEX_COLLECTION = os.getenv('CASE_PROJECTION_INDEX_COLLECTION', 'case_member_index')
+CASE_PROJECTION_SQLITE_PATH = os.getenv(
+    'CASE_PROJECTION_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'case_projection.db')
+)
+
+# Decided cases; everything else counts as open for member lookups
+CLOSED_STATUSES = ("APPROVED", "REJECTED")
+
+
+def get_required_documents(loan_type):
+    """Return list of required documents based on loan type"""
+    base_docs = ["drivers_license"]
+
+    if loan_type == "auto":
+        return base_docs + ["paystub_recent_2", "bank_statement_30days", "proof_of_insurance"]
+    elif loan_type == "personal":
+        return base_docs + ["paystub_recent_2", "bank_statement_60days"]
+    elif loan_type == "mortgage":
+        return base_docs + ["paystub_recent_2", "w2_2years", "bank_statement_60days", "tax_returns_2years"]
+    else:
+        return base_docs + ["paystub_recent_2", "bank_statement_30days"]
+
+
+def parse_timestamp(value):
+    """ISO 8601 string (with or without Z / fraction) or datetime -> aware datetime"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def format_timestamp(value):
+    return parse_timestamp(value).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def normalize_phone(phone):
+    """Digits only, without a leading US country code, so +1 (555) 123-4567 and 5551234567 match"""
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits or None
+
+
+def member_index_keys(member_id=None, phone=None):
+    """Index keys a case is filed under (and looked up by)"""
+    keys = []
+    if member_id:
+        keys.append(f"member_id:{member_id}")
+    phone = normalize_phone(phone)
+    if phone:
+        keys.append(f"phone:{phone}")
+    return keys
+
+
+def build_record(case_id, member_id, loan_type, status, created_at, member_phone=None, loan_amount=None,
+                 documents_received=(), status_updated_at=None, updated_at=None):
+    record = {
+        "case_id": case_id,
+        "member_id": member_id,
+        "member_phone": member_phone,
+        "loan_type": loan_type,
+        "loan_amount": float(loan_amount) if loan_amount is not None else None,
+        "status": status,
+        "required_documents": get_required_documents(loan_type),
+        "documents_received": sorted(set(documents_received)),
+        "created_at": format_timestamp(created_at),
+        "status_updated_at": format_timestamp(status_updated_at or created_at),
+        "updated_at": format_timestamp(updated_at or status_updated_at or created_at)
+    }
+    record["missing_documents"] = missing_documents(record)
+    return record
+
+
+def missing_documents(record):
+    return [doc for doc in record["required_documents"] if doc not in record["documents_received"]]
+
+
+def merge_records(existing, rebuilt):
+    """Combine a stored record with one rebuilt from BigQuery, keeping whichever status is newer"""
+    merged = dict(rebuilt)
+    merged["documents_received"] = sorted(set(existing["documents_received"]) | set(rebuilt["documents_received"]))
+    if parse_timestamp(existing["status_updated_at"]) > parse_timestamp(rebuilt["status_updated_at"]):
+        merged["status"] = existing["status"]
+        merged["status_updated_at"] = existing["status_updated_at"]
+    merged["updated_at"] = max(existing["updated_at"], rebuilt["updated_at"], key=parse_timestamp)
+    merged["missing_documents"] = missing_documents(merged)
+    return merged
+
+
+class SqliteBackend:
+    """Embedded stand-in for Firestore: one JSON record per case"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS case_status (case_id TEXT PRIMARY KEY, record TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS case_member_index ("
+            "index_key TEXT NOT NULL, case_id TEXT NOT NULL, PRIMARY KEY (index_key, case_id)) WITHOUT ROWID"
+        )
+
+    def get(self, case_id):
+        with self.lock:
+            row = self.connection.execute("SELECT record FROM case_status WHERE case_id = ?", (case_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, case_ids):
+        """Records for the case ids that have one, in no particular order"""
+        if not case_ids:
+            return []
+        placeholders = ", ".join("?" * len(case_ids))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT record FROM case_status WHERE case_id IN ({placeholders})", list(case_ids)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def index_case(self, keys, case_id):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO case_member_index (index_key, case_id) VALUES (?, ?)",
+                [(key, case_id) for key in keys]
+            )
+
+    def indexed_cases(self, key):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT case_id FROM case_member_index WHERE index_key = ?", (key,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def update(self, case_id, mutate):
+        """Atomically replace the record with mutate(record or None); a None result leaves it unchanged"""
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so other processes sharing the file serialize too
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT record FROM case_status WHERE case_id = ?", (case_id,)
+                ).fetchone()
+                record = mutate(json.loads(row[0]) if row else None)
+                if record is not None:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO case_status (case_id, record) VALUES (?, ?)",
+                        (case_id, json.dumps(record))
+                    )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return record
+
+
+class FirestoreBackend:
+    """One document per case in CASE_PROJECTION_COLLECTION, one per member index key in the index collection"""
+
+    def __init__(self, collection, index_collection):
+        from google.cloud import firestore
+
+        self.firestore = firestore
+        self.client = firestore.Client(project=PROJECT_ID)
+        self.collection = self.client.collection(collection)
+        self.index_collection = self.client.collection(index_collection)
+
+    def get(self, case_id):
+        snapshot = self.collection.document(case_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def get_many(self, case_ids):
+        """Records for the case ids that have one, fetched in one batched read"""
+        if not case_ids:
+            return []
+        references = [self.collection.document(case_id) for case_id in case_ids]
+        return [snapshot.to_dict() for snapshot in self.client.get_all(references) if snapshot.exists]
+
+    def index_case(self, keys, case_id):
+        batch = self.client.batch()
+        for key in keys:
+            batch.set(
+                self.index_collection.document(key),
+                {"case_ids": self.firestore.ArrayUnion([case_id])},
+                merge=True
+            )
+        batch.commit()
+
+    def indexed_cases(self, key):
+        snapshot = self.index_collection.document(key).get()
+        return snapshot.to_dict().get("case_ids", []) if snapshot.exists else []
+
+    def update(self, case_id, mutate):
+        """Read-modify-write in a transaction (retried by the client on contention)"""
+        reference = self.collection.document(case_id)
+
+        @self.firestore.transactional
+        def apply(transaction):
+            snapshot = reference.get(transaction=transaction)
+            record = mutate(snapshot.to_dict() if snapshot.exists else None)
+            if record is not None:
+                transaction.set(reference, record)
+            return record
+
+        return apply(self.client.transaction())
+
+
+class CaseProjection:
+    """Applies pipeline events to the per-case records"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, case_id):
+        """The case's record, or None if it has none (or the store is unavailable; callers fall back to BigQuery)"""
+        try:
+            return self.backend.get(case_id)
+        except Exception as e:
+            logger.warning(f"Case projection read failed for {case_id}: {e}")
+            return None
+
+    def _update(self, case_id, mutate, event):
+        try:
+            return self.backend.update(case_id, mutate)
+        except Exception as e:
+            logger.warning(f"Case projection not updated for {event} on {case_id} (rebuild repairs it): {e}")
+            return None
+
+    def _index(self, record):
+        keys = member_index_keys(record["member_id"], record["member_phone"])
+        if not keys:
+            return
+        try:
+            self.backend.index_case(keys, record["case_id"])
+        except Exception as e:
+            logger.warning(f"Member index not updated for {record['case_id']} (rebuild repairs it): {e}")
+
+    def member_cases(self, member_id=None, phone=None, include_closed=False):
+        """
+        Records of a member's cases, newest first, found through the member index
+
+        Cases filed under either the member_id or the phone are returned. Raises if
+        the store is unavailable (there is no cheap BigQuery fallback for this).
+        """
+        case_ids = set()
+        for key in member_index_keys(member_id, phone):
+            case_ids.update(self.backend.indexed_cases(key))
+        records = self.backend.get_many(sorted(case_ids))
+        if not include_closed:
+            records = [record for record in records if record["status"] not in CLOSED_STATUSES]
+        return sorted(records, key=lambda record: record["created_at"], reverse=True)
+
+    def case_created(self, case_id, member_id, loan_type, status, created_at, member_phone=None, loan_amount=None):
+        record = build_record(case_id, member_id, loan_type, status, created_at, member_phone, loan_amount)
+        stored = self._update(case_id, lambda existing: record if existing is None else None, "case created")
+        self._index(record)
+        return stored
+
+    def document_received(self, case_id, document_type, event_time):
+        def apply(record):
+            # Cases older than the projection have no record until a rebuild
+            if record is None or document_type in record["documents_received"]:
+                return None
+            record["documents_received"] = sorted(record["documents_received"] + [document_type])
+            record["missing_documents"] = missing_documents(record)
+            record["updated_at"] = max(record["updated_at"], format_timestamp(event_time))
+            return record
+
+        return self._update(case_id, apply, "document received")
+
+    def status_changed(self, case_id, status, event_time):
+        event_time = format_timestamp(event_time)
+
+        def apply(record):
+            # Events can arrive out of order across services; the latest status wins
+            if record is None or event_time < record["status_updated_at"]:
+                return None
+            record["status"] = status
+            record["status_updated_at"] = event_time
+            record["updated_at"] = max(record["updated_at"], event_time)
+            return record
+
+        return self._update(case_id, apply, "status change")
+
+    def rebuild(self, rebuilt):
+        """Write a record rebuilt from BigQuery, merged with anything newer already stored, and index it"""
+        record = self.backend.update(
+            rebuilt["case_id"], lambda existing: rebuilt if existing is None else merge_records(existing, rebuilt)
+        )
+        keys = member_index_keys(rebuilt["member_id"], rebuilt["member_phone"])
+        if keys:
+            self.backend.index_case(keys, rebuilt["case_id"])
+        return record
+
+
+def open_projection(mock_mode=False):
+    """Projection on CASE_PROJECTION_BACKEND (firestore, or sqlite in mock mode)"""
+    backend = CASE_PROJECTION_BACKEND or ('sqlite' if mock_mode else 'firestore')
+    if backend == 'sqlite':
+        return CaseProjection(SqliteBackend(CASE_PROJECTION_SQLITE_PATH))
+    if backend == 'firestore':
+        return CaseProjection(FirestoreBackend(CASE_PROJECTION_COLLECTION, CASE_PROJECTION_INDEX_COLLECTION))
+    raise ValueError(f"Unknown CASE_PROJECTION_BACKEND: {backend}")
+
+
+def stream_case_records(bq_client, case_id=None):
+    """Rebuild case records from cases, case_status_current and documents"""
+    from google.cloud import bigquery
+
+    query = f"""
+        SELECT
+            c.case_id,
+            c.member_id,
+            c.member_contact_phone,
+            c.loan_type,
+            c.loan_amount,
+            COALESCE(s.status, c.status) AS status,
+            c.created_at,
+            COALESCE(s.status_updated_at, c.updated_at, c.created_at) AS status_updated_at,
+            GREATEST(c.updated_at, IFNULL(s.status_updated_at, c.updated_at)) AS updated_at,
+            ARRAY_AGG(DISTINCT d.document_type IGNORE NULLS) AS documents_received
+        FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.case_status_current` s
+            ON c.case_id = s.case_id
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.documents` d
+            ON c.case_id = d.case_id
+        {"WHERE c.case_id = @case_id" if case_id else ""}
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("case_id", "STRING", case_id)] if case_id else []
+    )
+
+    for row in bq_client.query(query, job_config=job_config).result(page_size=1000):
+        yield build_record(
+            row['case_id'], row['member_id'], row['loan_type'], row['status'], row['created_at'],
+            member_phone=row['member_contact_phone'],
+            loan_amount=row['loan_amount'],
+            documents_received=row['documents_received'] or [],
+            status_updated_at=row['status_updated_at'],
+            updated_at=row['updated_at']
+        )
+
+
+def rebuild(projection, bq_client, case_id=None, dry_run=False):
+    """Rewrite projection records from BigQuery; returns the number of cases"""
+    count = 0
+    for record in stream_case_records(bq_client, case_id):
+        if dry_run:
+            print(json.dumps(record))
+        else:
+            projection.rebuild(record)
+        count += 1
+        if count % 1000 == 0:
+            logger.info(f"Rebuilt {count} case records")
+    return count
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Case status projection maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = commands.add_parser('rebuild', help="Rebuild records from BigQuery")
+    rebuild_parser.add_argument('--case-id', help="Rebuild one case instead of all")
+    rebuild_parser.add_argument('--dry-run', action='store_true', help="Print records instead of writing them")
+
+    get_parser = commands.add_parser('get', help="Print one case's record")
+    get_parser.add_argument('case_id')
+
+    member_parser = commands.add_parser('member', help="Print a member's cases found through the member index")
+    member_parser.add_argument('--member-id')
+    member_parser.add_argument('--phone')
+    member_parser.add_argument('--include-closed', action='store_true')
+
+    args = parser.parse_args(argv)
+    mock_mode = os.getenv('MOCK_MODE', 'false').lower() == 'true'
+    projection = None if getattr(args, 'dry_run', False) else open_projection(mock_mode)
+
+    if args.command == 'get':
+        print(json.dumps(projection.get(args.case_id), indent=2))
+        return 0
+
+    if args.command == 'member':
+        records = projection.member_cases(args.member_id, args.phone, args.include_closed)
+        print(json.dumps(records, indent=2))
+        return 0
+
+    from google.cloud import bigquery
+    count = rebuild(projection, bigquery.Client(project=PROJECT_ID), args.case_id, args.dry_run)
+    logger.info(f"{'Would rebuild' if args.dry_run else 'Rebuilt'} {count} case record(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
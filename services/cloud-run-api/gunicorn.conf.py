@@ -0,0 +1,34 @@
+"""
+gunicorn settings for the API service
+Keeps the multiprocess Prometheus metrics directory consistent across worker
+restarts, and serves the aggregated metrics from the master on METRICS_PORT
+(see metrics.py).
+"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    """Start from an empty metrics directory; files from a previous run would be summed in"""
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def when_ready(server):
+    """Serve /metrics on METRICS_PORT, away from the public request port"""
+    # Not importing metrics.py here: the master would register samples of its own
+    from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(int(os.getenv('METRICS_PORT', '9090')), registry=registry)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges (in-flight requests) from the aggregate"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
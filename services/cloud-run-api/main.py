@@ -4,26 +4,29 @@ Main application entry point
 """
 
 import os
-import logging
 import json
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from google.cloud import bigquery, storage, pubsub_v1
-from google.api_core import exceptions
 import hashlib
 import uuid
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+import tracing
+import metrics
+import blob_store
+import gcp_clients
+import case_projection
+import structured_logging
+
+# Configure logging (non-blocking; per-route lines can be sampled with LOG_SAMPLE_RATES)
+structured_logging.configure()
+logger = structured_logging.get_logger(__name__)
+tracing.init_tracing()
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for web form
+metrics.init_app(app)
 
 # Configuration
 PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
@@ -33,21 +36,35 @@ BUCKET_NAME = os.getenv('BUCKET_NAME', f'{PROJECT_ID}-lending-docs')
 PUBSUB_TOPIC = os.getenv('PUBSUB_TOPIC', 'document-uploaded')
 MOCK_MODE = os.getenv('MOCK_MODE', 'false').lower() == 'true'
 
-# Initialize GCP clients
-try:
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    storage_client = storage.Client(project=PROJECT_ID)
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
+# Worker priority lanes, selected by the "priority" message attribute
+PRIORITY_LANES = ("interactive", "standard", "bulk")
+DEFAULT_UPLOAD_PRIORITY = os.getenv('DEFAULT_UPLOAD_PRIORITY', 'standard')
 
-    logger.info(f"Initialized GCP clients for project: {PROJECT_ID}")
-    logger.info(f"Mock mode: {MOCK_MODE}")
-except Exception as e:
-    logger.error(f"Failed to initialize GCP clients: {e}")
-    # Continue anyway for local development
-    bq_client = None
-    storage_client = None
-    publisher = None
+# GCP clients are built on first use (see gcp_clients.py); warm-up builds them ahead of traffic
+topic_path = f"projects/{PROJECT_ID}/topics/{PUBSUB_TOPIC}"
+bq_client = gcp_clients.LazyClient(
+    "bigquery", gcp_clients.bigquery_client, ping=lambda client: client.get_dataset(DATASET_ID)
+)
+storage_client = gcp_clients.LazyClient(
+    "storage", gcp_clients.storage_client, ping=lambda client: list(client.list_blobs(BUCKET_NAME, max_results=1))
+)
+# Document bytes are stored once per SHA-256 and shared by every case that uploads them
+blobs = blob_store.BlobStore(storage_client, BUCKET_NAME, MOCK_MODE)
+# Ordering keys (case_id) keep each case's document events serialized for the worker
+publisher = gcp_clients.LazyClient(
+    "pubsub", lambda: gcp_clients.publisher_client(enable_message_ordering=True),
+    ping=lambda client: client.get_topic(topic=topic_path)
+)
+
+# Per-case status read model, updated as cases, uploads and status changes happen
+projection = gcp_clients.LazyClient(
+    "case_projection", lambda: case_projection.open_projection(MOCK_MODE),
+    ping=lambda store: store.get("CU-0000-00000")
+)
+
+# Mock mode never touches the GCP clients; the projection is local SQLite there
+warm_up = gcp_clients.warm_up(projection, *(() if MOCK_MODE else (bq_client, storage_client, publisher)))
+logger.info(f"Mock mode: {MOCK_MODE}")
 
 
 def log_audit_event(case_id, event_type, actor, payload, req=None):
@@ -65,16 +82,50 @@ def log_audit_event(case_id, event_type, actor, payload, req=None):
         }
 
         if MOCK_MODE:
-            logger.info(f"[MOCK] Audit event: {event}")
+            logger.info(
+                "[MOCK] Audit event", case_id=case_id, event_type=event_type, actor=event['actor'], payload=payload
+            )
         else:
             table_id = f"{PROJECT_ID}.{DATASET_ID}.audit_log"
-            errors = bq_client.insert_rows_json(table_id, [event])
+            with metrics.stage("bigquery.insert_audit_event", "bigquery") as stage:
+                errors = bq_client.insert_rows_json(table_id, [event])
+                if errors:
+                    stage.error()
             if errors:
                 logger.error(f"Failed to insert audit log: {errors}")
     except Exception as e:
         logger.error(f"Failed to log audit event: {e}")
 
 
+def record_status_event(entity_type, entity_id, case_id, status, details=None):
+    """Append a status transition to the status_events table"""
+    event = {
+        "event_id": str(uuid.uuid4()),
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "case_id": case_id,
+        "status": status,
+        "event_time": datetime.utcnow().isoformat() + "Z",
+        "source": "cloud-run-api",
+        "details": json.dumps(details) if details else None
+    }
+
+    if projection and entity_type == "case":
+        projection.status_changed(case_id, status, event["event_time"])
+
+    if MOCK_MODE:
+        logger.info("[MOCK] Status event", **event)
+        return
+
+    table_id = f"{PROJECT_ID}.{DATASET_ID}.status_events"
+    with metrics.stage("bigquery.insert_status_event", "bigquery") as stage:
+        errors = bq_client.insert_rows_json(table_id, [event], row_ids=[event["event_id"]])
+        if errors:
+            stage.error()
+    if errors:
+        raise Exception(f"Failed to insert status event: {errors}")
+
+
 def generate_case_id():
     """Generate unique case ID in format: CU-YYYY-NNNNN"""
     year = datetime.utcnow().year
@@ -95,6 +146,18 @@ def health_check():
     }), 200
 
 
+@app.route('/warmup', methods=['GET'])
+def warmup_check():
+    """Startup probe: ready once this process's clients are built and connected (or have failed trying)"""
+    if not warm_up.wait():
+        return jsonify({"status": "warming"}), 503
+    return jsonify({
+        "status": "ready",
+        "seconds": round(warm_up.seconds, 3),
+        "clients": warm_up.results
+    }), 200
+
+
 @app.route('/cases', methods=['POST'])
 def create_case():
     """
@@ -141,19 +204,28 @@ def create_case():
 
         # Insert into BigQuery
         if MOCK_MODE:
-            logger.info(f"[MOCK] Created case: {case_record}")
+            logger.info("[MOCK] Created case", case=case_record)
         else:
             table_id = f"{PROJECT_ID}.{DATASET_ID}.cases"
-            errors = bq_client.insert_rows_json(table_id, [case_record])
+            with metrics.stage("bigquery.insert_case", "bigquery") as stage:
+                errors = bq_client.insert_rows_json(table_id, [case_record])
+                if errors:
+                    stage.error()
             if errors:
                 logger.error(f"Failed to insert case: {errors}")
                 return jsonify({"error": "Failed to create case"}), 500
 
+        if projection:
+            projection.case_created(
+                case_id, case_record['member_id'], case_record['loan_type'], case_record['status'],
+                case_record['created_at'], case_record['member_contact_phone'], case_record['loan_amount']
+            )
+
         # Log audit event
         log_audit_event(case_id, "CASE_CREATED", data.get('member_id'), case_record, request)
 
         # Define required documents based on loan type
-        required_documents = get_required_documents(data['loan_type'])
+        required_documents = case_projection.get_required_documents(data['loan_type'])
 
         # Response
         response = {
@@ -163,7 +235,7 @@ def create_case():
             "required_documents": required_documents
         }
 
-        logger.info(f"Created case: {case_id}")
+        logger.info("Created case", sample="api.create_case", case_id=case_id)
         return jsonify(response), 201
 
     except Exception as e:
@@ -171,32 +243,24 @@ def create_case():
         return jsonify({"error": "Internal server error"}), 500
 
 
-def get_required_documents(loan_type):
-    """Return list of required documents based on loan type"""
-    base_docs = ["drivers_license"]
-
-    if loan_type == "auto":
-        return base_docs + ["paystub_recent_2", "bank_statement_30days", "proof_of_insurance"]
-    elif loan_type == "personal":
-        return base_docs + ["paystub_recent_2", "bank_statement_60days"]
-    elif loan_type == "mortgage":
-        return base_docs + ["paystub_recent_2", "w2_2years", "bank_statement_60days", "tax_returns_2years"]
-    else:
-        return base_docs + ["paystub_recent_2", "bank_statement_30days"]
-
-
 @app.route('/cases/<case_id>/documents', methods=['POST'])
+@tracing.traced_request("upload_document")
 def upload_document(case_id):
     """
     Upload document for a case
 
     Supports multipart/form-data (file upload) or JSON (GCS URI reference)
     """
+    # Start of the end-to-end latency the worker reports once the document is extracted
+    received_at = datetime.utcnow().isoformat() + "Z"
     try:
         # Check if case exists
+        loan_type = None
         if not MOCK_MODE:
+            from google.cloud import bigquery
+
             query = f"""
-                SELECT case_id FROM `{PROJECT_ID}.{DATASET_ID}.cases`
+                SELECT case_id, loan_type FROM `{PROJECT_ID}.{DATASET_ID}.cases`
                 WHERE case_id = @case_id
             """
             job_config = bigquery.QueryJobConfig(
@@ -204,14 +268,19 @@ def upload_document(case_id):
                     bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
                 ]
             )
-            result = bq_client.query(query, job_config=job_config).result()
+            with metrics.stage("bigquery.case_lookup", "bigquery"):
+                result = bq_client.query(query, job_config=job_config).result()
             if result.total_rows == 0:
                 return jsonify({"error": f"Case not found: {case_id}"}), 404
+            loan_type = list(result)[0]['loan_type']
 
         # Handle file upload
         if 'file' in request.files:
             file = request.files['file']
             document_type = request.form.get('document_type', 'unknown')
+            priority = request.form.get('priority', DEFAULT_UPLOAD_PRIORITY)
+            if priority not in PRIORITY_LANES:
+                return jsonify({"error": f"Invalid priority: {priority}"}), 400
 
             # Generate document ID
             document_id = f"doc-{uuid.uuid4().hex[:12]}"
@@ -223,6 +292,8 @@ def upload_document(case_id):
 
             # Check for duplicate (same hash)
             if not MOCK_MODE:
+                from google.cloud import bigquery
+
                 dup_query = f"""
                     SELECT document_id FROM `{PROJECT_ID}.{DATASET_ID}.documents`
                     WHERE case_id = @case_id AND file_hash_sha256 = @file_hash
@@ -233,27 +304,31 @@ def upload_document(case_id):
                         bigquery.ScalarQueryParameter("file_hash", "STRING", file_hash)
                     ]
                 )
-                dup_result = bq_client.query(dup_query, dup_job_config=dup_job_config).result()
+                with metrics.stage("bigquery.duplicate_check", "bigquery"):
+                    dup_result = bq_client.query(dup_query, dup_job_config=dup_job_config).result()
                 if dup_result.total_rows > 0:
                     existing_doc = list(dup_result)[0]
-                    logger.info(f"Duplicate document detected: {existing_doc['document_id']}")
+                    logger.info("Duplicate document detected", case_id=case_id, document_id=existing_doc['document_id'])
                     return jsonify({
                         "document_id": existing_doc['document_id'],
                         "upload_status": "duplicate",
                         "message": "This document has already been uploaded"
                     }), 200
 
-            # Upload to Cloud Storage
-            file_ext = file.filename.split('.')[-1] if '.' in file.filename else 'pdf'
-            gcs_path = f"cases/{case_id}/{document_id}.{file_ext}"
-            gcs_uri = f"gs://{BUCKET_NAME}/{gcs_path}"
-
-            if MOCK_MODE:
-                logger.info(f"[MOCK] Upload to GCS: {gcs_uri}")
+            # Upload to Cloud Storage, once per content: the same bytes in another case
+            # (co-borrower documents, reapplications) point at the blob already stored
+            gcs_uri = blobs.uri(file_hash)
+            with tracing.tracer.start_as_current_span("gcs.upload", attributes={"file_size_bytes": file_size}) as span:
+                # The blob is marked as referenced before the documents row exists (see blob_store.py)
+                blob_reused = not blobs.store(file_content, file_hash, file.content_type)
+                span.set_attribute("blob_reused", blob_reused)
+            if blob_reused:
+                metrics.blob_uploads.labels("reused").inc()
+                metrics.blob_bytes_skipped.inc(file_size)
             else:
-                bucket = storage_client.bucket(BUCKET_NAME)
-                blob = bucket.blob(gcs_path)
-                blob.upload_from_string(file_content, content_type=file.content_type)
+                metrics.blob_uploads.labels("stored").inc()
+                if MOCK_MODE:
+                    logger.info("[MOCK] Upload to GCS", gcs_uri=gcs_uri)
 
             # Create document record
             document_record = {
@@ -270,10 +345,14 @@ def upload_document(case_id):
 
             # Insert into BigQuery
             if MOCK_MODE:
-                logger.info(f"[MOCK] Created document record: {document_record}")
+                logger.info("[MOCK] Created document record", document=document_record)
             else:
                 table_id = f"{PROJECT_ID}.{DATASET_ID}.documents"
-                errors = bq_client.insert_rows_json(table_id, [document_record])
+                with tracing.tracer.start_as_current_span("bigquery.insert_document"), \
+                        metrics.stage("bigquery.insert_document", "bigquery") as stage:
+                    errors = bq_client.insert_rows_json(table_id, [document_record])
+                    if errors:
+                        stage.error()
                 if errors:
                     logger.error(f"Failed to insert document: {errors}")
                     return jsonify({"error": "Failed to create document record"}), 500
@@ -284,19 +363,36 @@ def upload_document(case_id):
                 "document_id": document_id,
                 "gcs_uri": gcs_uri,
                 "document_type": document_type,
+                "loan_type": loan_type,
                 "timestamp": document_record['uploaded_at'],
-                "correlation_id": f"req-{uuid.uuid4().hex[:8]}"
+                "received_at": received_at,
+                "correlation_id": f"req-{uuid.uuid4().hex[:8]}",
+                # Lets the worker reuse an earlier extraction of the same blob
+                "blob_reused": blob_reused
             }
 
             if MOCK_MODE:
-                logger.info(f"[MOCK] Published to Pub/Sub: {message_data}")
+                logger.info("[MOCK] Published to Pub/Sub", message=message_data)
                 pubsub_message_id = "mock-message-id-12345"
             else:
-                future = publisher.publish(
-                    topic_path,
-                    json.dumps(message_data).encode('utf-8')
-                )
-                pubsub_message_id = future.result()
+                with tracing.tracer.start_as_current_span("pubsub.publish"), metrics.stage("pubsub.publish", "pubsub"):
+                    # traceparent/tracestate attributes let the worker continue this trace
+                    future = publisher.publish(
+                        topic_path,
+                        json.dumps(message_data).encode('utf-8'),
+                        ordering_key=case_id,
+                        priority=priority,
+                        **tracing.message_attributes()
+                    )
+                    try:
+                        pubsub_message_id = future.result()
+                    except Exception:
+                        # A failed ordered publish pauses the key until it is resumed
+                        publisher.resume_publish(topic_path, case_id)
+                        raise
+
+            if projection:
+                projection.document_received(case_id, document_type, document_record['uploaded_at'])
 
             # Log audit event
             log_audit_event(case_id, "DOCUMENT_UPLOADED", None, document_record, request)
@@ -309,7 +405,7 @@ def upload_document(case_id):
                 "pubsub_message_id": pubsub_message_id
             }
 
-            logger.info(f"Uploaded document {document_id} for case {case_id}")
+            logger.info("Uploaded document", sample="api.upload", document_id=document_id, case_id=case_id)
             return jsonify(response), 201
 
         else:
@@ -324,7 +420,10 @@ def upload_document(case_id):
 def get_case(case_id):
     """Get case details including documents and extracted fields"""
     try:
-        if MOCK_MODE:
+        # Case header from the status projection; BigQuery only for cases it does not hold yet
+        case_info = projection.get(case_id) if projection else None
+
+        if MOCK_MODE and case_info is None:
             # Return mock data
             return jsonify({
                 "case_id": case_id,
@@ -338,39 +437,63 @@ def get_case(case_id):
                 "extracted_applicant": {}
             }), 200
 
-        # Query case details
-        query = f"""
-            SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.cases`
-            WHERE case_id = @case_id
-        """
+        from google.cloud import bigquery
+
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
             ]
         )
-        case_result = bq_client.query(query, job_config=job_config).result()
 
-        if case_result.total_rows == 0:
-            return jsonify({"error": f"Case not found: {case_id}"}), 404
+        if case_info is None:
+            # Query case details (current status comes from the latest status event, if any)
+            query = f"""
+                SELECT c.* REPLACE (
+                    COALESCE(s.status, c.status) AS status,
+                    GREATEST(c.updated_at, IFNULL(s.status_updated_at, c.updated_at)) AS updated_at
+                )
+                FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
+                LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.case_status_current` s
+                    ON c.case_id = s.case_id
+                WHERE c.case_id = @case_id
+            """
+            with metrics.stage("bigquery.get_case", "bigquery"):
+                case_result = bq_client.query(query, job_config=job_config).result()
 
-        case_row = list(case_result)[0]
+            if case_result.total_rows == 0:
+                return jsonify({"error": f"Case not found: {case_id}"}), 404
+
+            case_row = list(case_result)[0]
+            case_info = {
+                "status": case_row.status,
+                "created_at": case_row.created_at.isoformat() + "Z" if case_row.created_at else None,
+                "updated_at": case_row.updated_at.isoformat() + "Z" if case_row.updated_at else None,
+                "loan_type": case_row.loan_type,
+                "loan_amount": float(case_row.loan_amount)
+            }
 
         # Query documents
         doc_query = f"""
             SELECT
                 d.document_id,
                 d.document_type,
-                d.status,
+                COALESCE(s.status, d.status) as status,
                 d.uploaded_at,
                 COUNT(e.extraction_id) as fields_extracted,
                 AVG(e.confidence) as avg_confidence
             FROM `{PROJECT_ID}.{DATASET_ID}.documents` d
+            LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.document_status_current` s
+                ON d.document_id = s.document_id
             LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.extracted_fields` e
                 ON d.document_id = e.document_id
             WHERE d.case_id = @case_id
-            GROUP BY d.document_id, d.document_type, d.status, d.uploaded_at
+            GROUP BY d.document_id, d.document_type, COALESCE(s.status, d.status), d.uploaded_at
         """
-        doc_result = bq_client.query(doc_query, job_config=job_config).result()
+        if MOCK_MODE:
+            doc_result = []
+        else:
+            with metrics.stage("bigquery.get_documents", "bigquery"):
+                doc_result = bq_client.query(doc_query, job_config=job_config).result()
 
         documents = []
         for row in doc_result:
@@ -387,19 +510,19 @@ def get_case(case_id):
             }
             documents.append(doc_summary)
 
-        # Determine missing documents
-        required_docs = get_required_documents(case_row.loan_type)
-        uploaded_types = [d['document_type'] for d in documents]
+        # Determine missing documents (the projection also knows uploads BigQuery cannot show yet)
+        required_docs = case_projection.get_required_documents(case_info['loan_type'])
+        uploaded_types = {d['document_type'] for d in documents} | set(case_info.get('documents_received', []))
         missing_docs = [doc for doc in required_docs if doc not in uploaded_types]
 
         # Build response
         response = {
             "case_id": case_id,
-            "status": case_row.status,
-            "created_at": case_row.created_at.isoformat() + "Z" if case_row.created_at else None,
-            "updated_at": case_row.updated_at.isoformat() + "Z" if case_row.updated_at else None,
-            "loan_type": case_row.loan_type,
-            "loan_amount": float(case_row.loan_amount),
+            "status": case_info['status'],
+            "created_at": case_info['created_at'],
+            "updated_at": case_info['updated_at'],
+            "loan_type": case_info['loan_type'],
+            "loan_amount": case_info.get('loan_amount'),
             "documents": documents,
             "missing_documents": missing_docs,
             "extracted_applicant": {}  # TODO: aggregate extracted fields
@@ -440,27 +563,18 @@ def review_case(case_id):
             }
 
             if MOCK_MODE:
-                logger.info(f"[MOCK] Correction: {correction_record}")
+                logger.info("[MOCK] Correction", correction=correction_record)
             else:
                 table_id = f"{PROJECT_ID}.{DATASET_ID}.field_corrections"
-                errors = bq_client.insert_rows_json(table_id, [correction_record])
+                with metrics.stage("bigquery.insert_correction", "bigquery") as stage:
+                    errors = bq_client.insert_rows_json(table_id, [correction_record])
+                    if errors:
+                        stage.error()
                 if errors:
                     logger.error(f"Failed to insert correction: {errors}")
 
-        # Update case status
-        if not MOCK_MODE:
-            update_query = f"""
-                UPDATE `{PROJECT_ID}.{DATASET_ID}.cases`
-                SET status = @status, updated_at = CURRENT_TIMESTAMP()
-                WHERE case_id = @case_id
-            """
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("status", "STRING", "READY_FOR_DECISION"),
-                    bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
-                ]
-            )
-            bq_client.query(update_query, job_config=job_config).result()
+        # Update case status (appended as a status event; no UPDATE DML)
+        record_status_event("case", case_id, case_id, "READY_FOR_DECISION", {"review_id": review_id})
 
         # Log audit event
         log_audit_event(case_id, "REVIEW_COMPLETED", reviewer_id, data, request)
@@ -472,7 +586,7 @@ def review_case(case_id):
             "corrections_applied": len(field_corrections)
         }
 
-        logger.info(f"Review completed for case {case_id} by {reviewer_id}")
+        logger.info("Review completed", case_id=case_id, reviewer_id=reviewer_id)
         return jsonify(response), 200
 
     except Exception as e:
@@ -493,4 +607,5 @@ def internal_error(error):
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
+    metrics.start_server()
     app.run(host='0.0.0.0', port=port, debug=False)
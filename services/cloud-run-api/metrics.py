@@ -0,0 +1,115 @@
+"""
+Tytan LendingOps & MemberAssist - Prometheus metrics for the API service
+Request latency and counts per route, in-flight requests, and per-stage latency
+and error counts for the BigQuery, Cloud Storage and Pub/Sub calls on the upload
+path, served on :METRICS_PORT/metrics.
+
+METRICS_PORT is not the request port: Cloud Run only routes traffic to the
+container port, so the metrics can be scraped from inside the instance (the
+Prometheus sidecar) but not from the internet.
+
+gunicorn runs several worker processes; with PROMETHEUS_MULTIPROC_DIR set (see
+the Dockerfile and gunicorn.conf.py) each process writes its samples to files in
+that directory, and the gunicorn master serves their aggregate.
+"""
+
+import os
+import time
+
+from flask import g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess, start_http_server
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+REQUEST_BUCKETS_SECONDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+request_duration = Histogram(
+    "api_request_duration_seconds", "Request latency per route", ["route", "method"], buckets=REQUEST_BUCKETS_SECONDS
+)
+requests_total = Counter("api_requests_total", "Requests per route and status code", ["route", "method", "status"])
+in_flight = Gauge("api_in_flight_requests", "Requests currently being served", multiprocess_mode="livesum")
+stage_duration = Histogram(
+    "api_stage_duration_seconds", "Time spent per backend call", ["stage"], buckets=REQUEST_BUCKETS_SECONDS
+)
+backend_requests = Counter("api_backend_requests_total", "Calls to BigQuery, Cloud Storage and Pub/Sub", ["backend"])
+backend_errors = Counter(
+    "api_backend_errors_total", "Failed calls to BigQuery, Cloud Storage and Pub/Sub", ["backend"]
+)
+# "reused" uploads pointed at a blob that was already stored (see blob_store.py) instead of transferring it
+blob_uploads = Counter("api_blob_uploads_total", "Uploaded files by whether their content was stored or reused", ["result"])
+blob_bytes_skipped = Counter("api_blob_bytes_skipped_total", "Bytes not transferred because the blob was already stored")
+
+_children = {}
+
+
+class Stage:
+    """Times one backend call; counts an error if the block raises or error() is called"""
+
+    __slots__ = ("histogram", "requests", "errors", "started", "failed")
+
+    def __init__(self, histogram, requests, errors):
+        self.histogram = histogram
+        self.requests = requests
+        self.errors = errors
+        self.failed = False
+
+    def error(self):
+        self.failed = True
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+        self.requests.inc()
+        if exc_type is not None or self.failed:
+            self.errors.inc()
+        return False
+
+
+def stage(name, backend):
+    """Context manager timing one backend call"""
+    children = _children.get((name, backend))
+    if children is None:
+        children = _children[(name, backend)] = (
+            stage_duration.labels(name), backend_requests.labels(backend), backend_errors.labels(backend)
+        )
+    return Stage(*children)
+
+
+def init_app(app):
+    """Record every request"""
+
+    @app.before_request
+    def start_request():
+        g.metrics_started = time.perf_counter()
+        in_flight.inc()
+
+    @app.after_request
+    def record_request(response):
+        # Unmatched paths share one label so scanners cannot blow up cardinality
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.labels(route, request.method).observe(time.perf_counter() - g.metrics_started)
+        requests_total.labels(route, request.method, response.status_code).inc()
+        return response
+
+    @app.teardown_request
+    def finish_request(error=None):
+        if 'metrics_started' in g:
+            in_flight.dec()
+
+
+def registry():
+    """The registry to serve: every process's samples when running under gunicorn"""
+    if not MULTIPROCESS:
+        return REGISTRY
+    aggregate = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregate)
+    return aggregate
+
+
+def start_server(port=METRICS_PORT):
+    """Serve /metrics on port from a daemon thread (the gunicorn master, or python main.py)"""
+    start_http_server(port, registry=registry())
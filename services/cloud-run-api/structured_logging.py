@@ -0,0 +1,368 @@
+"""
+Tytan LendingOps & MemberAssist - Structured, non-blocking logging
+Request threads and message callbacks only enqueue log records; a listener
+thread renders them (message, JSON fields, tracebacks) and writes to stdout,
+where Cloud Run forwards them to Cloud Logging as structured entries.
+
+    logger = structured_logging.get_logger(__name__)
+    logger.info("Uploaded document", case_id=case_id, document_id=document_id)
+    logger.info("Webhook request", sample="webhook.request", parameters=parameters)
+
+Keyword arguments become JSON fields and are only rendered, on the listener
+thread, when the line is actually written; wrap anything expensive to compute in
+Lazy(fn, *args). Values are rendered after the call returns, so pass objects the
+caller will not mutate afterwards.
+
+Lines tagged with sample="<key>" are kept at the rate configured for that key
+(LOG_SAMPLE_RATES="webhook.request=0.05,api.upload=0.5", overriding the
+service's defaults) and carry sample_rate so counts can be scaled back up.
+Warnings and errors are never sampled.
+
+Fields named like contact details or identity numbers (REDACTED_FIELDS, plus
+LOG_REDACT_FIELDS) are masked at any depth, and email addresses are masked in
+message text.
+
+LOG_FORMAT is json (default on Cloud Run) or text (default elsewhere).
+
+    python structured_logging.py benchmark
+
+compares the request-thread cost of this setup with plain logging.basicConfig.
+
+This file is kept identical in services/cloud-run-api, services/dialogflow-webhook
+and pipelines/document_ai_worker (tests/test_shared_modules.py fails otherwise).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import argparse
+import logging.handlers
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json' if os.getenv('K_SERVICE') else 'text')
+
+# Records waiting for the listener; beyond this, new records are dropped (and counted) rather than block
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+REDACTED = "[REDACTED]"
+REDACTED_FIELDS = {
+    "email", "phone", "member_contact", "member_contact_email", "member_contact_phone", "caller_id",
+    "ssn", "tax_id", "date_of_birth", "dob", "address", "street_address", "first_name", "last_name",
+    "full_name", "account_number", "routing_number", "license_number", "ip_address",
+    # Values read off member documents (field names alone are fine)
+    "field_value", "extracted_value", "original_value", "corrected_value"
+}
+REDACTED_SUFFIXES = ("_email", "_phone", "_ssn", "_address")
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+
+# Fields set by the logging module itself, never copied into the JSON payload
+SAMPLE_KWARG = "sample"
+ADAPTER_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+redacted_fields = REDACTED_FIELDS | {
+    name.strip().lower() for name in os.getenv('LOG_REDACT_FIELDS', '').split(',') if name.strip()
+}
+sample_rates = {}
+listener = None
+
+
+class Lazy:
+    """A field value computed only if the line is written: Lazy(json.dumps, payload)"""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __call__(self):
+        return self.fn(*self.args)
+
+
+def parse_sample_rates(spec):
+    """"key=rate,..." -> {key: rate}"""
+    rates = {}
+    for part in spec.split(','):
+        if part.strip():
+            key, rate = part.split('=')
+            rates[key.strip()] = float(rate)
+    return rates
+
+
+def is_redacted(name):
+    name = name.lower()
+    return name in redacted_fields or name.endswith(REDACTED_SUFFIXES)
+
+
+def redact(value):
+    """Copy of value with PII fields masked, Lazy values resolved, and anything else JSON can't hold as str"""
+    if isinstance(value, Lazy):
+        value = value()
+    if isinstance(value, dict):
+        return {key: REDACTED if is_redacted(str(key)) and item is not None else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [redact(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger taking keyword fields and an optional sample key"""
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+
+    def log(self, level, msg, *args, **kwargs):
+        # Checked before any record is built, so suppressed lines cost almost nothing
+        if not self.isEnabledFor(level):
+            return
+        sample = kwargs.pop(SAMPLE_KWARG, None)
+        rate = sample_rates.get(sample, 1.0) if sample and level < logging.WARNING else 1.0
+        if rate < 1.0 and random.random() >= rate:
+            return
+
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in ADAPTER_KWARGS}
+        if rate < 1.0:
+            fields["sample_rate"] = rate
+        if fields:
+            kwargs["extra"] = dict(kwargs.get("extra") or {}, fields=fields)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def exception(self, msg, *args, exc_info=True, **kwargs):
+        self.log(logging.ERROR, msg, *args, exc_info=exc_info, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        self.log(logging.CRITICAL, msg, *args, **kwargs)
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(name))
+
+
+class JsonFormatter(logging.Formatter):
+    """One Cloud Logging structured entry per line: severity, message, fields"""
+
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "message": EMAIL_PATTERN.sub(REDACTED, record.getMessage()),
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat().replace("+00:00", "Z"),
+            "logger": record.name,
+            "thread": record.threadName
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            for key, value in redact(fields).items():
+                entry.setdefault(key, value)
+        if record.exc_info:
+            # Error Reporting picks up stack traces from this field
+            entry["stack_trace"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, with fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        line = EMAIL_PATTERN.sub(REDACTED, super().format(record))
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(
+                f"{key}={json.dumps(value, default=str)}" for key, value in redact(fields).items()
+            )
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records untouched (rendering happens on the listener) and drops them when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            fields = dict(getattr(record, "fields", None) or {}, log_lines_dropped=self.dropped)
+            record.fields = fields
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class BackgroundListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue instead of failing"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def configure(default_sample_rates=None, stream=None, log_format=None, level=LOG_LEVEL, queue_size=LOG_QUEUE_SIZE,
+              start=True):
+    """
+    Route all logging through a queue to a background writer
+
+    default_sample_rates are the service's rates per sample key; LOG_SAMPLE_RATES
+    overrides them. Safe to call more than once (the last call wins).
+    """
+    global listener
+
+    # Neither formatter shows caller file/line or process names, so skip collecting them per record
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    sample_rates.clear()
+    sample_rates.update(default_sample_rates or {})
+    sample_rates.update(parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', '')))
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if (log_format or LOG_FORMAT) == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    if listener is not None:
+        listener.stop()
+    listener = BackgroundListener(log_queue, handler, respect_handler_level=True)
+    if start:
+        listener.start()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(level)
+    return listener
+
+
+def shutdown():
+    """Write out everything still queued"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(shutdown)
+
+
+def benchmark(lines, output_path):
+    """Request-thread time per line, plain basicConfig-style logging vs this module"""
+    payload = {
+        "detectIntentResponseId": "5f1c6a0e-1b7f-4f8e-9d7c-1e2f3a4b5c6d",
+        "intentInfo": {"displayName": "check_application_status", "confidence": 0.93},
+        "pageInfo": {"currentPage": "projects/p/locations/global/agents/a/flows/f/pages/status"},
+        "sessionInfo": {
+            "session": "projects/p/locations/global/agents/a/sessions/0d3c2b1a",
+            "parameters": {"case_id": "CU-2024-00123", "phone": "+15551234567", "member_id": "M-12345"}
+        },
+        "fulfillmentInfo": {"tag": "get_case_status"},
+        "text": "what's the status of my application CU-2024-00123",
+        "languageCode": "en"
+    }
+    case_record = {
+        "case_id": "CU-2024-00123", "member_id": "M-12345", "loan_type": "auto", "loan_amount": 25000.0,
+        "status": "SUBMITTED", "created_at": "2024-01-15T10:00:00Z", "updated_at": "2024-01-15T10:00:00Z",
+        "member_contact_email": "sarah@example.com", "member_contact_phone": "+15551234567",
+        "source_channel": "web", "metadata": json.dumps({"source": "web", "campaign": "spring"})
+    }
+
+    def run(name, log_line):
+        # The listener (if any) starts after the burst: request threads mostly wait on I/O, which is
+        # when it renders and writes, so this isolates what the request thread itself pays
+        started = time.perf_counter()
+        for _ in range(lines):
+            log_line()
+        caller = time.perf_counter() - started
+        drain_started = time.perf_counter()
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        if listener is not None:
+            listener.start()
+        shutdown()
+        drained = time.perf_counter() - drain_started
+        print(f"{name:<46} {caller / lines * 1e6:8.2f} us/line on the caller, {drained:6.3f}s to drain")
+
+    results = open(output_path, 'w')
+    plain = logging.getLogger("benchmark.plain")
+    structured = get_logger("benchmark.structured")
+
+    def plain_setup():
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        handler = logging.StreamHandler(results)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+
+    plain_setup()
+    run("before: webhook request (json.dumps payload)",
+        lambda: plain.info(f"Dialogflow webhook request: {json.dumps(payload)}"))
+    plain_setup()
+    run("before: mock case record (f-string)",
+        lambda: plain.info(f"[MOCK] Created case: {case_record}"))
+    plain_setup()
+    run("before: short line", lambda: plain.info(f"Uploaded document {'DOC-1'} for case {'CU-2024-00123'}"))
+
+    configure(stream=results, log_format='json', queue_size=lines + 1, start=False)
+    run("after: webhook request (fields, unsampled)",
+        lambda: structured.info("Dialogflow webhook request", tag="get_case_status",
+                                parameters=payload["sessionInfo"]["parameters"]))
+    configure({"webhook.request": 0.05}, stream=results, log_format='json', queue_size=lines + 1, start=False)
+    run("after: webhook request (fields, sampled 5%)",
+        lambda: structured.info("Dialogflow webhook request", sample="webhook.request", tag="get_case_status",
+                                parameters=payload["sessionInfo"]["parameters"]))
+    configure(stream=results, log_format='json', queue_size=lines + 1, start=False)
+    run("after: mock case record (fields)", lambda: structured.info("[MOCK] Created case", case=case_record))
+    configure(stream=results, log_format='json', queue_size=lines + 1, start=False)
+    run("after: short line", lambda: structured.info("Uploaded document", document_id="DOC-1",
+                                                     case_id="CU-2024-00123"))
+    results.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Structured logging tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    benchmark_parser = commands.add_parser('benchmark', help="Compare request-thread logging cost")
+    benchmark_parser.add_argument('--lines', type=int, default=20000)
+    benchmark_parser.add_argument('--output', default=os.devnull, help="Where log lines are written")
+
+    args = parser.parse_args(argv)
+    benchmark(args.lines, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
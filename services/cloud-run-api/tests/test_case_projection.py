@@ -0,0 +1,112 @@
+"""
+Case status projection on the SQLite backend: member index lookups by
+member_id and phone, status changes arriving out of order, and phone
+normalization.
+"""
+
+import pytest
+
+from case_projection import CaseProjection, SqliteBackend, member_index_keys, normalize_phone
+
+
+@pytest.fixture
+def projection():
+    return CaseProjection(SqliteBackend(":memory:"))
+
+
+def create(projection, case_id, member_id="M-1", phone="+1 (555) 123-4567", status="PENDING_DOCUMENTS",
+           created_at="2024-03-01T10:00:00Z"):
+    return projection.case_created(case_id, member_id, "auto", status, created_at, member_phone=phone,
+                                   loan_amount=25000)
+
+
+def case_ids(records):
+    return [record["case_id"] for record in records]
+
+
+def test_member_cases_by_member_id_are_newest_first(projection):
+    create(projection, "CU-1", created_at="2024-03-01T10:00:00Z")
+    create(projection, "CU-2", created_at="2024-03-05T10:00:00Z")
+    create(projection, "CU-3", member_id="M-2", phone="555-999-0000")
+
+    assert case_ids(projection.member_cases(member_id="M-1")) == ["CU-2", "CU-1"]
+    assert case_ids(projection.member_cases(member_id="M-2")) == ["CU-3"]
+    assert projection.member_cases(member_id="M-404") == []
+
+
+def test_member_cases_by_phone_match_any_formatting(projection):
+    create(projection, "CU-1", phone="+1 (555) 123-4567")
+    create(projection, "CU-2", member_id="M-2", phone="555.123.4567", created_at="2024-03-02T10:00:00Z")
+
+    for phone in ("5551234567", "+15551234567", "1-555-123-4567", "(555) 123 4567"):
+        assert case_ids(projection.member_cases(phone=phone)) == ["CU-2", "CU-1"]
+    assert projection.member_cases(phone="555-123-0000") == []
+
+
+def test_member_cases_by_member_id_or_phone_are_returned_once(projection):
+    create(projection, "CU-1", member_id="M-1", phone="5551234567")
+    create(projection, "CU-2", member_id="M-1", phone=None, created_at="2024-03-02T10:00:00Z")
+    create(projection, "CU-3", member_id="M-2", phone="5551234567", created_at="2024-03-03T10:00:00Z")
+
+    assert case_ids(projection.member_cases(member_id="M-1", phone="+1 555 123 4567")) == ["CU-3", "CU-2", "CU-1"]
+
+
+def test_closed_cases_are_left_out_unless_asked_for(projection):
+    create(projection, "CU-1")
+    create(projection, "CU-2", created_at="2024-03-02T10:00:00Z")
+    projection.status_changed("CU-2", "APPROVED", "2024-03-10T10:00:00Z")
+
+    assert case_ids(projection.member_cases(member_id="M-1")) == ["CU-1"]
+    assert case_ids(projection.member_cases(member_id="M-1", include_closed=True)) == ["CU-2", "CU-1"]
+
+
+def test_older_status_change_arriving_late_is_ignored(projection):
+    create(projection, "CU-1")
+
+    projection.status_changed("CU-1", "UNDER_REVIEW", "2024-03-02T12:00:00Z")
+    assert projection.status_changed("CU-1", "NEEDS_REVIEW", "2024-03-02T11:59:59.500Z") is None
+
+    record = projection.get("CU-1")
+    assert record["status"] == "UNDER_REVIEW"
+    assert record["status_updated_at"] == "2024-03-02T12:00:00.000000Z"
+
+
+def test_status_change_times_are_compared_in_utc(projection):
+    create(projection, "CU-1")
+    projection.status_changed("CU-1", "UNDER_REVIEW", "2024-03-02T12:00:00Z")
+
+    # 13:30 at +02:00 is 11:30 UTC, i.e. older
+    projection.status_changed("CU-1", "NEEDS_REVIEW", "2024-03-02T13:30:00+02:00")
+    assert projection.get("CU-1")["status"] == "UNDER_REVIEW"
+
+    # 08:30 at -04:00 is 12:30 UTC, i.e. newer
+    projection.status_changed("CU-1", "APPROVED", "2024-03-02T08:30:00-04:00")
+    record = projection.get("CU-1")
+    assert record["status"] == "APPROVED"
+    assert record["status_updated_at"] == "2024-03-02T12:30:00.000000Z"
+    assert record["updated_at"] == "2024-03-02T12:30:00.000000Z"
+
+
+def test_status_change_for_unknown_case_creates_nothing(projection):
+    assert projection.status_changed("CU-404", "APPROVED", "2024-03-02T12:00:00Z") is None
+    assert projection.get("CU-404") is None
+
+
+@pytest.mark.parametrize("phone, expected", [
+    ("+1 (555) 123-4567", "5551234567"),
+    ("555-123-4567", "5551234567"),
+    ("15551234567", "5551234567"),
+    ("5551234567", "5551234567"),
+    ("+44 20 7946 0958", "442079460958"),
+    ("25551234567", "25551234567"),
+    ("ext. only", None),
+    ("", None),
+    (None, None),
+])
+def test_normalize_phone(phone, expected):
+    assert normalize_phone(phone) == expected
+
+
+def test_member_index_keys_skip_missing_values():
+    assert member_index_keys("M-1", "+1 555 123 4567") == ["member_id:M-1", "phone:5551234567"]
+    assert member_index_keys(None, "n/a") == []
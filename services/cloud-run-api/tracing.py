@@ -0,0 +1,84 @@
+"""
+Tytan LendingOps & MemberAssist - Tracing for the API service
+Starts (or continues, from an incoming traceparent header) a trace per upload
+request, with spans for the GCS upload, the documents insert and the Pub/Sub
+publish. The trace context is injected into the Pub/Sub message attributes so
+the Document AI worker continues the same trace.
+
+TRACE_EXPORTER selects where spans go: none (default), file (JSON lines in
+TRACE_FILE), otlp (OTLP/HTTP collector, OTEL_EXPORTER_OTLP_ENDPOINT) or console.
+"""
+
+import os
+import logging
+import functools
+
+from flask import request
+from opentelemetry import trace, propagate
+from opentelemetry.trace import SpanKind
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none').lower()
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', '1.0'))
+
+SERVICE_NAME = "cloud-run-api"
+
+tracer = trace.get_tracer(SERVICE_NAME)
+
+
+def init_tracing():
+    """Install a tracer provider for TRACE_EXPORTER (once per gunicorn worker process)"""
+    if TRACE_EXPORTER == 'none':
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if TRACE_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif TRACE_EXPORTER == 'file':
+        exporter = ConsoleSpanExporter(
+            out=open(TRACE_FILE, 'a', buffering=1),
+            formatter=lambda span: span.to_json(indent=None) + os.linesep
+        )
+    else:
+        exporter = ConsoleSpanExporter()
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACE_SAMPLE_RATIO))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled ({TRACE_EXPORTER} exporter, sample ratio {TRACE_SAMPLE_RATIO})")
+
+
+def traced_request(span_name):
+    """Decorator for Flask views: server span continuing any incoming traceparent"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(
+                span_name,
+                context=propagate.extract(request.headers),
+                kind=SpanKind.SERVER,
+                attributes={"http.method": request.method, "http.route": request.url_rule.rule, **kwargs}
+            ) as span:
+                response = view(*args, **kwargs)
+                status = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+                span.set_attribute("http.status_code", status)
+                return response
+        return wrapper
+    return decorator
+
+
+def message_attributes():
+    """W3C trace context of the current span, as Pub/Sub message attributes"""
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
@@ -0,0 +1,189 @@
+"""
+Tytan LendingOps & MemberAssist - Case status cache for the Dialogflow webhook
+Members ask about the same case several times in one conversation, and each
+BigQuery lookup can take most of Dialogflow's webhook timeout. Entries are served
+from memory while fresh; once stale they are still served (and refreshed in the
+background) for a while longer. Concurrent lookups of the same case share one
+in-flight query.
+
+Callers can bound how long they wait. A query still running after the recent p95
+query time gets a hedged duplicate (whichever finishes first wins); a caller that
+runs out of time gets TimeoutError and can fall back to peek(), while the query
+keeps running and fills the cache for the next turn.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent import futures
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Served without a query while younger than this
+CASE_CACHE_TTL_SECONDS = float(os.getenv('CASE_CACHE_TTL_SECONDS', '30'))
+
+# Past the TTL, served as-is for this much longer while a background refresh runs
+CASE_CACHE_STALE_SECONDS = float(os.getenv('CASE_CACHE_STALE_SECONDS', '300'))
+
+# "Case not found" is cached briefly so a mistyped number does not query on every turn
+CASE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('CASE_CACHE_NEGATIVE_TTL_SECONDS', '10'))
+
+CASE_CACHE_MAX_ENTRIES = int(os.getenv('CASE_CACHE_MAX_ENTRIES', '10000'))
+
+# Threads running queries (first attempts, hedges and background refreshes)
+CASE_CACHE_QUERY_THREADS = int(os.getenv('CASE_CACHE_QUERY_THREADS', '16'))
+
+# Hedge a query once it has run longer than the recent p95, within these bounds
+CASE_CACHE_HEDGE_MIN_SECONDS = float(os.getenv('CASE_CACHE_HEDGE_MIN_SECONDS', '0.25'))
+CASE_CACHE_HEDGE_DEFAULT_SECONDS = float(os.getenv('CASE_CACHE_HEDGE_DEFAULT_SECONDS', '1.0'))
+HEDGE_MIN_SAMPLES = 20
+
+
+class CacheEntry:
+    __slots__ = ("value", "loaded_at")
+
+    def __init__(self, value, loaded_at):
+        self.value = value
+        self.loaded_at = loaded_at
+
+
+class PendingLoad:
+    """One logical query for a case: up to two attempts (original and hedge) resolving one future"""
+
+    __slots__ = ("future", "attempts", "failures")
+
+    def __init__(self):
+        self.future = futures.Future()
+        self.attempts = 0
+        self.failures = 0
+
+
+class CaseStatusCache:
+    """TTL cache with stale-while-revalidate and per-key request coalescing"""
+
+    def __init__(self, loader, ttl_seconds=CASE_CACHE_TTL_SECONDS, stale_seconds=CASE_CACHE_STALE_SECONDS,
+                 negative_ttl_seconds=CASE_CACHE_NEGATIVE_TTL_SECONDS, max_entries=CASE_CACHE_MAX_ENTRIES):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # case_id -> CacheEntry, least recently used first
+        self.loading = {}  # case_id -> PendingLoad
+        self.load_seconds = deque(maxlen=200)
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=CASE_CACHE_QUERY_THREADS, thread_name_prefix='case-cache-query'
+        )
+        metrics.case_cache_entries.set_function(lambda: len(self.entries))
+
+    def get(self, case_id, timeout=None):
+        """
+        Return the case's status (None if the case does not exist)
+
+        Raises the loader's exception only when nothing servable is cached, and
+        concurrent.futures.TimeoutError when the query outlasts timeout seconds.
+        """
+        with self.lock:
+            entry = self.entries.get(case_id)
+            age = time.monotonic() - entry.loaded_at if entry else None
+            ttl = self.ttl_seconds if entry is None or entry.value is not None else self.negative_ttl_seconds
+
+            if entry is not None and age < ttl:
+                self.entries.move_to_end(case_id)
+                metrics.case_cache_lookups.labels("hit").inc()
+                return entry.value
+
+            if entry is not None and age < ttl + self.stale_seconds:
+                self.entries.move_to_end(case_id)
+                if case_id not in self.loading:
+                    self._start_load(case_id)
+                metrics.case_cache_lookups.labels("stale").inc()
+                return entry.value
+
+            pending = self.loading.get(case_id)
+            if pending is None:
+                pending = self._start_load(case_id)
+                metrics.case_cache_lookups.labels("miss").inc()
+            else:
+                metrics.case_cache_lookups.labels("coalesced").inc()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        hedge_delay = self.hedge_delay()
+        if timeout is None or hedge_delay < timeout:
+            try:
+                return pending.future.result(timeout=hedge_delay)
+            except futures.TimeoutError:
+                self._hedge(case_id, pending)
+
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        return pending.future.result(timeout=remaining)
+
+    def peek(self, case_id):
+        """Last loaded status regardless of age (None if never loaded or evicted)"""
+        with self.lock:
+            entry = self.entries.get(case_id)
+            return entry.value if entry else None
+
+    def hedge_delay(self):
+        """Recent p95 query time, so only the slowest queries are duplicated"""
+        samples = sorted(self.load_seconds)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return CASE_CACHE_HEDGE_DEFAULT_SECONDS
+        return max(CASE_CACHE_HEDGE_MIN_SECONDS, samples[int(0.95 * (len(samples) - 1))])
+
+    def _start_load(self, case_id):
+        """Register and submit the first attempt (caller holds the lock)"""
+        pending = self.loading[case_id] = PendingLoad()
+        pending.attempts = 1
+        self.executor.submit(self._attempt, case_id, pending, False)
+        return pending
+
+    def _hedge(self, case_id, pending):
+        with self.lock:
+            if pending.future.done() or pending.attempts > 1:
+                return
+            pending.attempts += 1
+        metrics.case_cache_hedges.labels("sent").inc()
+        self.executor.submit(self._attempt, case_id, pending, True)
+
+    def _attempt(self, case_id, pending, hedged):
+        """Run the loader; the first success resolves the load, which fails only if every attempt fails"""
+        started = time.perf_counter()
+        try:
+            value = self.loader(case_id)
+        except Exception as e:
+            metrics.case_cache_load_errors.inc()
+            with self.lock:
+                pending.failures += 1
+                if pending.failures < pending.attempts or pending.future.done():
+                    return
+                self.loading.pop(case_id, None)
+            # A stale entry, if any, stays in place until it ages out
+            logger.warning(f"Query for case {case_id} failed: {e}")
+            pending.future.set_exception(e)
+            return
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.case_cache_load_duration.observe(elapsed)
+
+        with self.lock:
+            self.load_seconds.append(elapsed)
+            if pending.future.done():
+                return
+            self.entries[case_id] = CacheEntry(value, time.monotonic())
+            self.entries.move_to_end(case_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.loading.pop(case_id, None)
+        if hedged:
+            metrics.case_cache_hedges.labels("won").inc()
+        pending.future.set_result(value)
+
+    def invalidate(self, case_id):
+        with self.lock:
+            self.entries.pop(case_id, None)
@@ -0,0 +1,496 @@
+"""
+Tytan LendingOps & MemberAssist - Escalation outbox for callback requests
+escalate_to_human only records the request here and answers the member at once;
+the CRM ticket is created afterwards, outside Dialogflow's webhook timeout. A
+background dispatcher claims due entries in batches, posts them to the ticketing
+endpoint (TICKET_ENDPOINT_URL) and retries failures with exponential backoff up
+to ESCALATION_MAX_ATTEMPTS.
+
+Repeat escalations for the same case within ESCALATION_DEDUPE_WINDOW_SECONDS
+(members ask twice, or again after a dropped call) join the existing entry
+while it is still pending instead of creating a second ticket. Once that ticket
+has been created, or delivery has failed for good, a repeat request gets a new one.
+
+A claim pushes next_attempt_at one lease ahead, so entries held by an instance
+that dies mid-delivery become due again once the lease lapses. Delivery is
+therefore at-least-once; the endpoint receives escalation_id as an idempotency key.
+
+ESCALATION_OUTBOX_BACKEND selects the store: firestore (production default) or
+sqlite (default in mock mode). To test delivery locally, run
+fake_ticket_endpoint.py and set TICKET_ENDPOINT_URL=http://localhost:8090/tickets/batch.
+
+    python escalation_outbox.py backlog
+    python escalation_outbox.py requeue-failed
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import sqlite3
+import tempfile
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
+
+ESCALATION_OUTBOX_BACKEND = os.getenv('ESCALATION_OUTBOX_BACKEND', '')
+ESCALATION_OUTBOX_COLLECTION = os.getenv('ESCALATION_OUTBOX_COLLECTION', 'escalation_outbox')
+ESCALATION_DEDUPE_COLLECTION = os.getenv('ESCALATION_DEDUPE_COLLECTION', 'escalation_dedupe')
+ESCALATION_OUTBOX_SQLITE_PATH = os.getenv(
+    'ESCALATION_OUTBOX_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'escalation_outbox.db')
+)
+
+ESCALATION_DEDUPE_WINDOW_SECONDS = float(os.getenv('ESCALATION_DEDUPE_WINDOW_SECONDS', '1800'))
+
+# Dispatcher: entries per delivery request, idle poll interval, and how long a claim holds an entry
+ESCALATION_BATCH_SIZE = int(os.getenv('ESCALATION_BATCH_SIZE', '50'))
+ESCALATION_POLL_SECONDS = float(os.getenv('ESCALATION_POLL_SECONDS', '5'))
+ESCALATION_LEASE_SECONDS = float(os.getenv('ESCALATION_LEASE_SECONDS', '60'))
+
+# Retries back off exponentially (with jitter) from the base up to the cap
+ESCALATION_MAX_ATTEMPTS = int(os.getenv('ESCALATION_MAX_ATTEMPTS', '8'))
+ESCALATION_BACKOFF_BASE_SECONDS = float(os.getenv('ESCALATION_BACKOFF_BASE_SECONDS', '5'))
+ESCALATION_BACKOFF_MAX_SECONDS = float(os.getenv('ESCALATION_BACKOFF_MAX_SECONDS', '600'))
+
+TICKET_ENDPOINT_URL = os.getenv('TICKET_ENDPOINT_URL', '')
+TICKET_API_TOKEN = os.getenv('TICKET_API_TOKEN', '')
+TICKET_TIMEOUT_SECONDS = float(os.getenv('TICKET_TIMEOUT_SECONDS', '10'))
+
+PENDING = "PENDING"
+DELIVERED = "DELIVERED"
+FAILED = "FAILED"
+
+ENTRY_FIELDS = ("escalation_id", "dedupe_key", "case_id", "phone", "session", "reason", "created_at", "status",
+                "attempts", "next_attempt_at", "requests", "last_error", "ticket_id", "delivered_at")
+
+
+def dedupe_key(case_id=None, phone=None, session=None):
+    """Escalations are deduplicated per case, or per phone / conversation when no case was given"""
+    if case_id:
+        return f"case:{case_id}"
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    if digits:
+        return f"phone:{digits[-10:]}"
+    # Session paths end in the session id; keep the key free of "/" for Firestore document ids
+    return f"session:{(session or uuid.uuid4().hex).rsplit('/', 1)[-1]}"
+
+
+def backoff_seconds(attempts):
+    """Delay before the next try after `attempts` failures: exponential, capped, with jitter"""
+    delay = min(ESCALATION_BACKOFF_MAX_SECONDS, ESCALATION_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def ticket_payload(entry):
+    return {
+        "escalation_id": entry["escalation_id"],
+        "case_id": entry["case_id"],
+        "phone": entry["phone"],
+        "reason": entry["reason"],
+        "requests": entry["requests"],
+        "requested_at": datetime.fromtimestamp(entry["created_at"], timezone.utc).isoformat().replace("+00:00", "Z")
+    }
+
+
+class SqliteBackend:
+    """Embedded stand-in for Firestore: one row per escalation"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS escalation_outbox (
+                escalation_id TEXT PRIMARY KEY,
+                dedupe_key TEXT NOT NULL,
+                case_id TEXT,
+                phone TEXT,
+                session TEXT,
+                reason TEXT,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                requests INTEGER NOT NULL,
+                last_error TEXT,
+                ticket_id TEXT,
+                delivered_at REAL
+            )
+        """)
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS escalation_outbox_due ON escalation_outbox (status, next_attempt_at)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS escalation_outbox_dedupe ON escalation_outbox (dedupe_key, created_at)"
+        )
+
+    def _transaction(self, work):
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so other processes sharing the file serialize too
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self.connection.execute("COMMIT")
+                return result
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, entry, window_start):
+        """Store entry unless a pending one with its dedupe key exists since window_start; returns (entry, duplicate)"""
+        def work():
+            row = self.connection.execute(
+                "SELECT * FROM escalation_outbox WHERE dedupe_key = ? AND created_at >= ? AND status = ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (entry["dedupe_key"], window_start, PENDING)
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE escalation_outbox SET requests = requests + 1 WHERE escalation_id = ?",
+                    (row["escalation_id"],)
+                )
+                return dict(row, requests=row["requests"] + 1), True
+            self.connection.execute(
+                f"INSERT INTO escalation_outbox ({', '.join(ENTRY_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(ENTRY_FIELDS))})",
+                [entry[field] for field in ENTRY_FIELDS]
+            )
+            return entry, False
+
+        return self._transaction(work)
+
+    def claim(self, now, limit, lease_seconds):
+        """Take up to limit due entries, oldest due first, holding them for lease_seconds"""
+        def work():
+            rows = self.connection.execute(
+                "SELECT * FROM escalation_outbox WHERE status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, now, limit)
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE escalation_outbox SET next_attempt_at = ? WHERE escalation_id = ?",
+                [(now + lease_seconds, row["escalation_id"]) for row in rows]
+            )
+            return [dict(row) for row in rows]
+
+        return self._transaction(work)
+
+    def update(self, escalation_id, changes):
+        with self.lock:
+            self.connection.execute(
+                f"UPDATE escalation_outbox SET {', '.join(f'{field} = ?' for field in changes)} "
+                "WHERE escalation_id = ?",
+                list(changes.values()) + [escalation_id]
+            )
+
+    def requeue_failed(self, now):
+        """Give every failed entry a fresh set of attempts; returns how many"""
+        def work():
+            return self.connection.execute(
+                "UPDATE escalation_outbox SET status = ?, attempts = 0, next_attempt_at = ? WHERE status = ?",
+                (PENDING, now, FAILED)
+            ).rowcount
+
+        return self._transaction(work)
+
+    def backlog(self):
+        """(pending entries, created_at of the oldest or None)"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM escalation_outbox WHERE status = ?", (PENDING,)
+            ).fetchone()
+        return row[0], row[1]
+
+
+class FirestoreBackend:
+    """
+    One document per escalation in ESCALATION_OUTBOX_COLLECTION, plus one per dedupe
+    key in ESCALATION_DEDUPE_COLLECTION pointing at its latest escalation
+    """
+
+    def __init__(self, collection, dedupe_collection):
+        from google.cloud import firestore
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        self.firestore = firestore
+        self.FieldFilter = FieldFilter
+        self.client = firestore.Client(project=PROJECT_ID)
+        self.collection = self.client.collection(collection)
+        self.dedupe_collection = self.client.collection(dedupe_collection)
+
+    def enqueue(self, entry, window_start):
+        """Store entry unless a pending one with its dedupe key exists since window_start; returns (entry, duplicate)"""
+        dedupe_reference = self.dedupe_collection.document(entry["dedupe_key"])
+
+        @self.firestore.transactional
+        def apply(transaction):
+            latest = dedupe_reference.get(transaction=transaction)
+            if latest.exists and latest.get("created_at") >= window_start:
+                reference = self.collection.document(latest.get("escalation_id"))
+                existing = reference.get(transaction=transaction)
+                if existing.exists and existing.get("status") == PENDING:
+                    transaction.update(reference, {"requests": self.firestore.Increment(1)})
+                    record = existing.to_dict()
+                    return dict(record, requests=record["requests"] + 1), True
+            transaction.set(self.collection.document(entry["escalation_id"]), entry)
+            transaction.set(dedupe_reference, {
+                "escalation_id": entry["escalation_id"], "created_at": entry["created_at"]
+            })
+            return entry, False
+
+        return apply(self.client.transaction())
+
+    def claim(self, now, limit, lease_seconds):
+        """Take up to limit due entries, oldest due first, holding them for lease_seconds"""
+        due = (
+            self.collection
+            .where(filter=self.FieldFilter("status", "==", PENDING))
+            .where(filter=self.FieldFilter("next_attempt_at", "<=", now))
+            .order_by("next_attempt_at")
+            .limit(limit)
+        )
+
+        @self.firestore.transactional
+        def take(transaction, reference):
+            # Another instance may have claimed it between the query and this transaction
+            snapshot = reference.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get("status") != PENDING or snapshot.get("next_attempt_at") > now:
+                return None
+            transaction.update(reference, {"next_attempt_at": now + lease_seconds})
+            return snapshot.to_dict()
+
+        claimed = []
+        for snapshot in due.stream():
+            entry = take(self.client.transaction(), snapshot.reference)
+            if entry is not None:
+                claimed.append(entry)
+        return claimed
+
+    def update(self, escalation_id, changes):
+        self.collection.document(escalation_id).update(changes)
+
+    def requeue_failed(self, now):
+        """Give every failed entry a fresh set of attempts; returns how many"""
+        count = 0
+        batch = self.client.batch()
+        for snapshot in self.collection.where(filter=self.FieldFilter("status", "==", FAILED)).stream():
+            batch.update(snapshot.reference, {"status": PENDING, "attempts": 0, "next_attempt_at": now})
+            count += 1
+            if count % 500 == 0:
+                batch.commit()
+                batch = self.client.batch()
+        batch.commit()
+        return count
+
+    def backlog(self):
+        """(pending entries, created_at of the oldest or None)"""
+        pending = self.collection.where(filter=self.FieldFilter("status", "==", PENDING))
+        count = pending.count().get()[0][0].value
+        oldest = list(pending.order_by("created_at").limit(1).stream())
+        return count, oldest[0].get("created_at") if oldest else None
+
+
+class EscalationOutbox:
+    """Records callback requests for later delivery"""
+
+    def __init__(self, backend, dedupe_window_seconds=ESCALATION_DEDUPE_WINDOW_SECONDS):
+        self.backend = backend
+        self.dedupe_window_seconds = dedupe_window_seconds
+
+    def enqueue(self, case_id=None, phone=None, session=None, reason=None):
+        """Record an escalation; returns (entry, duplicate) where duplicate means it joined a recent one"""
+        now = time.time()
+        entry = {
+            "escalation_id": str(uuid.uuid4()),
+            "dedupe_key": dedupe_key(case_id, phone, session),
+            "case_id": case_id,
+            "phone": phone,
+            "session": session,
+            "reason": reason,
+            "created_at": now,
+            "status": PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "requests": 1,
+            "last_error": None,
+            "ticket_id": None,
+            "delivered_at": None
+        }
+        entry, duplicate = self.backend.enqueue(entry, now - self.dedupe_window_seconds)
+        metrics.escalations_enqueued.labels("duplicate" if duplicate else "queued").inc()
+        return entry, duplicate
+
+
+class TicketClient:
+    """Creates CRM callback tickets in batches"""
+
+    def __init__(self, url, token=None, timeout_seconds=TICKET_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout_seconds = timeout_seconds
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def create_tickets(self, entries):
+        """
+        POST {"tickets": [...]}; the endpoint answers {"results": [{"escalation_id",
+        "ticket_id"} or {"escalation_id", "error"}]}. Returns escalation_id -> result;
+        raises when the whole batch failed.
+        """
+        response = self.session.post(
+            self.url, json={"tickets": [ticket_payload(entry) for entry in entries]}, timeout=self.timeout_seconds
+        )
+        response.raise_for_status()
+        return {result["escalation_id"]: result for result in response.json().get("results", [])}
+
+
+def mock_create_tickets(entries):
+    logger.info(f"[MOCK] Would create {len(entries)} callback tickets: {[e['escalation_id'] for e in entries]}")
+    return {entry["escalation_id"]: {"ticket_id": f"MOCK-{entry['escalation_id'][:8]}"} for entry in entries}
+
+
+class EscalationDispatcher:
+    """Delivers due outbox entries in batches from a background thread"""
+
+    def __init__(self, backend, create_tickets, batch_size=ESCALATION_BATCH_SIZE,
+                 poll_seconds=ESCALATION_POLL_SECONDS, lease_seconds=ESCALATION_LEASE_SECONDS,
+                 max_attempts=ESCALATION_MAX_ATTEMPTS):
+        self.backend = backend
+        self.create_tickets = create_tickets
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='escalation-dispatcher', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                claimed = self.dispatch_once()
+                self.report_backlog()
+            except Exception as e:
+                logger.error(f"Escalation dispatch failed: {e}")
+                claimed = 0
+            # A full batch suggests more are due; otherwise wait for new escalations
+            if claimed < self.batch_size:
+                self.stopped.wait(self.poll_seconds)
+
+    def dispatch_once(self):
+        """Claim and deliver one batch; returns how many entries were claimed"""
+        batch = self.backend.claim(time.time(), self.batch_size, self.lease_seconds)
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            results = self.create_tickets(batch)
+        except Exception as e:
+            logger.warning(f"Ticket batch of {len(batch)} failed: {e}")
+            results = {entry["escalation_id"]: {"error": str(e)} for entry in batch}
+        metrics.escalation_batch_duration.observe(time.perf_counter() - started)
+
+        for entry in batch:
+            result = results.get(entry["escalation_id"]) or {"error": "No result returned for escalation"}
+            if result.get("ticket_id"):
+                self._delivered(entry, result["ticket_id"])
+            else:
+                self._failed_attempt(entry, result.get("error", "Unknown error"))
+        return len(batch)
+
+    def _delivered(self, entry, ticket_id):
+        self.backend.update(entry["escalation_id"], {
+            "status": DELIVERED,
+            "attempts": entry["attempts"] + 1,
+            "ticket_id": ticket_id,
+            "delivered_at": time.time(),
+            "last_error": None
+        })
+        metrics.escalation_deliveries.labels("delivered").inc()
+        logger.info(f"Escalation {entry['escalation_id']} for case {entry['case_id']} became ticket {ticket_id}")
+
+    def _failed_attempt(self, entry, error):
+        attempts = entry["attempts"] + 1
+        if attempts >= self.max_attempts:
+            self.backend.update(entry["escalation_id"], {"status": FAILED, "attempts": attempts, "last_error": error})
+            metrics.escalation_deliveries.labels("failed").inc()
+            logger.error(
+                f"Escalation {entry['escalation_id']} for case {entry['case_id']} failed after {attempts} attempts: {error}"
+            )
+            return
+
+        self.backend.update(entry["escalation_id"], {
+            "attempts": attempts,
+            "next_attempt_at": time.time() + backoff_seconds(attempts),
+            "last_error": error
+        })
+        metrics.escalation_deliveries.labels("retried").inc()
+
+    def report_backlog(self):
+        pending, oldest_created_at = self.backend.backlog()
+        metrics.escalation_backlog.set(pending)
+        metrics.escalation_oldest_age.set(time.time() - oldest_created_at if oldest_created_at else 0)
+
+
+def open_backend(mock_mode=False):
+    """Outbox store on ESCALATION_OUTBOX_BACKEND (firestore, or sqlite in mock mode)"""
+    backend = ESCALATION_OUTBOX_BACKEND or ('sqlite' if mock_mode else 'firestore')
+    if backend == 'sqlite':
+        return SqliteBackend(ESCALATION_OUTBOX_SQLITE_PATH)
+    if backend == 'firestore':
+        return FirestoreBackend(ESCALATION_OUTBOX_COLLECTION, ESCALATION_DEDUPE_COLLECTION)
+    raise ValueError(f"Unknown ESCALATION_OUTBOX_BACKEND: {backend}")
+
+
+def start_dispatcher(backend, mock_mode=False):
+    """Deliver to TICKET_ENDPOINT_URL, or log deliveries in mock mode; None if there is nowhere to deliver"""
+    if TICKET_ENDPOINT_URL:
+        create_tickets = TicketClient(TICKET_ENDPOINT_URL, TICKET_API_TOKEN).create_tickets
+    elif mock_mode:
+        create_tickets = mock_create_tickets
+    else:
+        logger.warning("TICKET_ENDPOINT_URL is not set; escalations are recorded but not delivered")
+        return None
+    return EscalationDispatcher(backend, create_tickets).start()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Escalation outbox maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backlog', help="Print how many escalations are waiting and the oldest one's age")
+    commands.add_parser('requeue-failed', help="Retry escalations that ran out of attempts")
+
+    args = parser.parse_args(argv)
+    backend = open_backend(os.getenv('MOCK_MODE', 'false').lower() == 'true')
+
+    if args.command == 'backlog':
+        pending, oldest_created_at = backend.backlog()
+        age = f"{time.time() - oldest_created_at:.0f}s" if oldest_created_at else "-"
+        print(f"pending={pending} oldest_age={age}")
+        return 0
+
+    logger.info(f"Requeued {backend.requeue_failed(time.time())} failed escalation(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
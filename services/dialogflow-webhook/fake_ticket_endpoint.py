@@ -0,0 +1,80 @@
+"""
+Tytan LendingOps & MemberAssist - Fake ticketing endpoint for local testing
+Stands in for the CRM's batch ticket API so the escalation outbox can be
+exercised end to end, including slow responses, failed batches and failed
+tickets within a batch:
+
+    python fake_ticket_endpoint.py --port 8090 --batch-error-rate 0.2 --ticket-error-rate 0.05
+    TICKET_ENDPOINT_URL=http://localhost:8090/tickets/batch MOCK_MODE=true python main.py
+
+Tickets are keyed by escalation_id, so a redelivered escalation gets its
+original ticket back. GET /tickets lists what has been created.
+"""
+
+import time
+import random
+import logging
+import argparse
+import threading
+
+from flask import Flask, request, jsonify
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+settings = {"latency_ms": 0.0, "batch_error_rate": 0.0, "ticket_error_rate": 0.0}
+tickets = {}  # escalation_id -> ticket
+tickets_lock = threading.Lock()
+
+
+@app.route('/tickets/batch', methods=['POST'])
+def create_tickets():
+    time.sleep(settings["latency_ms"] / 1000)
+    batch = request.get_json().get('tickets', [])
+
+    if random.random() < settings["batch_error_rate"]:
+        logger.info(f"Rejecting batch of {len(batch)}")
+        return jsonify({"error": "Ticketing system unavailable"}), 503
+
+    results = []
+    with tickets_lock:
+        for ticket in batch:
+            escalation_id = ticket['escalation_id']
+            if escalation_id not in tickets and random.random() < settings["ticket_error_rate"]:
+                results.append({"escalation_id": escalation_id, "error": "Ticket rejected"})
+                continue
+            if escalation_id not in tickets:
+                tickets[escalation_id] = dict(ticket, ticket_id=f"TKT-{len(tickets) + 1:06d}")
+            results.append({"escalation_id": escalation_id, "ticket_id": tickets[escalation_id]['ticket_id']})
+
+    logger.info(f"Batch of {len(batch)}: {sum('ticket_id' in r for r in results)} ticket(s) created")
+    return jsonify({"results": results}), 200
+
+
+@app.route('/tickets', methods=['GET'])
+def list_tickets():
+    with tickets_lock:
+        return jsonify(list(tickets.values())), 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake CRM batch ticket endpoint")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay before answering each batch")
+    parser.add_argument('--batch-error-rate', type=float, default=0.0, help="Share of batches answered with 503")
+    parser.add_argument('--ticket-error-rate', type=float, default=0.0, help="Share of tickets rejected in a batch")
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms, batch_error_rate=args.batch_error_rate, ticket_error_rate=args.ticket_error_rate
+    )
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
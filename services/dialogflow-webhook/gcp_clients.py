@@ -0,0 +1,306 @@
+"""
+Tytan LendingOps & MemberAssist - Lazily built Google Cloud clients
+Clients, and the google.cloud packages behind them, are only created when
+something first uses them, so a cold instance imports quickly and answers /health
+without waiting on credential discovery. Each client is built once per process
+under a lock; threads that need it at the same moment wait for that one build.
+
+    bq_client = gcp_clients.LazyClient("bigquery", gcp_clients.bigquery_client)
+    bq_client.query(query)  # built here, then reused
+
+A client that fails to build raises ClientUnavailableError, and is retried after
+CLIENT_RETRY_SECONDS rather than on every request. LazyClient is false while its
+client cannot be built, so `if bq_client:` keeps working as a None check did.
+
+warm_up() builds clients on background threads and makes one cheap call through
+each (ping), so tokens are fetched and connections open before traffic arrives.
+The services' Cloud Run startup probes wait for it on /warmup.
+
+    python gcp_clients.py startup-benchmark
+
+reports import time, time to the first request and warm-up time for the service
+in the current directory.
+
+This file is kept identical in services/cloud-run-api, services/dialogflow-webhook
+and pipelines/document_ai_worker (tests/test_shared_modules.py fails otherwise).
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import statistics
+import tempfile
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
+
+# How long a client that failed to build is reported unavailable before it is tried again
+CLIENT_RETRY_SECONDS = float(os.getenv('CLIENT_RETRY_SECONDS', '30'))
+
+# How long /warmup waits for warm-up to finish before answering 503 (keep below the probe timeout)
+WARMUP_WAIT_SECONDS = float(os.getenv('WARMUP_WAIT_SECONDS', '4'))
+
+
+class ClientUnavailableError(RuntimeError):
+    """A client could not be built (recently), so the call it was needed for cannot be made"""
+
+
+def bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client(project=PROJECT_ID)
+
+
+def storage_client():
+    from google.cloud import storage
+    return storage.Client(project=PROJECT_ID)
+
+
+def publisher_client(enable_message_ordering=False):
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient(
+        publisher_options=pubsub_v1.types.PublisherOptions(enable_message_ordering=enable_message_ordering)
+    )
+
+
+def subscriber_client():
+    from google.cloud import pubsub_v1
+    return pubsub_v1.SubscriberClient()
+
+
+def documentai_client():
+    from google.cloud import documentai_v1
+    return documentai_v1.DocumentProcessorServiceClient()
+
+
+class LazyClient:
+    """
+    Builds a client on first use and stands in for it
+
+    Attribute access goes to the client, so LazyClient's own names are kept to
+    build(), use() and built (plus underscored state) to stay out of its way.
+    """
+
+    def __init__(self, name, factory, ping=None):
+        self._name = name
+        self._factory = factory
+        self._ping = ping
+        self._client = None
+        self._error = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """The client, building it if this is the first use"""
+        client = self._client
+        if client is not None:
+            return client
+
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            if self._failed_at is not None and time.monotonic() - self._failed_at < CLIENT_RETRY_SECONDS:
+                raise ClientUnavailableError(f"{self._name} client is unavailable: {self._error}")
+
+            started = time.perf_counter()
+            try:
+                self._client = self._factory()
+            except Exception as e:
+                self._error, self._failed_at = e, time.monotonic()
+                logger.error(f"Failed to initialize {self._name} client: {e}")
+                raise ClientUnavailableError(f"{self._name} client is unavailable: {e}") from e
+            self._error = self._failed_at = None
+            logger.info(f"Initialized {self._name} client in {time.perf_counter() - started:.2f}s")
+            return self._client
+
+    def use(self, client):
+        """Stand in for an already built client (benchmarks and local tools)"""
+        with self._lock:
+            self._client = client
+            self._error = self._failed_at = None
+
+    @property
+    def built(self):
+        return self._client is not None
+
+    def __bool__(self):
+        try:
+            self.build()
+            return True
+        except ClientUnavailableError:
+            return False
+
+    def __getattr__(self, name):
+        # Only reached for names LazyClient itself does not have
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.build(), name)
+
+    def __repr__(self):
+        return f"LazyClient({self._name!r}, built={self.built})"
+
+
+class WarmUp:
+    """Builds and pings clients on background threads; wait() tells whether that has finished"""
+
+    def __init__(self, clients):
+        self.clients = list(clients)
+        self.results = {}
+        self.seconds = None
+        self.started = time.perf_counter()
+        self.remaining = len(self.clients)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def start(self):
+        if not self.clients:
+            self.seconds = 0.0
+            self.done.set()
+        for client in self.clients:
+            threading.Thread(target=self._warm, args=(client,), name=f'warm-up-{client._name}', daemon=True).start()
+        return self
+
+    def _warm(self, client):
+        started = time.perf_counter()
+        try:
+            built = client.build()
+            if client._ping is not None:
+                client._ping(built)
+            result = {"status": "ok"}
+        except Exception as e:
+            if client.built and is_api_error(e):
+                # The API answered (e.g. 403 for a call the role does not cover): the token was
+                # fetched and the connection opened, which is all warm-up is for
+                result = {"status": "ok", "ping": type(e).__name__}
+            else:
+                # Requests still build or retry the client themselves; this only costs the head start
+                logger.warning(f"Warm-up of {client._name} client failed: {e}")
+                result = {"status": "error", "error": str(e)}
+        result["seconds"] = round(time.perf_counter() - started, 3)
+
+        with self.lock:
+            self.results[client._name] = result
+            self.remaining -= 1
+            if self.remaining:
+                return
+            self.seconds = time.perf_counter() - self.started
+        logger.info(f"Warm-up finished in {self.seconds:.2f}s")
+        self.done.set()
+
+    def wait(self, timeout=WARMUP_WAIT_SECONDS):
+        return self.done.wait(timeout)
+
+
+def is_api_error(error):
+    """Whether error is a response from a Google API (as opposed to a connection or credentials failure)"""
+    from google.api_core import exceptions
+    return isinstance(error, exceptions.GoogleAPICallError)
+
+
+def warm_up(*clients):
+    """Start warming clients (None entries are skipped) and return the WarmUp tracking it"""
+    return WarmUp(client for client in clients if client is not None).start()
+
+
+# Run in a fresh interpreter per sample, so nothing is cached from a previous import
+STARTUP_PROBE = """
+import os, sys, json, time, importlib
+started = time.perf_counter()
+sys.path.insert(0, os.getcwd())
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+if hasattr(module, 'app'):
+    status = module.app.test_client().get('/health').status_code
+else:
+    class Message:
+        data = json.dumps({"case_id": "CU-2024-00000", "document_id": "DOC-STARTUP",
+                           "gcs_uri": "gs://startup/doc.pdf", "document_type": "paystub"}).encode('utf-8')
+        attributes = {}
+        publish_time = None
+        acked = False
+        def ack(self):
+            self.acked = True
+        def nack(self):
+            pass
+    message = Message()
+    module.process_message(message)
+    status = 200 if message.acked else 500
+first_request = time.perf_counter()
+google_modules = sum(1 for name in sys.modules if name.startswith('google'))
+warmed = getattr(module, 'warm_up', None)
+warmed_up = warmed.wait(60) if warmed is not None else True
+with open(sys.argv[2], 'w') as result:
+    json.dump({
+        "import_seconds": imported - started,
+        "first_request_seconds": first_request - imported,
+        "warm_up_seconds": warmed.seconds if warmed is not None and warmed_up else None,
+        "status": status,
+        "google_modules": google_modules,
+    }, result)
+os._exit(0)
+"""
+
+
+def startup_benchmark(module, runs, mock_mode):
+    """Import time, time to the first request, and warm-up time of a service, over fresh processes"""
+    env = dict(os.environ, MOCK_MODE='true' if mock_mode else 'false')
+    samples = []
+    with tempfile.TemporaryDirectory() as directory:
+        result_path = os.path.join(directory, 'startup.json')
+        for _ in range(runs):
+            completed = subprocess.run(
+                [sys.executable, '-c', STARTUP_PROBE, module, result_path],
+                env=env, capture_output=True, text=True, timeout=300
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"Startup probe failed:\n{completed.stderr[-2000:]}")
+            with open(result_path) as f:
+                samples.append(json.load(f))
+
+    def median(field):
+        values = [sample[field] for sample in samples if sample[field] is not None]
+        return statistics.median(values) if values else None
+
+    summary = {
+        "module": module,
+        "mock_mode": mock_mode,
+        "runs": runs,
+        "import_seconds": median("import_seconds"),
+        "first_request_seconds": median("first_request_seconds"),
+        "warm_up_seconds": median("warm_up_seconds"),
+        "google_modules": samples[-1]["google_modules"],
+        "first_request_status": samples[-1]["status"]
+    }
+    print(f"{module}: import {summary['import_seconds']:.3f}s, "
+          f"first request {summary['first_request_seconds']:.3f}s (status {summary['first_request_status']}), "
+          f"warm-up {'-' if summary['warm_up_seconds'] is None else format(summary['warm_up_seconds'], '.3f') + 's'}, "
+          f"{summary['google_modules']} google modules loaded at the first request (median of {runs})")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Google Cloud client tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    benchmark_parser = commands.add_parser('startup-benchmark', help="Measure cold start of this directory's service")
+    benchmark_parser.add_argument('--module', default='main' if os.path.exists('main.py') else 'worker',
+                                  help="Service module to import (main, or worker for the Document AI worker)")
+    benchmark_parser.add_argument('--runs', type=int, default=5)
+    benchmark_parser.add_argument('--live', action='store_true',
+                                  help="Run with MOCK_MODE=false (needs credentials; warm-up then pings real APIs)")
+    benchmark_parser.add_argument('--output', help="Also write the summary here as JSON")
+
+    args = parser.parse_args(argv)
+    summary = startup_benchmark(args.module, args.runs, mock_mode=not args.live)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
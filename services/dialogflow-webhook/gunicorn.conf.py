@@ -0,0 +1,12 @@
+"""
+gunicorn settings for the Dialogflow webhook
+Serves the metrics on METRICS_PORT (see metrics.py) from the single worker
+process, which holds them, away from the public request port.
+"""
+
+
+def post_worker_init(worker):
+    """Serve /metrics on METRICS_PORT once the app is loaded"""
+    import metrics
+
+    metrics.start_server()
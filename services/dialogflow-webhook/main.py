@@ -4,107 +4,252 @@ Handles chatbot queries for case status
 """
 
 import os
-import logging
-import json
-from datetime import datetime
-from flask import Flask, request, jsonify
-from google.cloud import bigquery
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+import time
+from datetime import datetime, timezone
+from concurrent import futures
+from flask import Flask, request, jsonify, g
+
+import metrics
+import gcp_clients
+import case_projection
+import timeline_stats
+import escalation_outbox
+import structured_logging
+from case_cache import CaseStatusCache
+
+# Configure logging: request lines are sampled, everything is rendered off the request thread
+structured_logging.configure({"webhook.request": 0.05})
+logger = structured_logging.get_logger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+metrics.init_app(app)
 
 # Configuration
 PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
 DATASET_ID = os.getenv('DATASET_ID', 'tytan_lending_ops')
 MOCK_MODE = os.getenv('MOCK_MODE', 'false').lower() == 'true'
 
-# Initialize BigQuery client
-try:
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    logger.info(f"Initialized BigQuery client for project: {PROJECT_ID}")
-except Exception as e:
-    logger.error(f"Failed to initialize BigQuery client: {e}")
-    bq_client = None
+# Dialogflow CX webhook timeout (an agent setting, 5s by default), and the part of it
+# kept back for building the response and the trip back to Dialogflow
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('WEBHOOK_TIMEOUT_SECONDS', '5'))
+WEBHOOK_RESPONSE_MARGIN_SECONDS = float(os.getenv('WEBHOOK_RESPONSE_MARGIN_SECONDS', '0.75'))
+
+# Queries that outlive the request keep running to fill the cache, but not forever
+CASE_QUERY_TIMEOUT_SECONDS = float(os.getenv('CASE_QUERY_TIMEOUT_SECONDS', '30'))
+
+# Fulfillment tags handled below (anything else is reported as "other" in metrics)
+WEBHOOK_TAGS = ("get_case_status", "get_member_cases", "escalate_to_human", "get_timeline")
+
+# BigQuery is built on first use (see gcp_clients.py); warm-up builds it ahead of traffic
+bq_client = gcp_clients.LazyClient(
+    "bigquery", gcp_clients.bigquery_client, ping=lambda client: client.get_dataset(DATASET_ID)
+)
+
+# Case status read model kept current by the API and worker; BigQuery is the fallback
+projection = gcp_clients.LazyClient(
+    "case_projection", lambda: case_projection.open_projection(MOCK_MODE),
+    ping=lambda store: store.get("CU-0000-00000")
+)
+
+# Callback requests are recorded here and turned into CRM tickets in the background
+outbox_backend = gcp_clients.LazyClient("escalation_outbox", lambda: escalation_outbox.open_backend(MOCK_MODE))
+outbox = escalation_outbox.EscalationOutbox(outbox_backend)
+escalation_dispatcher = escalation_outbox.start_dispatcher(outbox_backend, MOCK_MODE)
+
+# Mock mode never queries BigQuery; the projection and outbox are local SQLite there
+warm_up = gcp_clients.warm_up(projection, outbox_backend, None if MOCK_MODE else bq_client)
+
+
+def case_status_from_record(record):
+    """Projection record -> the case status dict format_status_message takes"""
+    return {
+        "case_id": record['case_id'],
+        "status": record['status'],
+        "created_at": record['created_at'],
+        "status_updated_at": record['status_updated_at'],
+        "loan_type": record['loan_type'],
+        "documents_received": record['documents_received'],
+        "missing_documents": record['missing_documents']
+    }
+
 
+def query_case_status(case_id):
+    """Case status and documents from the projection, or BigQuery for cases it does not hold; None if not found"""
+    record = projection.get(case_id) if projection else None
+    if record is not None:
+        return case_status_from_record(record)
 
-def get_case_status(case_id):
-    """Query BigQuery for case status and documents"""
     if MOCK_MODE:
         return {
             "case_id": case_id,
             "status": "NEEDS_REVIEW",
             "created_at": "2024-01-15T10:00:00Z",
+            "status_updated_at": "2024-01-15T10:05:00Z",
             "loan_type": "auto",
             "documents_received": ["drivers_license", "paystub"],
             "missing_documents": ["bank_statement_30days"]
         }
 
-    try:
-        query = f"""
-            SELECT
-                c.case_id,
-                c.status,
-                c.created_at,
-                c.loan_type,
-                ARRAY_AGG(DISTINCT d.document_type) as documents_received
-            FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
-            LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.documents` d
-                ON c.case_id = d.case_id
-            WHERE c.case_id = @case_id
-            GROUP BY c.case_id, c.status, c.created_at, c.loan_type
-        """
-
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
-            ]
-        )
+    query = f"""
+        SELECT
+            c.case_id,
+            COALESCE(s.status, c.status) as status,
+            c.created_at,
+            COALESCE(s.status_updated_at, c.updated_at, c.created_at) as status_updated_at,
+            c.loan_type,
+            ARRAY_AGG(DISTINCT d.document_type IGNORE NULLS) as documents_received
+        FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.case_status_current` s
+            ON c.case_id = s.case_id
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.documents` d
+            ON c.case_id = d.case_id
+        WHERE c.case_id = @case_id
+        GROUP BY c.case_id, COALESCE(s.status, c.status), c.created_at,
+            COALESCE(s.status_updated_at, c.updated_at, c.created_at), c.loan_type
+    """
 
-        result = bq_client.query(query, job_config=job_config).result()
+    from google.cloud import bigquery
 
-        if result.total_rows == 0:
-            return None
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("case_id", "STRING", case_id)
+        ]
+    )
 
-        row = list(result)[0]
+    result = bq_client.query(query, job_config=job_config).result(timeout=CASE_QUERY_TIMEOUT_SECONDS)
 
-        # Determine required documents
-        required_docs = get_required_documents(row.loan_type)
-        documents_received = row.documents_received or []
-        missing_docs = [doc for doc in required_docs if doc not in documents_received]
+    if result.total_rows == 0:
+        return None
 
-        return {
-            "case_id": case_id,
-            "status": row.status,
-            "created_at": row.created_at.isoformat() + "Z" if row.created_at else None,
-            "loan_type": row.loan_type,
-            "documents_received": documents_received,
-            "missing_documents": missing_docs
-        }
+    row = list(result)[0]
+
+    # Determine required documents
+    required_docs = case_projection.get_required_documents(row.loan_type)
+    documents_received = row.documents_received or []
+    missing_docs = [doc for doc in required_docs if doc not in documents_received]
+
+    return {
+        "case_id": case_id,
+        "status": row.status,
+        "created_at": row.created_at.isoformat() + "Z" if row.created_at else None,
+        "status_updated_at": row.status_updated_at.isoformat() + "Z" if row.status_updated_at else None,
+        "loan_type": row.loan_type,
+        "documents_received": documents_received,
+        "missing_documents": missing_docs
+    }
+
+
+def verified_caller_id(req_data):
+    """
+    The caller's number as reported by the telephony gateway, or None on other channels
+
+    Session parameters hold whatever the caller said or typed, so they never
+    identify the member; only the gateway's caller ID does.
+    """
+    return req_data.get('payload', {}).get('telephony', {}).get('caller_id') or None
+
+
+def query_member_cases(member_id=None, phone=None):
+    """
+    A member's open cases (newest first) through the projection's member index
+
+    `cases` is clustered on status and loan_type, so there is no BigQuery fallback:
+    a member or phone lookup there scans the table. Raises if the projection is
+    unavailable.
+    """
+    if not projection:
+        raise RuntimeError("Case status projection is not available")
+    records = projection.member_cases(member_id=member_id, phone=phone)
+    if not records and MOCK_MODE:
+        return [query_case_status("CU-2024-00123")]
+    return [case_status_from_record(record) for record in records]
+
+
+# Repeat turns in a conversation are answered from memory
+case_status_cache = CaseStatusCache(query_case_status)
 
+
+# Queue statistics for get_timeline, held in memory and refreshed in the background
+timeline = timeline_stats.TimelineStats(
+    (lambda: timeline_stats.MOCK_ROWS) if MOCK_MODE else (lambda: timeline_stats.query_stats(bq_client))
+).start()
+
+
+def get_case_status(case_id, deadline):
+    """
+    Case status and documents within the request's time budget
+
+    Returns (case_data, outcome): "served" (case_data is None if the case does not
+    exist), "degraded" (last known status while the query is slow or failing),
+    "timeout" (nothing known yet) or "error".
+    """
+    try:
+        return case_status_cache.get(case_id, timeout=max(0.0, deadline - time.monotonic())), "served"
+    except futures.TimeoutError:
+        logger.warning("Case status query did not finish within the webhook budget", case_id=case_id)
+        outcome = "timeout"
     except Exception as e:
         logger.error(f"Error querying case status: {e}", exc_info=True)
-        return None
+        outcome = "error"
 
+    last_known = case_status_cache.peek(case_id)
+    if last_known is not None:
+        return last_known, "degraded"
+    return None, outcome
 
-def get_required_documents(loan_type):
-    """Return list of required documents based on loan type"""
-    base_docs = ["drivers_license"]
 
-    if loan_type == "auto":
-        return base_docs + ["paystub_recent_2", "bank_statement_30days"]
-    elif loan_type == "personal":
-        return base_docs + ["paystub_recent_2", "bank_statement_60days"]
-    elif loan_type == "mortgage":
-        return base_docs + ["paystub_recent_2", "w2_2years", "bank_statement_60days", "tax_returns_2years"]
-    else:
-        return base_docs + ["paystub_recent_2", "bank_statement_30days"]
+def format_member_cases_message(cases):
+    """One status message per open case"""
+    if not cases:
+        return (
+            "I couldn't find any open applications for you. If you have an application number, "
+            "I can look it up directly. It should look like CU-2024-00123."
+        )
+    if len(cases) == 1:
+        return format_status_message(cases[0])
+    return f"You have {len(cases)} open applications.\n\n" + "\n\n".join(
+        format_status_message(case_data) for case_data in cases
+    )
+
+
+def format_duration(seconds):
+    """Round a duration to hours or days for conversation"""
+    hours = round(seconds / 3600)
+    if hours <= 1:
+        return "an hour"
+    if hours < 36:
+        return f"{hours} hours"
+    return f"{round(hours / 24)} days"
+
+
+def format_timeline_message(case_data, estimate):
+    """Format a timeline estimate into conversational response"""
+    if case_data and case_data['status'] in timeline_stats.CLOSED_STATUSES:
+        return (
+            f"A decision has already been made on your application {case_data['case_id']}. "
+            "You'll receive an email with the details."
+        )
+
+    if estimate is None:
+        return (
+            "We usually complete initial review within one business day. "
+            "You'll receive an email when there's an update."
+        )
+
+    subject = f"your application {case_data['case_id']}" if case_data else "a new application"
+    milestone = "to complete initial review" if estimate.milestone == "review" else "to receive a decision"
+    message = (
+        f"Based on current volume, we expect {subject} {milestone} in about {format_duration(estimate.low_seconds)}"
+    )
+    if format_duration(estimate.high_seconds) != format_duration(estimate.low_seconds):
+        message += f", and within {format_duration(estimate.high_seconds)} for most applications"
+    message += "."
+
+    if case_data and case_data['status'] == "AWAITING_DOCUMENTS":
+        message += " Sending your remaining documents soon will speed this up."
+    message += " You'll receive an email when there's an update."
+    return message
 
 
 def format_status_message(case_data):
@@ -120,6 +265,7 @@ def format_status_message(case_data):
     # Map internal status to user-friendly message
     status_messages = {
         "SUBMITTED": "received and is being processed",
+        "AWAITING_DOCUMENTS": "received, and we're waiting on a few documents",
         "EXTRACTING": "under review",
         "NEEDS_REVIEW": "under review",
         "READY_FOR_DECISION": "being reviewed by our team",
@@ -145,7 +291,7 @@ def format_status_message(case_data):
             message += f"⏳ {doc_name}\n"
 
     # Timeline estimate
-    if status in ["SUBMITTED", "EXTRACTING", "NEEDS_REVIEW"]:
+    if status in ["SUBMITTED", "AWAITING_DOCUMENTS", "EXTRACTING", "NEEDS_REVIEW"]:
         message += "\nWe'll contact you within 24 hours if we need anything else."
     elif status == "READY_FOR_DECISION":
         message += "\nYou should hear back within 24 hours."
@@ -177,6 +323,18 @@ def health_check():
     }), 200
 
 
+@app.route('/warmup', methods=['GET'])
+def warmup_check():
+    """Startup probe: ready once the clients are built and connected (or have failed trying)"""
+    if not warm_up.wait():
+        return jsonify({"status": "warming"}), 503
+    return jsonify({
+        "status": "ready",
+        "seconds": round(warm_up.seconds, 3),
+        "clients": warm_up.results
+    }), 200
+
+
 @app.route('/dialogflow-webhook', methods=['POST'])
 def dialogflow_webhook():
     """
@@ -198,26 +356,46 @@ def dialogflow_webhook():
       }
     }
     """
+    deadline = time.monotonic() + WEBHOOK_TIMEOUT_SECONDS - WEBHOOK_RESPONSE_MARGIN_SECONDS
     try:
         req_data = request.get_json()
-        logger.info(f"Dialogflow webhook request: {json.dumps(req_data)}")
 
         # Extract parameters
         session_info = req_data.get('sessionInfo', {})
         parameters = session_info.get('parameters', {})
         fulfillment_info = req_data.get('fulfillmentInfo', {})
         tag = fulfillment_info.get('tag', '')
+        g.webhook_tag = tag if tag in WEBHOOK_TAGS else "other"
+        logger.info(
+            "Dialogflow webhook request", sample="webhook.request",
+            tag=tag, session=session_info.get('session'), parameters=parameters
+        )
 
         # Handle different webhook tags
         if tag == 'get_case_status':
             case_id = parameters.get('case_id')
+            case_data = None
 
             if not case_id:
                 response_text = "I need your application number to look up your status. It should look like CU-2024-00123."
             else:
-                # Query case status
-                case_data = get_case_status(case_id)
-                response_text = format_status_message(case_data)
+                # Query case status (cached), answering with what is known when the budget runs out
+                case_data, outcome = get_case_status(case_id, deadline)
+                metrics.responses.labels(tag, outcome).inc()
+                if outcome == "served":
+                    response_text = format_status_message(case_data)
+                elif outcome == "degraded":
+                    response_text = (
+                        format_status_message(case_data) +
+                        "\n\nThe latest details are still loading, so this may be a few minutes behind."
+                    )
+                elif outcome == "timeout":
+                    response_text = (
+                        f"I'm still pulling up application {case_id}. "
+                        "Please ask me again in a moment."
+                    )
+                else:
+                    response_text = "I'm having trouble connecting to our system. Please try again in a moment."
 
             # Build Dialogflow response
             response = {
@@ -240,17 +418,84 @@ def dialogflow_webhook():
 
             return jsonify(response), 200
 
-        elif tag == 'escalate_to_human':
-            case_id = parameters.get('case_id')
-            phone = parameters.get('phone', 'the number on file')
+        elif tag == 'get_member_cases':
+            # Only the verified caller ID identifies the member (never a spoken number or member ID)
+            phone = verified_caller_id(req_data)
+            cases = []
 
-            response_text = (
-                f"I'm creating a callback request for your application {case_id}. "
-                f"A loan officer will call you at {phone} within 2 hours during business hours. "
-                f"Is there anything else I can help with?"
-            )
+            if not phone:
+                response_text = (
+                    "I can only look up your applications when you call from the phone number on your application. "
+                    "If you have your application number, I can check that application for you."
+                )
+            else:
+                try:
+                    cases = query_member_cases(phone=phone)
+                    outcome = "served"
+                    response_text = format_member_cases_message(cases)
+                except Exception as e:
+                    logger.error(f"Error looking up member cases: {e}", exc_info=True)
+                    outcome = "error"
+                    response_text = "I'm having trouble connecting to our system. Please try again in a moment."
+                metrics.responses.labels(tag, outcome).inc()
 
-            # TODO: Create ticket in CRM system
+            response = {
+                "fulfillmentResponse": {
+                    "messages": [
+                        {
+                            "text": {
+                                "text": [response_text]
+                            }
+                        }
+                    ]
+                },
+                "sessionInfo": {
+                    "parameters": {
+                        "open_case_ids": [case_data['case_id'] for case_data in cases],
+                        # A single open case becomes the case follow-up turns ask about
+                        "case_id": cases[0]['case_id'] if len(cases) == 1 else parameters.get('case_id')
+                    }
+                }
+            }
+
+            return jsonify(response), 200
+
+        elif tag == 'escalate_to_human':
+            case_id = parameters.get('case_id')
+            # The callback goes to the verified caller ID, or to the number on file
+            phone = verified_caller_id(req_data)
+            application = f" for your application {case_id}" if case_id else ""
+            escalation = None
+
+            # Only recorded here; the CRM ticket is created by the outbox dispatcher
+            try:
+                escalation, duplicate = outbox.enqueue(
+                    case_id, phone, session_info.get('session'),
+                    reason=req_data.get('intentInfo', {}).get('displayName')
+                )
+                outcome = "served"
+            except Exception as e:
+                logger.error(f"Error recording escalation: {e}", exc_info=True)
+                outcome = "error"
+            metrics.responses.labels(tag, outcome).inc()
+
+            if escalation is None:
+                response_text = (
+                    "I'm having trouble creating your callback request right now. "
+                    "Please try again in a moment."
+                )
+            elif duplicate:
+                response_text = (
+                    f"You already have a callback request{application}. "
+                    f"A loan officer will call you at {phone or 'the number on file'} within 2 hours during business hours. "
+                    f"Is there anything else I can help with?"
+                )
+            else:
+                response_text = (
+                    f"I'm creating a callback request{application}. "
+                    f"A loan officer will call you at {phone or 'the number on file'} within 2 hours during business hours. "
+                    f"Is there anything else I can help with?"
+                )
 
             response = {
                 "fulfillmentResponse": {
@@ -261,6 +506,11 @@ def dialogflow_webhook():
                             }
                         }
                     ]
+                },
+                "sessionInfo": {
+                    "parameters": {
+                        "escalation_id": escalation['escalation_id'] if escalation else None
+                    }
                 }
             }
 
@@ -268,12 +518,27 @@ def dialogflow_webhook():
 
         elif tag == 'get_timeline':
             case_id = parameters.get('case_id')
-
-            # Simple timeline logic (could be more sophisticated)
-            response_text = (
-                "Based on current volume, we expect to complete initial review by "
-                "tomorrow at 3 PM. You'll receive an email when there's an update."
-            )
+            case_data, outcome = None, "served"
+
+            if case_id:
+                case_data, outcome = get_case_status(case_id, deadline)
+            metrics.responses.labels(tag, outcome).inc()
+
+            # Estimated from the in-memory queue statistics; no query per request
+            if case_data:
+                status_updated_at = case_data.get('status_updated_at')
+                in_status_seconds = (
+                    (datetime.now(timezone.utc) - case_projection.parse_timestamp(status_updated_at)).total_seconds()
+                    if status_updated_at else 0.0
+                )
+                estimate = timeline.estimate(case_data['loan_type'], case_data['status'], in_status_seconds)
+                response_text = format_timeline_message(case_data, estimate)
+            elif case_id and outcome == "served":
+                response_text = format_status_message(None)
+            else:
+                # No case, or it could not be looked up in time: estimate for a new application
+                loan_type = parameters.get('loan_type', timeline_stats.ALL_LOAN_TYPES)
+                response_text = format_timeline_message(None, timeline.estimate(loan_type, "SUBMITTED"))
 
             response = {
                 "fulfillmentResponse": {
@@ -306,6 +571,7 @@ def dialogflow_webhook():
 
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
+        metrics.responses.labels(g.get('webhook_tag', 'other'), "error").inc()
 
         # Return error response to Dialogflow
         error_response = {
@@ -323,5 +589,6 @@ def dialogflow_webhook():
 
 
 if __name__ == '__main__':
+    metrics.start_server()
     port = int(os.getenv('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,90 @@
+"""
+Tytan LendingOps & MemberAssist - Prometheus metrics for the Dialogflow webhook
+Request latency per route and fulfillment tag, the case status cache hit rate,
+the freshness of the timeline statistics and the escalation outbox backlog,
+served on :METRICS_PORT/metrics.
+
+METRICS_PORT is not the request port: the webhook is public (Dialogflow calls it
+unauthenticated), and Cloud Run only routes traffic to the container port, so the
+metrics can be scraped from inside the instance (the Prometheus sidecar) but not
+from the internet.
+
+The webhook runs as a single gunicorn process (threads only) so the case cache
+and these metrics are shared by every request on the instance.
+"""
+
+import os
+import time
+
+from flask import g, request
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# Dialogflow CX gives a webhook 5 seconds by default
+REQUEST_BUCKETS_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 4, 5, 10)
+
+request_duration = Histogram(
+    "webhook_request_duration_seconds",
+    "Webhook latency per route and fulfillment tag",
+    ["route", "tag"],
+    buckets=REQUEST_BUCKETS_SECONDS
+)
+case_cache_lookups = Counter(
+    "webhook_case_cache_lookups_total",
+    "Case status lookups by result: hit, stale (served while refreshing), miss, coalesced (joined a miss)",
+    ["result"]
+)
+case_cache_load_duration = Histogram(
+    "webhook_case_cache_load_duration_seconds", "BigQuery case status queries", buckets=REQUEST_BUCKETS_SECONDS
+)
+case_cache_load_errors = Counter("webhook_case_cache_load_errors_total", "Failed case status queries")
+case_cache_entries = Gauge("webhook_case_cache_entries", "Cases held in the status cache")
+case_cache_hedges = Counter(
+    "webhook_case_cache_hedges_total", "Hedged duplicate queries sent, and how many finished first", ["result"]
+)
+timeline_stats_age = Gauge(
+    "webhook_timeline_stats_age_seconds", "Age of the timeline statistics snapshot (-1 before the first refresh)"
+)
+timeline_refresh_errors = Counter("webhook_timeline_refresh_errors_total", "Failed timeline statistics refreshes")
+escalations_enqueued = Counter(
+    "webhook_escalations_enqueued_total",
+    "Callback requests recorded in the outbox: queued, or duplicate (joined a recent one for the same case)",
+    ["result"]
+)
+escalation_deliveries = Counter(
+    "webhook_escalation_deliveries_total", "Outbox delivery attempts by result: delivered, retried, failed", ["result"]
+)
+escalation_backlog = Gauge("webhook_escalation_backlog", "Escalations waiting for delivery")
+escalation_oldest_age = Gauge(
+    "webhook_escalation_oldest_age_seconds", "Age of the oldest escalation waiting for delivery"
+)
+escalation_batch_duration = Histogram(
+    "webhook_escalation_batch_duration_seconds", "Ticketing endpoint calls, one per batch",
+    buckets=REQUEST_BUCKETS_SECONDS
+)
+responses = Counter(
+    "webhook_responses_total",
+    "Webhook answers by outcome: served, degraded (last known status), timeout (nothing known in time), error",
+    ["tag", "outcome"]
+)
+
+
+def init_app(app):
+    """Time every request"""
+
+    @app.before_request
+    def start_request():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        # Views set g.webhook_tag once they have parsed the Dialogflow request
+        request_duration.labels(route, g.get('webhook_tag', '')).observe(time.perf_counter() - g.metrics_started)
+        return response
+
+
+def start_server(port=METRICS_PORT):
+    """Serve /metrics on port from a daemon thread (the gunicorn worker, or python main.py)"""
+    start_http_server(port)
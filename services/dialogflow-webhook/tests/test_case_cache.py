@@ -0,0 +1,192 @@
+"""
+Case status cache: fresh hits, stale-while-revalidate, expiry, coalescing of
+concurrent misses, and hedged queries.
+"""
+
+import time
+import threading
+from concurrent import futures
+
+import pytest
+
+import case_cache
+from case_cache import CaseStatusCache
+
+
+class Clock:
+    """Stands in for the time module: monotonic() is set by the test, perf_counter() is real"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+class Loader:
+    """Returns status-<n> for the n-th query; a query can be held until release()"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.gate = None
+        self.started = threading.Semaphore(0)
+
+    def hold(self):
+        self.gate = threading.Event()
+
+    def release(self):
+        self.gate.set()
+
+    def __call__(self, case_id):
+        with self.lock:
+            self.calls.append((case_id, time.perf_counter()))
+            value = {"case_id": case_id, "status": f"status-{len(self.calls)}"}
+            gate = self.gate
+        self.started.release()
+        if gate is not None:
+            gate.wait(5)
+        return value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(case_cache, "time", clock)
+    return clock
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_fresh_entry_is_served_without_a_query(clock):
+    loader = Loader()
+    cache = CaseStatusCache(loader, ttl_seconds=30, stale_seconds=300)
+
+    first = cache.get("CU-1")
+    clock.now += 29
+    second = cache.get("CU-1")
+
+    assert first == second == {"case_id": "CU-1", "status": "status-1"}
+    assert len(loader.calls) == 1
+
+
+def test_stale_entry_is_served_while_refreshing_in_background(clock):
+    loader = Loader()
+    cache = CaseStatusCache(loader, ttl_seconds=30, stale_seconds=300)
+    cache.get("CU-1")
+    loader.started.acquire()
+
+    clock.now += 31
+    loader.hold()
+    # Served at once from the stale entry; one refresh runs however often it is asked for
+    assert cache.get("CU-1", timeout=0.5)["status"] == "status-1"
+    assert cache.get("CU-1", timeout=0.5)["status"] == "status-1"
+    assert loader.started.acquire(timeout=5)
+    assert len(loader.calls) == 2
+
+    loader.release()
+    wait_until(lambda: cache.peek("CU-1")["status"] == "status-2")
+    assert cache.get("CU-1")["status"] == "status-2"
+    assert len(loader.calls) == 2
+
+
+def test_expired_entry_is_queried_again(clock):
+    loader = Loader()
+    cache = CaseStatusCache(loader, ttl_seconds=30, stale_seconds=300)
+    cache.get("CU-1")
+
+    clock.now += 331
+
+    assert cache.get("CU-1")["status"] == "status-2"
+    assert len(loader.calls) == 2
+
+
+def test_missing_case_is_cached_for_the_negative_ttl(clock):
+    calls = []
+
+    def loader(case_id):
+        calls.append(case_id)
+
+    cache = CaseStatusCache(loader, ttl_seconds=30, stale_seconds=0, negative_ttl_seconds=10)
+
+    assert cache.get("CU-404") is None
+    clock.now += 9
+    assert cache.get("CU-404") is None
+    assert len(calls) == 1
+
+    clock.now += 2
+    assert cache.get("CU-404") is None
+    assert len(calls) == 2
+
+
+def test_concurrent_misses_share_one_query(clock):
+    loader = Loader()
+    loader.hold()
+    cache = CaseStatusCache(loader)
+
+    with futures.ThreadPoolExecutor(max_workers=4) as pool:
+        results = [pool.submit(cache.get, "CU-1") for _ in range(4)]
+        assert loader.started.acquire(timeout=5)
+        loader.release()
+        values = [result.result(timeout=5) for result in results]
+
+    assert all(value["status"] == "status-1" for value in values)
+    assert len(loader.calls) == 1
+
+
+def test_hedge_is_sent_only_after_the_hedge_delay(clock, monkeypatch):
+    monkeypatch.setattr(case_cache, "CASE_CACHE_HEDGE_DEFAULT_SECONDS", 0.3)
+    first_attempt = threading.Event()
+    calls = []
+
+    def loader(case_id):
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            # The original query hangs; the hedge answers at once
+            first_attempt.wait(5)
+            return {"case_id": case_id, "status": "original"}
+        return {"case_id": case_id, "status": "hedged"}
+
+    cache = CaseStatusCache(loader)
+    started = time.perf_counter()
+    value = cache.get("CU-1", timeout=2)
+    first_attempt.set()
+
+    assert value["status"] == "hedged"
+    assert len(calls) == 2
+    assert calls[1] - started >= 0.3
+
+
+def test_fast_query_is_not_hedged(clock, monkeypatch):
+    monkeypatch.setattr(case_cache, "CASE_CACHE_HEDGE_DEFAULT_SECONDS", 0.3)
+    loader = Loader()
+    cache = CaseStatusCache(loader)
+
+    assert cache.get("CU-1", timeout=2)["status"] == "status-1"
+    time.sleep(0.4)
+    assert len(loader.calls) == 1
+
+
+def test_timeout_shorter_than_hedge_delay_gives_up_without_hedging(clock, monkeypatch):
+    monkeypatch.setattr(case_cache, "CASE_CACHE_HEDGE_DEFAULT_SECONDS", 1.0)
+    loader = Loader()
+    loader.hold()
+    cache = CaseStatusCache(loader)
+
+    with pytest.raises(futures.TimeoutError):
+        cache.get("CU-1", timeout=0.2)
+    assert len(loader.calls) == 1
+
+    # The query keeps running and fills the cache for the next turn
+    loader.release()
+    wait_until(lambda: cache.peek("CU-1") is not None)
+    assert cache.get("CU-1")["status"] == "status-1"
+    assert len(loader.calls) == 1
@@ -0,0 +1,201 @@
+"""
+Escalation outbox on the SQLite backend: deduplication of repeat requests,
+claiming with leases, and the dispatcher's handling of delivered, failed and
+missing ticket results.
+"""
+
+import time
+
+import pytest
+
+import escalation_outbox
+from escalation_outbox import (
+    DELIVERED, FAILED, PENDING, EscalationDispatcher, EscalationOutbox, SqliteBackend
+)
+
+
+class StubTickets:
+    """create_tickets stand-in: records each batch and answers from a per-call script"""
+
+    def __init__(self, respond=None):
+        self.batches = []
+        self.respond = respond or (lambda entries: {
+            entry["escalation_id"]: {"ticket_id": f"T-{entry['case_id']}"} for entry in entries
+        })
+
+    def __call__(self, entries):
+        self.batches.append([entry["case_id"] for entry in entries])
+        return self.respond(entries)
+
+
+@pytest.fixture
+def backend():
+    return SqliteBackend(":memory:")
+
+
+@pytest.fixture
+def outbox(backend):
+    return EscalationOutbox(backend, dedupe_window_seconds=1800)
+
+
+def load(backend, escalation_id):
+    row = backend.connection.execute(
+        "SELECT * FROM escalation_outbox WHERE escalation_id = ?", (escalation_id,)
+    ).fetchone()
+    return dict(row)
+
+
+def test_repeat_request_joins_pending_entry(backend, outbox):
+    first, duplicate = outbox.enqueue(case_id="CASE-1", phone="+15551230001", reason="wants a call")
+    assert not duplicate
+
+    again, duplicate = outbox.enqueue(case_id="CASE-1", phone="+15551230001", reason="asked again")
+    assert duplicate
+    assert again["escalation_id"] == first["escalation_id"]
+    assert load(backend, first["escalation_id"])["requests"] == 2
+
+
+def test_repeat_request_after_delivery_creates_new_entry(backend, outbox):
+    first, _ = outbox.enqueue(case_id="CASE-1")
+    EscalationDispatcher(backend, StubTickets()).dispatch_once()
+    assert load(backend, first["escalation_id"])["status"] == DELIVERED
+
+    second, duplicate = outbox.enqueue(case_id="CASE-1")
+    assert not duplicate
+    assert second["escalation_id"] != first["escalation_id"]
+    assert load(backend, second["escalation_id"])["status"] == PENDING
+
+
+def test_repeat_request_after_failure_creates_new_entry(backend, outbox):
+    first, _ = outbox.enqueue(case_id="CASE-1")
+    failing = StubTickets(lambda entries: {entry["escalation_id"]: {"error": "rejected"} for entry in entries})
+    EscalationDispatcher(backend, failing, max_attempts=1).dispatch_once()
+    assert load(backend, first["escalation_id"])["status"] == FAILED
+
+    second, duplicate = outbox.enqueue(case_id="CASE-1")
+    assert not duplicate
+    assert second["escalation_id"] != first["escalation_id"]
+
+
+def test_repeat_request_outside_window_creates_new_entry(backend):
+    first, _ = EscalationOutbox(backend, dedupe_window_seconds=1800).enqueue(case_id="CASE-1")
+    backend.connection.execute(
+        "UPDATE escalation_outbox SET created_at = ? WHERE escalation_id = ?",
+        (time.time() - 3600, first["escalation_id"])
+    )
+
+    second, duplicate = EscalationOutbox(backend, dedupe_window_seconds=1800).enqueue(case_id="CASE-1")
+    assert not duplicate
+    assert second["escalation_id"] != first["escalation_id"]
+
+
+def test_claim_takes_due_entries_oldest_first_up_to_limit(backend, outbox):
+    ids = [outbox.enqueue(case_id=f"CASE-{n}")[0]["escalation_id"] for n in range(3)]
+    now = time.time()
+
+    claimed = backend.claim(now, limit=2, lease_seconds=60)
+    assert [entry["escalation_id"] for entry in claimed] == ids[:2]
+    assert load(backend, ids[0])["next_attempt_at"] == pytest.approx(now + 60)
+
+    # Held entries are not handed out again; the third still is
+    assert [entry["escalation_id"] for entry in backend.claim(now, limit=10, lease_seconds=60)] == ids[2:]
+    assert backend.claim(now, limit=10, lease_seconds=60) == []
+
+
+def test_claimed_entry_is_due_again_when_lease_lapses(backend, outbox):
+    entry, _ = outbox.enqueue(case_id="CASE-1")
+    now = time.time()
+    assert len(backend.claim(now, limit=10, lease_seconds=60)) == 1
+
+    # The instance holding it died without updating the entry
+    assert backend.claim(now + 59, limit=10, lease_seconds=60) == []
+    reclaimed = backend.claim(now + 61, limit=10, lease_seconds=60)
+    assert [claimed["escalation_id"] for claimed in reclaimed] == [entry["escalation_id"]]
+
+
+def test_failed_attempt_backs_off_exponentially(backend, outbox, monkeypatch):
+    monkeypatch.setattr(escalation_outbox, "ESCALATION_BACKOFF_BASE_SECONDS", 5)
+    monkeypatch.setattr(escalation_outbox, "ESCALATION_BACKOFF_MAX_SECONDS", 600)
+    monkeypatch.setattr(escalation_outbox.random, "uniform", lambda low, high: high)
+    entry, _ = outbox.enqueue(case_id="CASE-1")
+    failing = StubTickets(lambda entries: {e["escalation_id"]: {"error": "CRM unavailable"} for e in entries})
+    dispatcher = EscalationDispatcher(backend, failing, max_attempts=10)
+
+    for attempts, delay in [(1, 5), (2, 10), (3, 20)]:
+        before = time.time()
+        # Let the entry come due again without waiting out the backoff
+        backend.update(entry["escalation_id"], {"next_attempt_at": before})
+        assert dispatcher.dispatch_once() == 1
+        stored = load(backend, entry["escalation_id"])
+        assert stored["status"] == PENDING
+        assert stored["attempts"] == attempts
+        assert stored["last_error"] == "CRM unavailable"
+        assert before + delay <= stored["next_attempt_at"] <= time.time() + delay
+
+    assert escalation_outbox.backoff_seconds(20) == 600
+
+
+def test_entry_fails_after_max_attempts(backend, outbox):
+    entry, _ = outbox.enqueue(case_id="CASE-1")
+    failing = StubTickets(lambda entries: {e["escalation_id"]: {"error": "rejected"} for e in entries})
+    dispatcher = EscalationDispatcher(backend, failing, max_attempts=3)
+
+    for _ in range(3):
+        backend.update(entry["escalation_id"], {"next_attempt_at": time.time()})
+        dispatcher.dispatch_once()
+
+    stored = load(backend, entry["escalation_id"])
+    assert stored["status"] == FAILED
+    assert stored["attempts"] == 3
+    assert backend.claim(time.time() + 3600, limit=10, lease_seconds=60) == []
+
+    assert backend.requeue_failed(time.time()) == 1
+    assert load(backend, entry["escalation_id"])["status"] == PENDING
+
+
+def test_partial_batch_failure_retries_only_failed_entries(backend, outbox):
+    delivered, rejected, missing = (outbox.enqueue(case_id=f"CASE-{n}")[0]["escalation_id"] for n in range(3))
+
+    def respond(entries):
+        return {
+            delivered: {"escalation_id": delivered, "ticket_id": "T-1"},
+            rejected: {"escalation_id": rejected, "error": "invalid phone"}
+            # No result at all for the third entry
+        }
+
+    tickets = StubTickets(respond)
+    assert EscalationDispatcher(backend, tickets, batch_size=10).dispatch_once() == 3
+    assert tickets.batches == [["CASE-0", "CASE-1", "CASE-2"]]
+
+    stored = load(backend, delivered)
+    assert (stored["status"], stored["ticket_id"], stored["attempts"]) == (DELIVERED, "T-1", 1)
+    assert stored["delivered_at"] is not None
+
+    for escalation_id, error in [(rejected, "invalid phone"), (missing, "No result returned for escalation")]:
+        stored = load(backend, escalation_id)
+        assert (stored["status"], stored["attempts"], stored["last_error"]) == (PENDING, 1, error)
+        assert stored["next_attempt_at"] > time.time()
+
+
+def test_whole_batch_failure_retries_every_entry(backend, outbox):
+    ids = [outbox.enqueue(case_id=f"CASE-{n}")[0]["escalation_id"] for n in range(2)]
+
+    def respond(entries):
+        raise ConnectionError("ticketing endpoint down")
+
+    assert EscalationDispatcher(backend, StubTickets(respond)).dispatch_once() == 2
+    for escalation_id in ids:
+        stored = load(backend, escalation_id)
+        assert (stored["status"], stored["attempts"]) == (PENDING, 1)
+        assert stored["last_error"] == "ticketing endpoint down"
+
+
+def test_dispatch_once_delivers_in_batches(backend, outbox):
+    for n in range(5):
+        outbox.enqueue(case_id=f"CASE-{n}")
+    tickets = StubTickets()
+    dispatcher = EscalationDispatcher(backend, tickets, batch_size=2)
+
+    assert [dispatcher.dispatch_once() for _ in range(4)] == [2, 2, 1, 0]
+    assert tickets.batches == [["CASE-0", "CASE-1"], ["CASE-2", "CASE-3"], ["CASE-4"]]
+    assert backend.backlog() == (0, None)
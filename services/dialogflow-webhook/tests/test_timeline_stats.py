@@ -0,0 +1,146 @@
+"""
+Timeline statistics: estimates from a snapshot of per-status rows, the fallback
+to all loan types, queue backlog, and the background refresh (a failed refresh
+keeps the previous snapshot serving).
+"""
+
+import time
+import threading
+
+import metrics
+import timeline_stats
+from timeline_stats import ALL_LOAN_TYPES, REVIEW_STATUS, TimelineStats
+
+HOUR = 3600
+
+
+def row(status, loan_type=ALL_LOAN_TYPES, samples=100, next_p50=HOUR, next_p90=4 * HOUR, review_samples=100,
+        review_p50=10 * HOUR, review_p90=30 * HOUR, recent_exits=0, queue_depth=0):
+    return {
+        "loan_type": loan_type, "status": status, "samples": samples, "next_p50": next_p50, "next_p90": next_p90,
+        "review_samples": review_samples, "review_p50": review_p50, "review_p90": review_p90,
+        "recent_exits": recent_exits, "queue_depth": queue_depth
+    }
+
+
+def stats_from(rows):
+    stats = TimelineStats(lambda: rows)
+    stats.refresh()
+    return stats
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def gauge_value(gauge):
+    return gauge.collect()[0].samples[0].value
+
+
+def counter_value(counter):
+    return next(sample.value for sample in counter.collect()[0].samples if sample.name.endswith("_total"))
+
+
+def test_case_before_review_is_estimated_to_reach_review():
+    stats = stats_from([row("NEEDS_REVIEW", review_p50=6 * HOUR, review_p90=20 * HOUR)])
+
+    estimate = stats.estimate("auto", "NEEDS_REVIEW", in_status_seconds=2 * HOUR)
+
+    assert estimate.milestone == "review"
+    assert (estimate.low_seconds, estimate.high_seconds) == (4 * HOUR, 18 * HOUR)
+
+
+def test_case_in_review_is_estimated_to_reach_a_decision():
+    stats = stats_from([row(REVIEW_STATUS, next_p50=8 * HOUR, next_p90=24 * HOUR, review_samples=0,
+                            review_p50=None, review_p90=None)])
+
+    estimate = stats.estimate("auto", REVIEW_STATUS)
+
+    assert estimate.milestone == "decision"
+    assert (estimate.low_seconds, estimate.high_seconds) == (8 * HOUR, 24 * HOUR)
+
+
+def test_loan_type_with_too_few_samples_falls_back_to_all_loan_types():
+    stats = stats_from([
+        row("SUBMITTED", loan_type="mortgage", review_samples=5, review_p50=100 * HOUR, review_p90=200 * HOUR),
+        row("SUBMITTED", loan_type="auto", review_p50=2 * HOUR, review_p90=5 * HOUR),
+        row("SUBMITTED", review_p50=10 * HOUR, review_p90=30 * HOUR),
+    ])
+
+    assert stats.estimate("auto", "SUBMITTED").low_seconds == 2 * HOUR
+    assert stats.estimate("mortgage", "SUBMITTED").low_seconds == 10 * HOUR
+    assert stats.estimate("personal", "SUBMITTED").low_seconds == 10 * HOUR
+
+
+def test_too_little_data_or_a_decided_case_has_no_estimate():
+    stats = stats_from([row("SUBMITTED", review_samples=timeline_stats.TIMELINE_MIN_SAMPLES - 1)])
+
+    assert stats.estimate("auto", "SUBMITTED") is None
+    assert stats.estimate("auto", "EXTRACTING") is None
+    assert stats.estimate("auto", "APPROVED") is None
+
+
+def test_queue_draining_slower_than_usual_adds_its_backlog():
+    # 7 exits in the 7-day window is one a day, so 2 queued cases take 2 days to drain: 1 day over the usual stay
+    stats = stats_from([row("AWAITING_DOCUMENTS", next_p50=24 * HOUR, review_p50=30 * HOUR, review_p90=50 * HOUR,
+                            recent_exits=7, queue_depth=2)])
+
+    estimate = stats.estimate("auto", "AWAITING_DOCUMENTS")
+
+    assert (estimate.low_seconds, estimate.high_seconds) == (54 * HOUR, 74 * HOUR)
+
+
+def test_overdue_case_gets_the_minimum_estimate():
+    stats = stats_from([row("NEEDS_REVIEW", review_p50=2 * HOUR, review_p90=3 * HOUR)])
+
+    estimate = stats.estimate("auto", "NEEDS_REVIEW", in_status_seconds=10 * HOUR)
+
+    assert estimate.low_seconds == estimate.high_seconds == timeline_stats.TIMELINE_MIN_ESTIMATE_SECONDS
+
+
+def test_background_refresh_replaces_the_snapshot_and_keeps_it_on_failure(monkeypatch):
+    monkeypatch.setattr(timeline_stats, "TIMELINE_RETRY_SECONDS", 0.05)
+    snapshots = [
+        [row("SUBMITTED", review_p50=10 * HOUR)],
+        RuntimeError("BigQuery unavailable"),
+        [row("SUBMITTED", review_p50=12 * HOUR)],
+    ]
+    started = threading.Semaphore(0)
+    resume = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(None)
+        started.release()
+        snapshot = snapshots[min(len(calls), len(snapshots)) - 1]
+        if len(calls) == len(snapshots):
+            # Hold the retry until the test has looked at the snapshot the failure left behind
+            resume.wait(5)
+        if isinstance(snapshot, Exception):
+            raise snapshot
+        return snapshot
+
+    stats = TimelineStats(loader, refresh_seconds=0.05)
+    assert gauge_value(metrics.timeline_stats_age) == -1
+    errors_before = counter_value(metrics.timeline_refresh_errors)
+
+    stats.start()
+    try:
+        for _ in range(3):
+            assert started.acquire(timeout=5)
+        # The retry has started, so the failed refresh has been handled: counted, first snapshot still serving
+        assert stats.estimate("auto", "SUBMITTED").low_seconds == 10 * HOUR
+        assert counter_value(metrics.timeline_refresh_errors) == errors_before + 1
+        assert 0 <= gauge_value(metrics.timeline_stats_age) < 5
+
+        # The retry replaces the snapshot
+        resume.set()
+        wait_until(lambda: stats.estimate("auto", "SUBMITTED").low_seconds == 12 * HOUR)
+    finally:
+        resume.set()
+        stats.stop()
+        stats.thread.join(5)
+    assert not stats.thread.is_alive()
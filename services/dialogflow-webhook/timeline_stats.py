@@ -0,0 +1,256 @@
+"""
+Tytan LendingOps & MemberAssist - Queue statistics for timeline estimates
+A background thread periodically computes, per loan type and case status, how
+long cases stay in that status before moving on (and before reaching review),
+how many cases are in it now, and how fast it is draining. get_timeline answers
+from the snapshot held in memory, so a chat turn never waits on BigQuery.
+
+Transitions come from status_events (entity_type = 'case'), with each case's
+SUBMITTED stay starting at cases.created_at. Stays still in progress are not in
+the percentiles; a status whose queue is draining slower than usual adds the
+extra wait implied by its current depth (Little's law: depth / exit rate).
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ID = os.getenv('PROJECT_ID', 'tytan-lending-dev')
+DATASET_ID = os.getenv('DATASET_ID', 'tytan_lending_ops')
+
+TIMELINE_REFRESH_SECONDS = float(os.getenv('TIMELINE_REFRESH_SECONDS', '900'))
+TIMELINE_RETRY_SECONDS = float(os.getenv('TIMELINE_RETRY_SECONDS', '60'))
+
+# History the percentiles are computed over, and the window exit rates are measured on
+TIMELINE_LOOKBACK_DAYS = int(os.getenv('TIMELINE_LOOKBACK_DAYS', '90'))
+TIMELINE_RATE_DAYS = int(os.getenv('TIMELINE_RATE_DAYS', '7'))
+
+# Below this many completed stays, a loan type falls back to the figures for all loan types
+TIMELINE_MIN_SAMPLES = int(os.getenv('TIMELINE_MIN_SAMPLES', '20'))
+
+# Estimates never go below this, however overdue a case already is
+TIMELINE_MIN_ESTIMATE_SECONDS = float(os.getenv('TIMELINE_MIN_ESTIMATE_SECONDS', '3600'))
+
+ALL_LOAN_TYPES = "all"
+REVIEW_STATUS = "READY_FOR_DECISION"
+CLOSED_STATUSES = ("APPROVED", "REJECTED")
+
+STATS_QUERY = f"""
+    WITH transitions AS (
+        SELECT case_id, 'SUBMITTED' AS status, created_at AS event_time
+        FROM `{PROJECT_ID}.{DATASET_ID}.cases`
+        WHERE created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @lookback_days DAY)
+        UNION ALL
+        SELECT entity_id, status, event_time
+        FROM `{PROJECT_ID}.{DATASET_ID}.status_events`
+        WHERE entity_type = 'case'
+            AND event_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @lookback_days DAY)
+    ),
+    changes AS (
+        -- A repeated event for the current status extends the stay instead of starting one
+        SELECT * FROM transitions
+        QUALIFY status != IFNULL(LAG(status) OVER (PARTITION BY case_id ORDER BY event_time), '')
+    ),
+    stays AS (
+        SELECT
+            c.loan_type,
+            t.status,
+            LEAD(t.event_time) OVER (PARTITION BY t.case_id ORDER BY t.event_time) AS left_at,
+            TIMESTAMP_DIFF(
+                LEAD(t.event_time) OVER (PARTITION BY t.case_id ORDER BY t.event_time), t.event_time, SECOND
+            ) AS next_seconds,
+            TIMESTAMP_DIFF(
+                MIN(IF(t.status = '{REVIEW_STATUS}', t.event_time, NULL)) OVER (
+                    PARTITION BY t.case_id ORDER BY t.event_time
+                    ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING
+                ),
+                t.event_time, SECOND
+            ) AS review_seconds
+        FROM changes t
+        JOIN `{PROJECT_ID}.{DATASET_ID}.cases` c USING (case_id)
+    ),
+    pooled_stays AS (
+        SELECT loan_type, status, left_at, next_seconds, review_seconds FROM stays
+        UNION ALL
+        SELECT '{ALL_LOAN_TYPES}', status, left_at, next_seconds, review_seconds FROM stays
+    ),
+    durations AS (
+        SELECT
+            loan_type,
+            status,
+            COUNT(next_seconds) AS samples,
+            APPROX_QUANTILES(next_seconds, 20)[SAFE_OFFSET(10)] AS next_p50,
+            APPROX_QUANTILES(next_seconds, 20)[SAFE_OFFSET(18)] AS next_p90,
+            COUNT(review_seconds) AS review_samples,
+            APPROX_QUANTILES(review_seconds, 20)[SAFE_OFFSET(10)] AS review_p50,
+            APPROX_QUANTILES(review_seconds, 20)[SAFE_OFFSET(18)] AS review_p90,
+            COUNTIF(left_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @rate_days DAY)) AS recent_exits
+        FROM pooled_stays
+        GROUP BY loan_type, status
+    ),
+    open_cases AS (
+        SELECT c.loan_type, COALESCE(s.status, c.status) AS status
+        FROM `{PROJECT_ID}.{DATASET_ID}.cases` c
+        LEFT JOIN `{PROJECT_ID}.{DATASET_ID}.case_status_current` s
+            ON c.case_id = s.case_id
+        WHERE c.created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @lookback_days DAY)
+    ),
+    queue AS (
+        SELECT loan_type, status, COUNT(*) AS queue_depth FROM open_cases GROUP BY loan_type, status
+        UNION ALL
+        SELECT '{ALL_LOAN_TYPES}', status, COUNT(*) FROM open_cases GROUP BY status
+    )
+    SELECT
+        loan_type,
+        status,
+        IFNULL(d.samples, 0) AS samples,
+        d.next_p50,
+        d.next_p90,
+        IFNULL(d.review_samples, 0) AS review_samples,
+        d.review_p50,
+        d.review_p90,
+        IFNULL(d.recent_exits, 0) AS recent_exits,
+        IFNULL(q.queue_depth, 0) AS queue_depth
+    FROM durations d
+    FULL OUTER JOIN queue q USING (loan_type, status)
+    WHERE status NOT IN {CLOSED_STATUSES}
+"""
+
+# Plausible figures for local development (seconds)
+MOCK_ROWS = [
+    {"loan_type": ALL_LOAN_TYPES, "status": "SUBMITTED", "samples": 400, "next_p50": 900, "next_p90": 3600,
+     "review_samples": 350, "review_p50": 5 * 3600, "review_p90": 20 * 3600, "recent_exits": 120, "queue_depth": 1},
+    {"loan_type": ALL_LOAN_TYPES, "status": "AWAITING_DOCUMENTS", "samples": 150, "next_p50": 18 * 3600,
+     "next_p90": 72 * 3600, "review_samples": 120, "review_p50": 26 * 3600, "review_p90": 96 * 3600,
+     "recent_exits": 40, "queue_depth": 5},
+    {"loan_type": ALL_LOAN_TYPES, "status": "EXTRACTING", "samples": 380, "next_p50": 120, "next_p90": 900,
+     "review_samples": 340, "review_p50": 4 * 3600, "review_p90": 18 * 3600, "recent_exits": 110, "queue_depth": 0},
+    {"loan_type": ALL_LOAN_TYPES, "status": "NEEDS_REVIEW", "samples": 300, "next_p50": 4 * 3600,
+     "next_p90": 18 * 3600, "review_samples": 300, "review_p50": 4 * 3600, "review_p90": 18 * 3600,
+     "recent_exits": 90, "queue_depth": 3},
+    {"loan_type": ALL_LOAN_TYPES, "status": REVIEW_STATUS, "samples": 250, "next_p50": 8 * 3600,
+     "next_p90": 24 * 3600, "review_samples": 0, "review_p50": None, "review_p90": None,
+     "recent_exits": 80, "queue_depth": 5},
+]
+
+
+class StageStats:
+    """How long cases of one loan type stay in one status, and how busy that status is now"""
+
+    __slots__ = ("samples", "next_p50", "next_p90", "review_samples", "review_p50", "review_p90",
+                 "recent_exits", "queue_depth")
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row[name])
+
+    def backlog_seconds(self):
+        """Wait beyond the usual stay implied by the current queue depth at the recent exit rate"""
+        if not self.recent_exits or not self.queue_depth or self.next_p50 is None:
+            return 0.0
+        drain_seconds = self.queue_depth / (self.recent_exits / (TIMELINE_RATE_DAYS * 86400))
+        return max(0.0, drain_seconds - self.next_p50)
+
+
+class Estimate:
+    """Remaining time (p50 to p90) until a case reaches its next milestone"""
+
+    __slots__ = ("milestone", "low_seconds", "high_seconds")
+
+    def __init__(self, milestone, low_seconds, high_seconds):
+        self.milestone = milestone
+        self.low_seconds = low_seconds
+        self.high_seconds = high_seconds
+
+
+def query_stats(bq_client):
+    """Rows of per loan type and status statistics from BigQuery"""
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("lookback_days", "INT64", TIMELINE_LOOKBACK_DAYS),
+            bigquery.ScalarQueryParameter("rate_days", "INT64", TIMELINE_RATE_DAYS)
+        ]
+    )
+    return [dict(row.items()) for row in bq_client.query(STATS_QUERY, job_config=job_config).result()]
+
+
+class TimelineStats:
+    """Holds the latest statistics snapshot and refreshes it from a background thread"""
+
+    def __init__(self, loader, refresh_seconds=TIMELINE_REFRESH_SECONDS):
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        # (loan_type, status) -> StageStats; replaced whole on each refresh, never mutated
+        self.stages = {}
+        self.computed_at = None
+        self.stopped = threading.Event()
+        metrics.timeline_stats_age.set_function(
+            lambda: time.time() - self.computed_at.timestamp() if self.computed_at else -1
+        )
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='timeline-stats', daemon=True)
+        self.thread.start()
+        return self
+
+    def refresh(self):
+        started = time.perf_counter()
+        rows = self.loader()
+        self.stages = {(row["loan_type"], row["status"]): StageStats(row) for row in rows}
+        self.computed_at = datetime.now(timezone.utc)
+        logger.info(f"Timeline statistics refreshed: {len(rows)} stages in {time.perf_counter() - started:.1f}s")
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+                delay = self.refresh_seconds
+            except Exception as e:
+                # The previous snapshot keeps serving until a refresh succeeds
+                metrics.timeline_refresh_errors.inc()
+                logger.error(f"Failed to refresh timeline statistics: {e}")
+                delay = TIMELINE_RETRY_SECONDS
+            self.stopped.wait(delay)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _stage(self, loan_type, status, samples_field):
+        stages = self.stages
+        for key in ((loan_type, status), (ALL_LOAN_TYPES, status)):
+            stats = stages.get(key)
+            if stats is not None and getattr(stats, samples_field) >= TIMELINE_MIN_SAMPLES:
+                return stats
+        return None
+
+    def estimate(self, loan_type, status, in_status_seconds=0.0):
+        """
+        Estimate for a case that has been in status for in_status_seconds
+
+        Cases before review are estimated to reach review; cases in review to reach
+        a decision. Returns None for decided cases or while there is too little data.
+        """
+        if status in CLOSED_STATUSES:
+            return None
+
+        if status == REVIEW_STATUS:
+            milestone, samples_field, low_field, high_field = "decision", "samples", "next_p50", "next_p90"
+        else:
+            milestone, samples_field, low_field, high_field = "review", "review_samples", "review_p50", "review_p90"
+
+        stats = self._stage(loan_type, status, samples_field)
+        if stats is None:
+            return None
+
+        backlog = stats.backlog_seconds()
+        low = max(TIMELINE_MIN_ESTIMATE_SECONDS, getattr(stats, low_field) - in_status_seconds + backlog)
+        high = max(low, getattr(stats, high_field) - in_status_seconds + backlog)
+        return Estimate(milestone, low, high)
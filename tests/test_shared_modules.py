@@ -0,0 +1,26 @@
+"""
+Modules shared by the services are copied into each service directory, since
+every Dockerfile builds from its own directory. The copies must not drift.
+"""
+
+import os
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICE_DIRS = ("services/cloud-run-api", "services/dialogflow-webhook", "pipelines/document_ai_worker")
+
+SHARED_MODULES = ("case_projection.py", "structured_logging.py", "gcp_clients.py")
+
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_shared_module_copies_are_identical(module):
+    copies = {}
+    for service_dir in SERVICE_DIRS:
+        with open(os.path.join(REPO_ROOT, service_dir, module), "rb") as f:
+            copies[service_dir] = f.read()
+
+    reference = SERVICE_DIRS[0]
+    drifted = [service_dir for service_dir, source in copies.items() if source != copies[reference]]
+    assert not drifted, f"{module} in {', '.join(drifted)} differs from {reference}/{module}; edit all copies together"